@@ -0,0 +1,22 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .token_cache import token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """DRF token authentication served from the shared in-process token cache"""
+
+    def authenticate_credentials(self, key):
+        try:
+            user = token_cache.load(key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        # DRF exposes the Token as request.auth; rebuild it without a query
+        return (user, Token(key=key, user=user))
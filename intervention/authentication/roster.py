@@ -0,0 +1,62 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+class EmployeeRosterCache:
+    """Process-wide cache of employee/admin users.
+
+    The roster rarely changes but is read on every intervention serialization,
+    so it is kept in memory for ``ttl`` seconds and dropped explicitly by the
+    User save/delete signals (see ``authentication.signals``).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._users = None
+        self._serialized = {}
+        self._expires_at = 0
+        self._generation = 0
+
+    def _load(self):
+        from .models import User
+        with self._lock:
+            generation = self._generation
+        users = tuple(User.objects.filter(user_type__in=['employee', 'admin']).order_by('id'))
+        with self._lock:
+            # Don't publish a roster that was invalidated while it was being loaded
+            if generation == self._generation:
+                self._users = users
+                self._serialized = {}
+                self._expires_at = time.monotonic() + self.ttl
+        return users
+
+    def get(self):
+        """Return the employee/admin users ordered by id"""
+        users = self._users
+        if users is None or time.monotonic() >= self._expires_at:
+            users = self._load()
+        return users
+
+    def serialized(self, serializer_class):
+        """Return ``serializer_class(roster, many=True).data``, computed once per roster"""
+        users = self.get()
+        data = self._serialized.get(serializer_class)
+        if data is None or self._users is not users:
+            data = serializer_class(users, many=True).data
+            with self._lock:
+                if self._users is users:
+                    self._serialized[serializer_class] = data
+        return data
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._users = None
+            self._serialized = {}
+            self._expires_at = 0
+
+
+roster_cache = EmployeeRosterCache(ttl=getattr(settings, 'EMPLOYEE_ROSTER_CACHE_TTL', 300))
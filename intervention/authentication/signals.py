@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .models import User
+from .roster import roster_cache
+from .token_cache import token_cache
+
+# Saves that only touch these fields can't change the roster (e.g. login stamps last_login)
+ROSTER_IRRELEVANT_FIELDS = frozenset({'last_login', 'password'})
+
+
+@receiver(post_save, sender=User)
+def invalidate_employee_roster_on_save(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= ROSTER_IRRELEVANT_FIELDS:
+        return
+    roster_cache.invalidate()
+
+
+@receiver(post_delete, sender=User)
+def invalidate_employee_roster_on_delete(sender, **kwargs):
+    roster_cache.invalidate()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate_key(instance.key)
@@ -1,3 +1,91 @@
 from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .models import User
+from .roster import roster_cache
+from .token_cache import token_cache
+
+
+class EmployeeRosterCacheTests(TestCase):
+    def setUp(self):
+        roster_cache.invalidate()
+        self.employee = User.objects.create_user('employee', 'employee@example.com', 'pw', user_type='employee')
+        User.objects.create_user('client', 'client@example.com', 'pw', user_type='client')
+
+    def test_roster_is_loaded_once(self):
+        self.assertEqual(list(roster_cache.get()), [self.employee])
+        with self.assertNumQueries(0):
+            roster_cache.get()
+
+    def test_user_changes_invalidate_the_roster(self):
+        roster_cache.get()
+        admin = User.objects.create_user('admin', 'admin@example.com', 'pw', user_type='admin')
+        self.assertEqual(list(roster_cache.get()), [self.employee, admin])
+
+        admin.delete()
+        self.assertEqual(list(roster_cache.get()), [self.employee])
+
+    def test_login_stamps_keep_the_roster(self):
+        users = roster_cache.get()
+        self.employee.save(update_fields=['last_login'])
+        self.assertIs(roster_cache.get(), users)
+
+    def test_serialized_roster_is_reused(self):
+        from intervention_app.serializers import UserSerializer
+        data = roster_cache.serialized(UserSerializer)
+        self.assertIs(roster_cache.serialized(UserSerializer), data)
+        self.assertEqual([user['username'] for user in data], ['employee'])
+
+
+class TokenUserCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user('client', 'client@example.com', 'pw', user_type='client')
+        self.token = Token.objects.create(user=self.user)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookups_are_cached(self):
+        self.assertEqual(self.api.get('/api/interventions/').status_code, 200)
+        with self.assertNumQueries(1):  # the interventions themselves
+            self.assertEqual(self.api.get('/api/interventions/').status_code, 200)
+
+    def test_deleted_token_is_rejected(self):
+        self.api.get('/api/interventions/')
+        self.token.delete()
+        self.assertEqual(self.api.get('/api/interventions/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.api.get('/api/interventions/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.get('/api/interventions/').status_code, 401)
+
+    def test_cached_copies_are_independent(self):
+        token_cache.load(self.token.key).first_name = 'Changed'
+        self.assertEqual(token_cache.load(self.token.key).first_name, '')
+
+    def test_load_racing_an_invalidation_is_not_cached(self):
+        # A load that read the database before the token was invalidated
+        generation = token_cache.generation()
+        token_cache.invalidate_key(self.token.key)
+        token_cache.set(self.token.key, self.user, generation)
+        self.assertIsNone(token_cache.get(self.token.key))
+
+        token_cache.set(self.token.key, self.user, token_cache.generation())
+        self.assertEqual(token_cache.get(self.token.key), self.user)
+
+
+class LoginLoggingTests(TestCase):
+    def test_logins_are_logged_without_credentials(self):
+        user = User.objects.create_user('client', 'client@example.com', 'secret-password', user_type='client')
+        with self.assertLogs('authentication.views', 'INFO') as logs:
+            for password, status in (('secret-password', 200), ('wrong-password', 401)):
+                response = self.client.post('/api/auth/login', {'username': 'client', 'password': password})
+                self.assertEqual(response.status_code, status)
+
+        self.assertEqual([entry.getMessage() for entry in logs.records], ['Login succeeded', 'Login failed'])
+        self.assertEqual(logs.records[0].user_id, user.id)
+        for entry in logs.records:
+            self.assertNotIn('-password', str(vars(entry)))
@@ -0,0 +1,106 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TokenUserCache:
+    """Bounded in-process LRU cache mapping token keys to users.
+
+    Shared by ``chat_consumer.middleware.TokenAuthMiddleware`` and
+    ``authentication.authentication.CachedTokenAuthentication``. Entries expire
+    after ``ttl`` seconds and are dropped by the Token/User signals in
+    ``authentication.signals``. Callers always get their own copy of the user.
+
+    The cache is per process: the signals only reach the process that made the
+    change, so with several workers a deleted token or deactivated user stays
+    valid on the other workers for at most ``ttl`` seconds (``TOKEN_CACHE_TTL``).
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # token key -> (user, expires_at)
+        self._keys_by_user = {}  # user id -> set of token keys
+        self._generation = 0  # bumped by every invalidation
+
+    def get(self, key):
+        """Return a cached user for ``key``, or ``None`` on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        return copy.copy(user)
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def set(self, key, user, generation=None):
+        """Cache ``user`` for ``key``; with the ``generation()`` read before the user was loaded,
+        nothing is cached if an invalidation happened since"""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def load(self, key):
+        """Return the user for ``key``, hitting the database on a miss.
+
+        Raises ``Token.DoesNotExist`` for unknown keys.
+        """
+        user = self.get(key)
+        if user is None:
+            from rest_framework.authtoken.models import Token
+            generation = self.generation()
+            user = Token.objects.select_related('user').get(key=key).user
+            # Don't put back a user whose token was invalidated while it was being loaded
+            self.set(key, user, generation)
+            user = copy.copy(user)
+        return user
+
+    def invalidate_key(self, key):
+        with self._lock:
+            self._generation += 1
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._generation += 1
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[0].pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[0].pk]
+
+
+token_cache = TokenUserCache(
+    max_size=getattr(settings, 'TOKEN_CACHE_MAX_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 300),
+)
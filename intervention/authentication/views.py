@@ -6,6 +6,10 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from .models import User
 from .serializer import UserSerializer
+from .roster import roster_cache
+import logging
+
+logger = logging.getLogger(__name__)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -32,16 +36,16 @@ def register(request):
 def login(request):
     username = request.data.get('username')
     password = request.data.get('password')
-    print(username, password)
     user = authenticate(username=username, password=password)
     if user:
-        print(user)
+        logger.info("Login succeeded", extra={'user_id': user.id})
         # Get or create token for the user
         token, created = Token.objects.get_or_create(user=user)
         return Response({
             'user': UserSerializer(user).data,
             'token': token.key
         })
+    logger.info("Login failed", extra={'username': username})
     return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
 
@@ -49,5 +53,4 @@ def login(request):
 @permission_classes([IsAuthenticated])
 def employees(request):
     """Return list of employees/admins for assignment"""
-    qs = User.objects.filter(user_type__in=['employee', 'admin']).order_by('id')
-    return Response(UserSerializer(qs, many=True).data)
\ No newline at end of file
+    return Response(roster_cache.serialized(UserSerializer))
\ No newline at end of file
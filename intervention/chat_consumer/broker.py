@@ -0,0 +1,240 @@
+"""Local message broker for ``chat_consumer.layers.UnixSocketChannelLayer``.
+
+Every ASGI worker on the host keeps one connection to the broker over a Unix
+domain socket. The broker only knows which worker owns which channel and which
+workers have members in which group; the channel queues themselves (capacity,
+expiry, group expiry) stay inside each worker's layer. A ``group_send`` is
+therefore forwarded as a single frame per remote worker, not per channel.
+
+Frames are a 4-byte big-endian length followed by a msgpack array:
+
+    client -> broker
+        ["hello", owner, listen]        identify the worker (owner of ``<owner>!`` channels)
+        ["listen", channel]             receive a general (non-``!``) channel
+        ["send", channel, payload]      payload is the msgpack-encoded message
+        ["gadd", group, channel]
+        ["gdis", group, channel]
+        ["gsend", group, payload, origin]
+        ["flush"]                       drop every membership owned by this worker
+
+    broker -> client
+        ["msg", channel, payload]
+        ["gmsg", group, payload]
+
+Delivery is at-most-once: frames for unknown owners, closed connections or
+workers whose socket buffer is over ``max_buffer`` bytes are dropped.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import struct
+
+import msgpack
+
+from .wire import Frames
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+# msgpack extension type of chat_consumer.wire.Frames, which travel as their payload
+FRAMES_EXT = 1
+
+
+def pack_default(obj):
+    if isinstance(obj, Frames):
+        return msgpack.ExtType(FRAMES_EXT, pack(obj.payload))
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+def unpack_ext(code, data):
+    if code == FRAMES_EXT:
+        return Frames(unpack(data))
+    return msgpack.ExtType(code, data)
+
+
+def pack(obj):
+    return msgpack.packb(obj, use_bin_type=True, default=pack_default)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False, ext_hook=unpack_ext)
+
+
+def encode_frame(*fields):
+    body = pack(list(fields))
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    """Read one frame, returning ``None`` on a clean EOF"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return unpack(await reader.readexactly(size))
+
+
+def channel_owner(channel):
+    """Return the worker id encoded in a specific channel name (``...<owner>!xyz``)"""
+    if '!' not in channel:
+        return None
+    return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+
+class BrokerConnection:
+    def __init__(self, broker, writer):
+        self.broker = broker
+        self.writer = writer
+        self.owner = None
+        self.listening = False
+
+    def push(self, frame):
+        transport = self.writer.transport
+        if transport.is_closing():
+            self.broker.dropped += 1
+            return
+        if transport.get_write_buffer_size() > self.broker.max_buffer:
+            # Slow worker: drop rather than buffer without bound
+            self.broker.dropped += 1
+            return
+        self.writer.write(frame)
+
+
+class ChannelBroker:
+    def __init__(self, path, max_buffer=8 * 1024 * 1024):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.listeners = {}  # owner -> BrokerConnection
+        self.general = {}  # general channel name -> list of BrokerConnection
+        self.groups = {}  # group -> {owner: set(channels)}
+        self.round_robin = {}  # general channel name -> itertools.count
+        self.dropped = 0
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        return self.server
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def handle(self, reader, writer):
+        connection = BrokerConnection(self, writer)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                self.dispatch(connection, frame)
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as exc:
+            logger.warning("Channel broker connection from %s failed: %s", connection.owner, exc)
+        finally:
+            self.forget(connection)
+            writer.close()
+
+    def dispatch(self, connection, frame):
+        kind = frame[0]
+        if kind == 'send':
+            self.route_send(frame[1], frame[2])
+        elif kind == 'gsend':
+            self.route_group_send(frame[1], frame[2], frame[3])
+        elif kind == 'gadd':
+            owner = channel_owner(frame[2])
+            if owner is not None:
+                self.groups.setdefault(frame[1], {}).setdefault(owner, set()).add(frame[2])
+        elif kind == 'gdis':
+            self.discard(frame[1], frame[2])
+        elif kind == 'hello':
+            connection.owner = frame[1]
+            if frame[2]:
+                connection.listening = True
+                self.listeners[frame[1]] = connection
+        elif kind == 'listen':
+            self.general.setdefault(frame[1], []).append(connection)
+        elif kind == 'flush':
+            self.drop_memberships(connection.owner)
+        else:
+            logger.warning("Channel broker ignoring unknown frame %r", kind)
+
+    def route_send(self, channel, payload):
+        owner = channel_owner(channel)
+        if owner is not None:
+            connection = self.listeners.get(owner)
+        else:
+            candidates = self.general.get(channel)
+            connection = None
+            if candidates:
+                counter = self.round_robin.setdefault(channel, itertools.count())
+                connection = candidates[next(counter) % len(candidates)]
+        if connection is None:
+            self.dropped += 1
+            return
+        connection.push(encode_frame('msg', channel, payload))
+
+    def route_group_send(self, group, payload, origin):
+        members = self.groups.get(group)
+        if not members:
+            return
+        frame = None
+        for owner in members:
+            if owner == origin:
+                continue
+            connection = self.listeners.get(owner)
+            if connection is None:
+                continue
+            if frame is None:
+                frame = encode_frame('gmsg', group, payload)
+            connection.push(frame)
+
+    def discard(self, group, channel):
+        members = self.groups.get(group)
+        if not members:
+            return
+        owner = channel_owner(channel)
+        channels = members.get(owner)
+        if channels is None:
+            return
+        channels.discard(channel)
+        if not channels:
+            del members[owner]
+        if not members:
+            del self.groups[group]
+
+    def drop_memberships(self, owner):
+        for group in list(self.groups):
+            members = self.groups[group]
+            members.pop(owner, None)
+            if not members:
+                del self.groups[group]
+
+    def forget(self, connection):
+        if connection.listening and self.listeners.get(connection.owner) is connection:
+            del self.listeners[connection.owner]
+            self.drop_memberships(connection.owner)
+        for channel in list(self.general):
+            candidates = [c for c in self.general[channel] if c is not connection]
+            if candidates:
+                self.general[channel] = candidates
+            else:
+                del self.general[channel]
+                self.round_robin.pop(channel, None)
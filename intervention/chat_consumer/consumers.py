@@ -1,12 +1,29 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from metrics.consumers import ConsumerMetricsMixin
+from metrics.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from intervention_app.models import Intervention, Message
-import json
-from channels.layers import get_channel_layer
-from django.db import models
+import asyncio
+import logging
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from intervention_app import archive, unread
+from .events import chat_message_event, chat_payload, intervention_state_event, notification_event
+from .flow import RateLimitMixin, SendQueueMixin
+from .history import room_histories
+from .presence import room_presence
+from .persistence import get_message_writer, sequence_clock, timestamp_for
+from .wire import WireFormatMixin, decode, encode, history_frame
+
+logger = logging.getLogger(__name__)
 
 class InterventionMixin:
+    # The intervention is loaded once in connect and then kept current through
+    # 'intervention_update' group events, so chat messages never re-read it.
+    intervention = None
+
     @database_sync_to_async
     def get_intervention(self):
         try:
@@ -14,127 +31,289 @@ class InterventionMixin:
         except Intervention.DoesNotExist:
             return None
 
-    @database_sync_to_async
-    def save_message(self, content):
-        intervention = Intervention.objects.get(id=self.room_name)
+    def build_message(self, content):
+        """Return an unsaved message stamped with the next sequence id"""
         # Set message type based on user type
         if self.user.is_employee():
             message_type = 'employee_message'
         else:
             message_type = 'client_message'
-            
-        return Message.objects.create(
-            intervention=intervention,
+
+        _, timestamp = sequence_clock.next()
+        return Message(
+            intervention=self.intervention,
             user=self.user,
             content=content,
-            message_type=message_type
+            message_type=message_type,
+            timestamp=timestamp
         )
 
     @database_sync_to_async
+    def save_message(self, content):
+        message = self.build_message(content)
+        # One thread hop and one commit: the message with its unread counters and search entry
+        with transaction.atomic():
+            message.save()
+        return message
+
+    @database_sync_to_async
+    def get_messages_since(self, last_seq, limit):
+        """Chat payloads of the (at most ``limit`` latest) stored messages after ``last_seq``,
+        and whether older ones were left out"""
+        since = timestamp_for(last_seq)
+        messages = list(
+            Message.objects.filter(intervention_id=self.intervention.id, timestamp__gt=since)
+            .select_related('user')
+            .order_by('-timestamp', '-id')[:limit + 1]
+        )
+        if len(messages) <= limit:
+            # Archived messages are older than the hot ones. Ids are positive, so
+            # the bound holds every message stamped after ``since``
+            after = (timestamp_for(last_seq + 1), 0)
+            messages.extend(archive.archived_messages(
+                self.intervention.id, [('gt', after)], descending=True, limit=limit + 1 - len(messages)
+            ))
+        return [chat_payload(message) for message in reversed(messages[:limit])], len(messages) > limit
+
     def get_room_participant_user_ids_excluding_sender(self):
-        try:
-            intervention = Intervention.objects.get(id=self.room_name)
-            # Include both creator and assigned employee
-            participant_ids = {intervention.created_by_id}
-            if intervention.assigned_to_id:
-                participant_ids.add(intervention.assigned_to_id)
-            
-            # Remove current sender from recipients
-            if self.user and self.user.id in participant_ids:
-                participant_ids.discard(self.user.id)
-                
-            return list(participant_ids)
-        except Intervention.DoesNotExist:
+        if self.intervention is None:
             return []
+        # Include both creator and assigned employee
+        participant_ids = {self.intervention.created_by_id}
+        if self.intervention.assigned_to_id:
+            participant_ids.add(self.intervention.assigned_to_id)
+
+        # Remove current sender from recipients
+        if self.user and self.user.id in participant_ids:
+            participant_ids.discard(self.user.id)
+
+        return list(participant_ids)
 
-class ChatConsumer(AsyncWebsocketConsumer, InterventionMixin):
     @database_sync_to_async
+    def end_chat(self):
+        # Closes the intervention as well
+        self.intervention.end_chat_by_employee()
+
+    @database_sync_to_async
+    def mark_read(self, up_to):
+        return unread.mark_read(self.user, self.intervention.id, up_to)
+
+    @database_sync_to_async
+    def get_last_message_id_through(self, seq):
+        """Id of the latest stored message with sequence id ``seq`` or lower"""
+        return (
+            Message.objects
+            .filter(intervention_id=self.intervention.id, timestamp__lte=timestamp_for(seq))
+            .aggregate(last_id=Max('id'))['last_id']
+        )
+
+    @database_sync_to_async
+    def save_rating(self, intervention_id, rating):
+        # A real save (not a queryset update) so the dashboard stats see the rating
+        intervention = Intervention.objects.get(id=intervention_id)
+        intervention.chat_rating = rating
+        intervention.save(update_fields=['chat_rating', 'updated_at'])
+        if self.intervention is not None and self.intervention.id == intervention_id:
+            self.intervention.chat_rating = intervention.chat_rating
+
+    async def intervention_update(self, event):
+        """Apply an intervention state change broadcast to the room"""
+        if self.intervention is None:
+            return
+        self.intervention.title = event['title']
+        self.intervention.status = event['status']
+        self.intervention.assigned_to_id = event['assigned_to_id']
+        self.intervention.created_by_id = event['created_by_id']
+        self.intervention.chat_rating = event['chat_rating']
+
+class ChatConsumer(ConsumerMetricsMixin, RateLimitMixin, SendQueueMixin, WireFormatMixin, AsyncWebsocketConsumer,
+                   InterventionMixin):
+    # This room's recent-message buffer, once the consumer joined the room group
+    history = None
+    # Highest sequence id sent in the reconnect replay; live copies of those are skipped
+    replayed_through = None
+    # This room's presence state, once the consumer joined the room group
+    presence = None
+
     def can_access_intervention(self):
-        try:
-            intervention = Intervention.objects.get(id=self.room_name)
-            # Allow only the creator or assigned employee/admin to access
-            if not self.user.is_authenticated:
-                return False
-            
-            # Check if user is admin or employee
-            if self.user.user_type in ['admin', 'employee']:
-                return True
-                
-            # For clients, check if they created the intervention
-            allowed_ids = [intervention.created_by_id]
-            if intervention.assigned_to_id:
-                allowed_ids.append(intervention.assigned_to_id)
-            return self.user.id in allowed_ids
-        except Intervention.DoesNotExist:
+        if self.intervention is None:
             return False
-        
+        # Allow only the creator or assigned employee/admin to access
+        if not self.user.is_authenticated:
+            return False
+
+        # Check if user is admin or employee
+        if self.user.user_type in ['admin', 'employee']:
+            return True
+
+        # For clients, check if they created the intervention
+        allowed_ids = [self.intervention.created_by_id]
+        if self.intervention.assigned_to_id:
+            allowed_ids.append(self.intervention.assigned_to_id)
+        return self.user.id in allowed_ids
+
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = f"chat_{self.room_name}"
-        
+
         # Get the user from the scope
         self.user = self.scope.get('user', AnonymousUser())
-        print(f"WebSocket connect - User: {self.user}, Room: {self.room_name}")
-        
+        logger.debug("WebSocket connect", extra={'user_id': self.user.id, 'room': self.room_name})
+
         # Check if intervention exists and user has access
-        if not await self.can_access_intervention():
-            print(f"WebSocket connect - Access denied for user {self.user} to room {self.room_name}")
+        if self.user.is_authenticated:
+            self.intervention = await self.get_intervention()
+        if not self.can_access_intervention():
+            logger.info("WebSocket connect denied", extra={'user_id': self.user.id, 'room': self.room_name})
             await self.close()
             return
-        
+
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
-        
+        self.history = room_histories.join(self.room_group_name, getattr(settings, 'CHAT_HISTORY_SIZE', 200))
+        await self.accept_with_wire_format()
+        self.presence = room_presence.join(
+            self.room_group_name, self.user, self.channel_layer,
+            getattr(settings, 'CHAT_PRESENCE_WINDOW_MS', 500) / 1000,
+            getattr(settings, 'CHAT_TYPING_TIMEOUT_MS', 6000) / 1000,
+        )
+
         # Send welcome message
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'system',
             'message': f'Connected to intervention #{self.room_name}',
             'user': 'System'
-        }))
+        })
+
+        last_seq = self.get_last_seq()
+        if last_seq is not None:
+            await self.replay(last_seq)
+
+    def get_last_seq(self):
+        """The ``last_seq`` query parameter of a reconnecting client, if valid"""
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get('last_seq')
+        try:
+            return int(values[0]) if values else None
+        except ValueError:
+            return None
+
+    async def replay(self, last_seq):
+        """Send the messages after ``last_seq`` in one 'history' frame, from the ring
+        buffer when it reaches back far enough and from the database otherwise"""
+        buffered = self.history.since(last_seq)
+        if buffered is not None:
+            frames = [frames[self.wire_format] for frames in buffered]
+            truncated = False
+            if buffered:
+                self.replayed_through = max(sequence for sequence, _ in self.history.keys)
+        else:
+            writer = get_message_writer()
+            if writer is not None:
+                # Messages still queued for the database are part of the gap
+                await writer.flush()
+            payloads, truncated = await self.get_messages_since(
+                last_seq, getattr(settings, 'CHAT_HISTORY_REPLAY_LIMIT', 500)
+            )
+            frames = [encode(payload, self.wire_format) for payload in payloads]
+            if payloads:
+                self.replayed_through = payloads[-1]['seq']
+        await self.send_frame(history_frame(frames, self.wire_format, truncated))
 
     async def disconnect(self, close_code):
+        if self.history is not None:
+            room_histories.leave(self.room_group_name)
+            self.history = None
+        if self.presence is not None:
+            room_presence.leave(self.room_group_name, self.user)
+            self.presence = None
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        writer = get_message_writer()
+        if writer is not None:
+            # Make sure what this client sent is stored before it can reload history
+            await writer.flush()
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = decode(text_data, bytes_data)
         message_content = data.get('message', '').strip()
 
-        # Get intervention instance
-        intervention = await self.get_intervention()
+        intervention = self.intervention
 
-        # Prevent sending messages if intervention is closed
-        if intervention and getattr(intervention, 'status', None) == 'closed':
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Chat is closed. No more messages can be sent.'
-            }))
+        # The client read everything up to a ping (see flow.SendQueueMixin)
+        if data.get('action') == 'pong':
+            self.acknowledge(data.get('id'))
+            return
+
+        # Typing indicators are ephemeral: in-memory state, announced with the room's presence
+        if data.get('action') == 'typing':
+            if self.presence is not None and getattr(intervention, 'status', None) != 'closed':
+                self.presence.set_typing(self.user, bool(data.get('typing', True)))
             return
 
         # Handle client rating after chat closed
         if intervention and intervention.status == 'closed' and self.user.user_type == 'client' and data.get('action') == 'rate_chat':
-            rating = data.get('rating')
+            try:
+                rating = int(data.get('rating'))
+            except (TypeError, ValueError):
+                rating = None
             if rating:
                 await self.save_rating(intervention.id, rating)
-            await self.send(text_data=json.dumps({
+                await self.channel_layer.group_send(self.room_group_name, intervention_state_event(intervention))
+            await self.send_payload({
                 'type': 'system',
                 'message': f'Thank you for rating this chat: {rating} stars.'
-            }))
+            })
+            return
+
+        # Mark messages read up to a message id, or a chat frame's seq (allowed on closed chats too)
+        if intervention and data.get('action') == 'mark_read':
+            by_seq = data.get('up_to_seq') is not None
+            try:
+                up_to = int(data.get('up_to_seq') if by_seq else data.get('up_to'))
+            except (TypeError, ValueError):
+                await self.send_payload({
+                    'type': 'error',
+                    'message': 'up_to must be a message id, or up_to_seq a sequence id.'
+                })
+                return
+            if by_seq:
+                writer = get_message_writer()
+                if writer is not None:
+                    # Write-behind messages up to that seq have to be stored to have an id
+                    await writer.flush()
+                up_to = await self.get_last_message_id_through(up_to)
+            marked = await self.mark_read(up_to) if up_to is not None else 0
+            await self.send_payload({
+                'type': 'marked_read',
+                'up_to': up_to,
+                'marked': marked
+            })
+            return
+
+        # Prevent sending messages if intervention is closed
+        if intervention and getattr(intervention, 'status', None) == 'closed':
+            await self.send_payload({
+                'type': 'error',
+                'message': 'Chat is closed. No more messages can be sent.'
+            })
             return
 
         # Employee can end chat by sending a special command
         if self.user.user_type == 'employee' and data.get('action') == 'end_chat':
             await self.end_chat()
+            # Let every consumer in the room see the closed status
+            await self.channel_layer.group_send(self.room_group_name, intervention_state_event(intervention))
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'chat_message',
+                chat_message_event({
+                    'type': 'chat',
+                    'id': None,
                     'message': 'Chat has been ended by the employee.',
                     'user': self.user.username,
                     'timestamp': '',
+                    'seq': None,
                     'user_id': self.user.id,
                     'message_type': 'system_message',
                     'user_type': self.user.user_type
-                }
+                })
             )
             # Close the WebSocket connection for all users in the group
             await self.channel_layer.group_send(
@@ -150,86 +329,93 @@ class ChatConsumer(AsyncWebsocketConsumer, InterventionMixin):
 
         # Allow both client and employee to send messages
         if self.user.user_type not in ['client', 'employee']:
-            print(f"WebSocket receive - Access denied: User {self.user} (type: {self.user.user_type}) cannot send messages")
-            await self.send(text_data=json.dumps({
+            logger.info(
+                "WebSocket message denied",
+                extra={'user_id': self.user.id, 'user_type': self.user.user_type, 'room': self.room_name}
+            )
+            await self.send_payload({
                 'type': 'error',
                 'message': 'Only clients and employees can send messages in the chat.'
-            }))
+            })
             return
 
-        # Save message to database
-        saved_message = await self.save_message(message_content)
+        writer = get_message_writer()
+        if writer is not None:
+            # Write-behind: broadcast now, the writer stores it with the next batch
+            saved_message = self.build_message(message_content)
+            await writer.enqueue(saved_message)
+        else:
+            # Save message to database
+            saved_message = await self.save_message(message_content)
 
-        # Send message to group
+        # Send message to group, encoded once for every member
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': saved_message.content,
-                'user': saved_message.user.username,
-                'timestamp': saved_message.timestamp.isoformat(),
-                'user_id': saved_message.user.id,
-                'message_type': saved_message.message_type,
-                'user_type': saved_message.user.user_type
-            }
+            chat_message_event(chat_payload(saved_message))
         )
 
-        # Also send a lightweight notification event to the recipient user's personal group
-        try:
-            channel_layer = get_channel_layer()
-            # Determine target users in this room besides the sender
-            recipient_user_ids = await self.get_room_participant_user_ids_excluding_sender()
-            for rid in recipient_user_ids:
-                await channel_layer.group_send(
-                    f"user_{rid}",
-                    {
-                        'type': 'notify_event',
-                        'event': 'new_message',
-                        'intervention_id': self.room_name,
-                        'from_user': saved_message.user.username,
-                        'message': saved_message.content,
-                        'timestamp': saved_message.timestamp.isoformat(),
-                        'title': (await self.get_intervention()).title if await self.get_intervention() else f"Intervention {self.room_name}",
-                    }
-                )
-        except Exception as e:
-            # best-effort; don't disrupt chat
-            print(f"Notify event failed: {e}")
+        # Also send a lightweight notification event to each recipient's personal group
+        notification = notification_event({
+            'type': 'notify_event',
+            'event': 'new_message',
+            'intervention_id': self.room_name,
+            'from_user': saved_message.user.username,
+            'message': saved_message.content,
+            'timestamp': saved_message.timestamp.isoformat(),
+            'title': intervention.title if intervention else f"Intervention {self.room_name}",
+        })
+        await self.notify_users(self.get_room_participant_user_ids_excluding_sender(), notification)
+
+    async def notify_users(self, user_ids, event):
+        """Send ``event`` to every user's notification group concurrently (best-effort)"""
+        results = await asyncio.gather(
+            *(self.channel_layer.group_send(f"user_{user_id}", event) for user_id in user_ids),
+            return_exceptions=True
+        )
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                # best-effort; don't disrupt chat
+                logger.warning("Notify event failed", extra={'user_id': user_id, 'error': repr(result)})
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat',
-            'message': event['message'],
-            'user': event['user'],
-            'timestamp': event['timestamp'],
-            'user_id': event['user_id'],
-            'message_type': event['message_type'],
-            'user_type': event['user_type']
-        }))
+        sequence = event.get('seq')
+        if sequence is not None:
+            if self.history is not None:
+                self.history.add(sequence, event.get('worker'), event['frames'])
+            if self.replayed_through is not None and sequence <= self.replayed_through:
+                return
+        await self.send_frames(event['frames'])
+
+    async def presence_update(self, event):
+        if self.presence is not None:
+            await self.send_droppable(self.presence.receive(event))
 
     async def close_chat_channel(self, event):
         # Send a message to the frontend to trigger rating for client, redirect for employee
         user_type = getattr(self.user, 'user_type', None)
         if user_type == 'client':
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'close_chat_channel',
                 'show_rating': True
-            }))
+            })
         else:
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'close_chat_channel',
                 'show_rating': False
-            }))
+            })
         await self.close()
 
-    @database_sync_to_async
-    def get_intervention(self):
-        try:
-            return Intervention.objects.get(id=self.room_name)
-        except Intervention.DoesNotExist:
-            return None
+class UserNotificationConsumer(ConsumerMetricsMixin, SendQueueMixin, WireFormatMixin, AsyncWebsocketConsumer):
+    # Events of these kinds for the same intervention are coalesced within the window
+    COALESCED_EVENTS = {'new_message'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.coalesce_window = getattr(settings, 'NOTIFICATION_COALESCE_MS', 500) / 1000
+        # (event, intervention_id) -> {'event': latest event, 'count': events since last delivery}
+        self.pending_notifications = {}
+        self.flush_tasks = set()
 
-class UserNotificationConsumer(AsyncWebsocketConsumer, InterventionMixin):
     async def connect(self):
         self.user = self.scope.get('user', AnonymousUser())
         if not getattr(self.user, 'is_authenticated', False):
@@ -237,75 +423,42 @@ class UserNotificationConsumer(AsyncWebsocketConsumer, InterventionMixin):
             return
         self.group_name = f"user_{self.user.id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        await self.accept_with_wire_format()
 
     async def disconnect(self, close_code):
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        for task in self.flush_tasks:
+            task.cancel()
 
-    async def notify_event(self, event):
-        await self.send(text_data=json.dumps(event))
-
-    @database_sync_to_async
-    def get_room_participant_user_ids_excluding_sender(self):
-        try:
-            intervention = Intervention.objects.get(id=self.room_name)
-            # Include both creator and assigned employee
-            participant_ids = {intervention.created_by_id}
-            if intervention.assigned_to_id:
-                participant_ids.add(intervention.assigned_to_id)
-            
-            # Remove current sender from recipients
-            if self.user and self.user.id in participant_ids:
-                participant_ids.discard(self.user.id)
-                
-            return list(participant_ids)
-        except Intervention.DoesNotExist:
-            return []
+    async def receive(self, text_data=None, bytes_data=None):
+        data = decode(text_data, bytes_data)
+        if data.get('action') == 'pong':
+            self.acknowledge(data.get('id'))
 
-    @database_sync_to_async
-    def can_access_intervention(self):
-        try:
-            intervention = Intervention.objects.get(id=self.room_name)
-            # For now, allow any authenticated user to access any intervention
-            # You can add more specific access control here
-            return self.user.is_authenticated
-        except Intervention.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def save_message(self, content):
-        intervention = Intervention.objects.get(id=self.room_name)
-        # Set message type based on user type
-        if self.user.is_employee():
-            message_type = 'employee_message'
-        else:
-            message_type = 'client_message'
-            
-        return Message.objects.create(
-            intervention=intervention,
-            user=self.user,
-            content=content,
-            message_type=message_type
-        )
+    async def notify_event(self, event):
+        if event.get('event') not in self.COALESCED_EVENTS or self.coalesce_window <= 0:
+            await self.send_frames(event['frames'])
+            return
 
-    @database_sync_to_async
-    def end_chat(self):
-        intervention = Intervention.objects.get(id=self.room_name)
-        intervention.end_chat_by_employee()
-        # Mark intervention as closed after chat ends
-        intervention.status = 'closed'
-        intervention.save()
+        key = (event['event'], event.get('intervention_id'))
+        pending = self.pending_notifications.get(key)
+        if pending is not None:
+            # Inside the window: fold into the summary sent when it closes
+            pending['event'] = event
+            pending['count'] += 1
+            return
 
-    @database_sync_to_async
-    def get_intervention(self):
-        try:
-            return Intervention.objects.get(id=self.room_name)
-        except Intervention.DoesNotExist:
-            return None
+        # First event of a burst goes out right away and opens the window
+        self.pending_notifications[key] = {'event': None, 'count': 0}
+        task = asyncio.create_task(self.flush_notifications(key))
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+        await self.send_frames(event['frames'])
 
-    @database_sync_to_async
-    def save_rating(self, intervention_id, rating):
-        intervention = Intervention.objects.get(id=intervention_id)
-        intervention.chat_rating = rating
-        intervention.save()
+    async def flush_notifications(self, key):
+        await asyncio.sleep(self.coalesce_window)
+        pending = self.pending_notifications.pop(key, None)
+        if pending and pending['count']:
+            payload = pending['event']['frames'].payload
+            await self.send_payload({**payload, 'count': pending['count']})
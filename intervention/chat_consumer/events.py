@@ -0,0 +1,84 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .persistence import sequence_clock, sequence_for
+from .wire import frames_for
+
+
+def intervention_state_event(intervention):
+    """Group event carrying the intervention fields chat consumers keep cached"""
+    return {
+        'type': 'intervention_update',
+        'intervention_id': intervention.id,
+        'title': intervention.title,
+        'status': intervention.status,
+        'assigned_to_id': intervention.assigned_to_id,
+        'created_by_id': intervention.created_by_id,
+        'chat_rating': intervention.chat_rating,
+    }
+
+
+def chat_payload(message):
+    """The frame a chat ``Message`` is delivered as (its user must be loaded).
+
+    ``id`` is None while a write-behind message waits for the database; ``seq``
+    works as a mark_read watermark either way.
+    """
+    return {
+        'type': 'chat',
+        'id': message.id,
+        'message': message.content,
+        'user': message.user.username,
+        'timestamp': message.timestamp.isoformat(),
+        'seq': sequence_for(message.timestamp),
+        'user_id': message.user.id,
+        'message_type': message.message_type,
+        'user_type': message.user.user_type
+    }
+
+
+def chat_message_event(payload):
+    """Room event delivering ``payload`` to every member, encoded once for all of them"""
+    return {
+        'type': 'chat_message',
+        'seq': payload.get('seq'),
+        'worker': sequence_clock.worker,
+        'frames': frames_for(payload),
+    }
+
+
+def notification_event(payload):
+    """Personal-group event for a notification; the encoded frames are its first delivery (count 1)"""
+    return {
+        'type': 'notify_event',
+        'event': payload['event'],
+        'intervention_id': payload['intervention_id'],
+        'frames': frames_for({**payload, 'count': 1}),
+    }
+
+
+def broadcast_intervention_states(interventions):
+    """Refresh the cached interventions of their chat rooms with concurrent group sends"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not interventions:
+        return
+
+    async def send_all():
+        await asyncio.gather(*(
+            channel_layer.group_send(f"chat_{intervention.id}", intervention_state_event(intervention))
+            for intervention in interventions
+        ))
+
+    async_to_sync(send_all)()
+
+
+def broadcast_intervention_state(intervention):
+    """Refresh the cached intervention of every chat consumer in its room (sync callers)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        f"chat_{intervention.id}", intervention_state_event(intervention)
+    )
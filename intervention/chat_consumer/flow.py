@@ -0,0 +1,272 @@
+"""Flow control for WebSocket consumers: inbound rate limits and bounded send queues.
+
+``RateLimitMixin`` drops incoming frames beyond a token bucket per connection
+and one per user (shared by the user's connections in this process), with
+limits per ``user_type`` from ``CHAT_RATE_LIMITS`` (``None`` lifts a limit).
+Throttled frames are discarded before they are decoded. A client that keeps
+flooding is disconnected.
+
+``SendQueueMixin`` hands outgoing frames to a per-connection writer task
+through a queue of ``CHAT_SEND_QUEUE_SIZE`` frames. Once the queue is half
+full the connection is lagging and droppable frames (ones a later frame
+supersedes, like presence) are skipped. When it is full the connection is
+evicted.
+
+The queue only fills while the server's ``send`` is slower than the frames
+produced for the connection. Servers whose ``send`` waits for the socket to
+drain (uvicorn with websockets) make that a slow-reader signal. Daphne's
+``send`` returns once Twisted has buffered the frame, whether or not the
+client reads it: there the queue bounds in-process bursts, and the backlog
+of a client that stops reading grows in Daphne's transport buffer instead.
+
+What the client has actually read is measured with acknowledgements. Once
+frames flow, a ``{'type': 'ping', 'id': n}`` frame is queued every
+``CHAT_PING_INTERVAL_MS``; the client answers ``{'action': 'pong', 'id': n}``
+once it has read it, which acknowledges every earlier frame too. The age of
+the oldest unanswered ping is the connection's lag, whatever the server
+buffers: past half of ``CHAT_MAX_ACK_LAG_MS`` the connection counts as
+lagging, past all of it it is evicted. Clients that never answered a ping
+are not held to it.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+
+from metrics.instruments import WEBSOCKET_DROPPED_FRAMES, WEBSOCKET_EVICTIONS, WEBSOCKET_THROTTLED
+
+DEFAULT_RATE_LIMITS = {
+    'connection': (5, 10),
+    'user': (10, 20),
+}
+
+# Close codes (4000-4999 are reserved for applications)
+CLOSE_THROTTLED = 4029
+CLOSE_SLOW_CONSUMER = 4008
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def retry_after(self):
+        """Seconds until a token is available"""
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate else None
+
+
+class UserBuckets:
+    """Per-user token buckets, kept while the user has a connection in this process"""
+
+    def __init__(self):
+        self.buckets = {}
+
+    def acquire(self, user_id, rate, burst):
+        entry = self.buckets.get(user_id)
+        if entry is None:
+            entry = self.buckets[user_id] = [TokenBucket(rate, burst), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, user_id):
+        entry = self.buckets.get(user_id)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self.buckets[user_id]
+
+
+user_buckets = UserBuckets()
+
+
+def rate_limits(user_type):
+    limits = getattr(settings, 'CHAT_RATE_LIMITS', {})
+    return {**DEFAULT_RATE_LIMITS, **limits.get('default', {}), **limits.get(user_type, {})}
+
+
+class RateLimitMixin:
+    """Drop incoming frames beyond the connection's and the user's token buckets.
+
+    List it before the consumer base class so it wraps ``websocket_receive``.
+    """
+
+    rate_limited = False
+    connection_bucket = None
+    user_bucket = None
+    throttled_streak = 0
+
+    def start_rate_limits(self):
+        self.rate_limited = True
+        user = self.scope.get('user')
+        limits = rate_limits(getattr(user, 'user_type', None))
+        if limits['connection'] is not None:
+            self.connection_bucket = TokenBucket(*limits['connection'])
+        if limits['user'] is not None and getattr(user, 'is_authenticated', False):
+            self.user_bucket = user_buckets.acquire(user.id, *limits['user'])
+
+    async def websocket_receive(self, message):
+        if not self.rate_limited:
+            self.start_rate_limits()
+        limit = None
+        if self.connection_bucket is not None and not self.connection_bucket.take():
+            limit, bucket = 'connection', self.connection_bucket
+        elif self.user_bucket is not None and not self.user_bucket.take():
+            if self.connection_bucket is not None:
+                self.connection_bucket.give_back()
+            limit, bucket = 'user', self.user_bucket
+        if limit is None:
+            self.throttled_streak = 0
+            await super().websocket_receive(message)
+            return
+
+        WEBSOCKET_THROTTLED.labels(type(self).__name__, limit).inc()
+        self.throttled_streak += 1
+        if self.throttled_streak == 1:
+            # Tell the client once per burst, not for every dropped frame
+            await self.send_payload({
+                'type': 'error',
+                'message': 'Too many messages, slow down.',
+                'retry_after': bucket.retry_after(),
+            })
+        elif self.throttled_streak == getattr(settings, 'CHAT_THROTTLE_CLOSE_AFTER', 200):
+            WEBSOCKET_EVICTIONS.labels(type(self).__name__, 'throttled').inc()
+            await self.close(CLOSE_THROTTLED)
+
+    async def websocket_disconnect(self, message):
+        if self.user_bucket is not None:
+            user_buckets.release(self.scope['user'].id)
+            self.user_bucket = None
+        await super().websocket_disconnect(message)
+
+
+class SendQueueMixin:
+    """Send frames through a bounded queue drained by a writer task.
+
+    List it before ``WireFormatMixin`` so it takes over ``send_frame``.
+    """
+
+    send_queue = None
+    send_task = None
+    evicted = False
+    # Unanswered ping ids -> when they were queued, oldest first
+    pings = None
+    ping_task = None
+    acknowledged = False
+
+    async def send_frame(self, frame):
+        if self.evicted:
+            return
+        if self.send_queue is None:
+            self.send_queue = asyncio.Queue(getattr(settings, 'CHAT_SEND_QUEUE_SIZE', 256))
+            self.send_task = asyncio.create_task(self.drain_send_queue())
+            self.start_pings()
+        try:
+            self.send_queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            await self.evict()
+
+    def lagging(self):
+        if self.send_queue is not None and self.send_queue.qsize() * 2 >= self.send_queue.maxsize:
+            return True
+        return self.ack_lag() * 2 >= getattr(settings, 'CHAT_MAX_ACK_LAG_MS', 30000) / 1000
+
+    async def send_droppable(self, frames):
+        """Send pre-encoded frames that a later frame supersedes; lagging connections skip them"""
+        if self.lagging():
+            WEBSOCKET_DROPPED_FRAMES.labels(type(self).__name__).inc()
+            return
+        await self.send_frames(frames)
+
+    def start_pings(self):
+        interval = getattr(settings, 'CHAT_PING_INTERVAL_MS', 5000)
+        if interval:
+            self.pings = {}
+            self.ping_task = asyncio.create_task(self.send_pings(interval / 1000))
+
+    async def send_pings(self, interval):
+        max_lag = getattr(settings, 'CHAT_MAX_ACK_LAG_MS', 30000) / 1000
+        ping_id = 0
+        while not self.evicted:
+            await asyncio.sleep(interval)
+            if self.ack_lag() > max_lag:
+                await self.evict('ack_lag')
+                return
+            if not self.acknowledged:
+                # A client that doesn't answer pings only needs the latest one
+                self.pings.clear()
+            ping_id += 1
+            self.pings[ping_id] = time.monotonic()
+            await self.send_payload({'type': 'ping', 'id': ping_id})
+
+    def acknowledge(self, ping_id):
+        """Handle a client's pong: it has read every frame up to ping ``ping_id``"""
+        if not self.pings or not isinstance(ping_id, int):
+            return
+        self.acknowledged = True
+        for answered in [pending for pending in self.pings if pending <= ping_id]:
+            del self.pings[answered]
+
+    def ack_lag(self):
+        """Seconds the oldest unanswered ping has waited, for a client that answers pings"""
+        if not self.acknowledged or not self.pings:
+            return 0.0
+        return time.monotonic() - next(iter(self.pings.values()))
+
+    async def drain_send_queue(self):
+        while True:
+            frame = await self.send_queue.get()
+            try:
+                await super().send_frame(frame)
+            finally:
+                self.send_queue.task_done()
+
+    async def evict(self, reason='slow_consumer'):
+        """Close a connection whose client doesn't keep up, dropping what it hasn't read"""
+        WEBSOCKET_EVICTIONS.labels(type(self).__name__, reason).inc()
+        self.evicted = True
+        self.stop_send_queue()
+        await self.close(CLOSE_SLOW_CONSUMER)
+
+    def stop_send_queue(self):
+        if self.send_task is not None:
+            self.send_task.cancel()
+            self.send_task = None
+        if self.ping_task is not None:
+            # Evicting from the ping task itself: let it finish the close and end
+            if self.ping_task is not asyncio.current_task():
+                self.ping_task.cancel()
+            self.ping_task = None
+
+    async def close(self, code=None, reason=None):
+        if self.send_task is not None:
+            # Let the client read what was sent before the close frame
+            try:
+                await asyncio.wait_for(self.send_queue.join(), getattr(settings, 'CHAT_SEND_CLOSE_TIMEOUT', 1.0))
+            except asyncio.TimeoutError:
+                pass
+            self.stop_send_queue()
+        await super().close(code, reason)
+
+    async def websocket_disconnect(self, message):
+        self.stop_send_queue()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,76 @@
+"""Recent chat messages per room, for replaying what a reconnecting client missed.
+
+Each process keeps the last ``CHAT_HISTORY_SIZE`` chat frames of every room
+that has a member connected to it. A buffer is created when the first local
+member joins the room group and dropped when the last one leaves, so it only
+ever holds messages the group actually delivered here.
+
+A buffer knows its ``watermark``: every message with a greater sequence id is
+(or was, before being evicted) in it. A client resuming from ``last_seq`` at or
+after the watermark is served from memory; anything older falls back to the
+database. Sequence ids are only unique per worker, so entries are told apart
+by (sequence, worker).
+"""
+from collections import deque
+
+from django.utils import timezone
+
+from .persistence import sequence_for
+
+
+class RoomHistory:
+    """Ring buffer of one room's recent (sequence, worker, frames) entries"""
+
+    def __init__(self, size, watermark):
+        self.entries = deque()
+        self.keys = set()
+        self.size = size
+        self.watermark = watermark
+        self.members = 0
+
+    def add(self, sequence, worker, frames):
+        # Every local member receives the same group event; keep it once
+        key = (sequence, worker)
+        if key in self.keys or self.size <= 0:
+            return
+        if len(self.entries) >= self.size:
+            evicted = self.entries.popleft()
+            self.keys.discard(evicted[:2])
+            self.watermark = max(self.watermark, evicted[0])
+        self.entries.append((sequence, worker, frames))
+        self.keys.add(key)
+
+    def since(self, last_seq):
+        """Frames of the messages after ``last_seq`` in sequence order, or None
+        when the buffer doesn't reach back that far"""
+        if last_seq < self.watermark:
+            return None
+        missed = sorted((entry for entry in self.entries if entry[0] > last_seq), key=lambda entry: entry[:2])
+        return [frames for _, _, frames in missed]
+
+
+class HistoryRegistry:
+    """The ring buffers of the rooms with members connected to this process"""
+
+    def __init__(self):
+        self.rooms = {}
+
+    def join(self, room, size):
+        """Count a member in, after it joined the room group, and return the room's buffer"""
+        history = self.rooms.get(room)
+        if history is None:
+            # Messages sequenced from now on reach this process through the group
+            history = self.rooms[room] = RoomHistory(size, sequence_for(timezone.now()))
+        history.members += 1
+        return history
+
+    def leave(self, room):
+        history = self.rooms.get(room)
+        if history is None:
+            return
+        history.members -= 1
+        if history.members <= 0:
+            del self.rooms[room]
+
+
+room_histories = HistoryRegistry()
@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import random
+import string
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+from .broker import channel_owner, encode_frame, pack, read_frame, unpack
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER_PATH = '/tmp/intervention-channels.sock'
+
+
+class BrokerUnavailable(ConnectionError):
+    """The broker can't be reached and the client is waiting before trying again"""
+
+
+class BrokerClient:
+    """One worker's connection to the channel broker, bound to a single event loop"""
+
+    def __init__(self, layer, listen):
+        self.layer = layer
+        self.listen = listen
+        self.writer = None
+        self.reader_task = None
+        self.closed = False
+        self.lock = asyncio.Lock()
+        self.failures = 0
+        self.retry_at = 0
+        self.reconnect_task = None
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def ensure_connected(self):
+        """Connect to the broker; raises ``OSError`` when it can't be reached.
+
+        After a failed attempt the next one waits for an exponential backoff,
+        and until then this raises ``BrokerUnavailable`` right away.
+        """
+        if self.connected:
+            return
+        async with self.lock:
+            if self.connected:
+                return
+            if time.monotonic() < self.retry_at:
+                raise BrokerUnavailable(f"Channel broker {self.layer.path} is unreachable")
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.layer.path)
+            except OSError as exc:
+                self.failures += 1
+                delay = min(self.layer.reconnect_delay * 2 ** (self.failures - 1), self.layer.max_reconnect_delay)
+                self.retry_at = time.monotonic() + delay
+                logger.warning("Channel broker %s unreachable (%s), retrying in %.1fs", self.layer.path, exc, delay)
+                if self.listen:
+                    self.start_reconnect()
+                raise
+            self.failures = 0
+            self.retry_at = 0
+            if not self.listen:
+                # Publish-only clients often live on a short-lived loop (async_to_sync)
+                # that nobody closes them on: drain() then waits for the buffer to be
+                # empty, so nothing is left behind when the loop goes away
+                writer.transport.set_write_buffer_limits(high=0)
+            writer.write(encode_frame('hello', self.layer.owner, self.listen))
+            if self.listen:
+                # Re-announce everything this worker receives (also after a broker restart)
+                for group, channels in self.layer.groups.items():
+                    for channel in channels:
+                        writer.write(encode_frame('gadd', group, channel))
+                for channel in self.layer.general_channels:
+                    writer.write(encode_frame('listen', channel))
+                self.reader_task = asyncio.get_running_loop().create_task(self.read_loop(reader))
+            self.writer = writer
+            await writer.drain()
+
+    async def write(self, *fields):
+        await self.ensure_connected()
+        writer = self.writer
+        try:
+            writer.write(encode_frame(*fields))
+            await writer.drain()
+        except OSError:
+            # The broker went away; the next write reconnects (listeners also in the background)
+            writer.close()
+            if self.writer is writer:
+                self.writer = None
+            raise
+
+    async def read_loop(self, reader):
+        reconnect = True
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                await self.layer.deliver(frame)
+        except asyncio.CancelledError:
+            # Closing, or the event loop is shutting down
+            reconnect = False
+            raise
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as exc:
+            logger.warning("Lost channel broker connection: %s", exc)
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            if reconnect:
+                self.start_reconnect()
+
+    def start_reconnect(self):
+        """Keep trying to reconnect in the background, so a listener gets its messages again"""
+        if self.closed or (self.reconnect_task is not None and not self.reconnect_task.done()):
+            return
+        self.reconnect_task = asyncio.get_running_loop().create_task(self.reconnect())
+
+    async def reconnect(self):
+        while not self.closed and not self.connected:
+            await asyncio.sleep(max(self.retry_at - time.monotonic(), self.layer.reconnect_delay))
+            try:
+                await self.ensure_connected()
+            except OSError:
+                pass  # logged by ensure_connected
+
+    async def close(self):
+        """Stop reading and reconnecting, and close the connection once everything
+        written so far has reached the broker"""
+        self.closed = True
+        writer, self.writer = self.writer, None
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if writer is not None:
+            # The transport sends what is still buffered before it closes the socket
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass  # The broker went away first; those frames are lost either way
+
+
+class UnixSocketChannelLayer(InMemoryChannelLayer):
+    """Channel layer that shares groups between workers through ``chat_consumer.broker``.
+
+    Queues, per-channel capacity, message expiry and group expiry are the
+    in-memory layer's, kept per worker. Sends to this worker's own channels
+    stay in-process; everything else is forwarded to the broker, which fans a
+    ``group_send`` out to each other worker with members in the group once.
+    Delivery across workers is at-most-once: messages hitting a full channel,
+    or sent while the broker is unreachable, are dropped (and counted in
+    ``dropped``). Broker outages never reach the consumers: the worker keeps
+    serving its own channels and groups, reconnects with an exponential
+    backoff from ``reconnect_delay`` up to ``max_reconnect_delay`` seconds,
+    and then re-announces its groups and channels.
+
+    The event loop that first creates or receives on a channel becomes the
+    worker's listening loop. Other loops (e.g. ``async_to_sync`` from a
+    management command) get publish-only connections.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path=DEFAULT_BROKER_PATH,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        reconnect_delay=1.0,
+        max_reconnect_delay=30.0,
+        **kwargs,
+    ):
+        super().__init__(
+            expiry=expiry,
+            group_expiry=group_expiry,
+            capacity=capacity,
+            channel_capacity=channel_capacity,
+            **kwargs,
+        )
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.owner = 'unix' + uuid.uuid4().hex[:12]
+        self.general_channels = set()
+        self.dropped = 0
+        self._clients = {}  # event loop -> BrokerClient
+        self._listener_loop = None
+
+    async def _client(self, listen=False):
+        loop = asyncio.get_running_loop()
+        if listen and (self._listener_loop is None or self._listener_loop.is_closed()):
+            self._listener_loop = loop
+        client = self._clients.get(loop)
+        if client is not None and not client.listen and loop is self._listener_loop:
+            # Publish-only connection on what just became the listening loop
+            await client.close()
+            client = None
+        if client is None:
+            for stale in [l for l in self._clients if l.is_closed()]:
+                del self._clients[stale]
+            client = BrokerClient(self, listen=loop is self._listener_loop)
+            self._clients[loop] = client
+        await client.ensure_connected()
+        return client
+
+    async def _write(self, *fields, listen=False):
+        """Send a frame to the broker. Returns False when the broker is unreachable:
+        the frame is lost, and group memberships and listened channels are announced
+        again on reconnect."""
+        try:
+            client = await self._client(listen)
+            await client.write(*fields)
+        except OSError:
+            return False
+        return True
+
+    async def _forward(self, *fields):
+        """Send a message frame to the broker, counting it as dropped when that fails"""
+        if not await self._write(*fields):
+            self.dropped += 1
+
+    def _on_listener_loop(self):
+        return self._listener_loop is asyncio.get_running_loop()
+
+    async def deliver(self, frame):
+        """Hand a frame pushed by the broker to the local queues"""
+        kind, target, payload = frame[0], frame[1], frame[2]
+        message = unpack(payload)
+        if kind == 'gmsg':
+            await super().group_send(target, message)
+        elif kind == 'msg':
+            try:
+                await super().send(target, message)
+            except ChannelFull:
+                self.dropped += 1
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        if channel_owner(channel) == self.owner and self._on_listener_loop():
+            return await super().send(channel, message)
+        await self._forward('send', channel, pack(message))
+
+    async def receive(self, channel):
+        if '!' not in channel and channel not in self.general_channels:
+            self.general_channels.add(channel)
+            await self._write('listen', channel, listen=True)
+        else:
+            await self._listen()
+        return await super().receive(channel)
+
+    async def _listen(self):
+        """Make this loop the listening one and connect it, if the broker is reachable"""
+        try:
+            await self._client(listen=True)
+        except OSError:
+            pass
+
+    async def new_channel(self, prefix='specific.'):
+        await self._listen()
+        return '%s%s!%s' % (
+            prefix,
+            self.owner,
+            ''.join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    # Flush extension
+
+    async def flush(self):
+        await super().flush()
+        self.general_channels = set()
+        client = self._clients.get(asyncio.get_running_loop())
+        if client is not None and client.connected:
+            await self._write('flush')
+
+    async def close(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        await super().group_add(group, channel)
+        await self._write('gadd', group, channel)
+
+    async def group_discard(self, group, channel):
+        await super().group_discard(group, channel)
+        await self._write('gdis', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        origin = None
+        if self._on_listener_loop():
+            # Local members are served directly; the broker skips this worker
+            await super().group_send(group, message)
+            origin = self.owner
+        await self._forward('gsend', group, pack(message), origin)
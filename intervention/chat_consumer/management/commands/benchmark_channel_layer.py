@@ -0,0 +1,163 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_consumer.layers import UnixSocketChannelLayer
+
+GROUP = 'benchmark'
+
+
+async def receive_all(layer, receivers, messages, ready=None, idle_timeout=5.0):
+    """Join ``receivers`` channels to the group and drain ``messages`` on each.
+
+    Returns ``(delivered, time of the last delivery)``.
+    """
+    channels = [await layer.new_channel() for _ in range(receivers)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    if ready is not None:
+        ready()
+
+    async def drain(channel):
+        count, last_received = 0, time.time()
+        while count < messages:
+            try:
+                await asyncio.wait_for(layer.receive(channel), idle_timeout)
+            except asyncio.TimeoutError:
+                break
+            count, last_received = count + 1, time.time()
+        return count, last_received
+
+    results = await asyncio.gather(*(drain(channel) for channel in channels))
+    return sum(count for count, _ in results), max(last for _, last in results)
+
+
+def run_worker(path, receivers, messages, ready_queue, result_queue):
+    """Entry point of a benchmark worker process using the Unix socket layer"""
+    async def main():
+        layer = UnixSocketChannelLayer(path=path, capacity=messages + 1)
+        result = await receive_all(layer, receivers, messages, ready=lambda: ready_queue.put(True))
+        await layer.close()
+        return result
+
+    result_queue.put(asyncio.run(main()))
+
+
+class Command(BaseCommand):
+    help = "Compare group_send throughput of the in-memory and Unix socket channel layers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help="group_send calls per run")
+        parser.add_argument('--receivers', type=int, default=20, help="Channels in the group")
+        parser.add_argument('--workers', type=int, default=2, help="Worker processes for the Unix socket run")
+        parser.add_argument('--path', default=None, help="Broker socket (default: a temporary path)")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        messages, receivers, workers = options['messages'], options['receivers'], options['workers']
+        if receivers < workers:
+            raise CommandError("--receivers must be at least --workers")
+
+        results = [
+            self.report('in-memory (1 process)', *asyncio.run(self.bench_in_memory(messages, receivers)),
+                        messages, receivers),
+            self.report(f'unix socket ({workers} workers)', *self.bench_unix(messages, receivers, workers, options['path']),
+                        messages, receivers),
+        ]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                f"{result['backend']:<28} {result['sends_per_sec']:>10.0f} group_send/s "
+                f"{result['deliveries_per_sec']:>10.0f} deliveries/s "
+                f"({result['delivered']}/{result['expected']} delivered)"
+            )
+
+    def report(self, backend, delivered, elapsed, messages, receivers):
+        return {
+            'backend': backend,
+            'messages': messages,
+            'receivers': receivers,
+            'expected': messages * receivers,
+            'delivered': delivered,
+            'elapsed': elapsed,
+            'sends_per_sec': messages / elapsed if elapsed else 0,
+            'deliveries_per_sec': delivered / elapsed if elapsed else 0,
+        }
+
+    async def bench_in_memory(self, messages, receivers):
+        layer = InMemoryChannelLayer(capacity=messages + 1)
+        ready = asyncio.Event()
+        consumer = asyncio.create_task(receive_all(layer, receivers, messages, ready=ready.set))
+        await ready.wait()
+        started = time.time()
+        for i in range(messages):
+            await layer.group_send(GROUP, {'type': 'benchmark.message', 'seq': i})
+        delivered, finished = await consumer
+        return delivered, finished - started
+
+    def bench_unix(self, messages, receivers, workers, path):
+        tmpdir = None
+        if path is None:
+            tmpdir = tempfile.TemporaryDirectory()
+            path = os.path.join(tmpdir.name, 'broker.sock')
+        broker = subprocess.Popen(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'runchannelbroker', '--path', path],
+            stdout=subprocess.DEVNULL,
+        )
+        context = multiprocessing.get_context('spawn')
+        ready_queue, result_queue = context.Queue(), context.Queue()
+        processes = []
+        try:
+            deadline = time.time() + 10
+            while not os.path.exists(path):
+                if time.time() > deadline:
+                    raise CommandError(f"Channel broker did not start on {path}")
+                time.sleep(0.05)
+
+            for index in range(workers):
+                share = receivers // workers + (1 if index < receivers % workers else 0)
+                process = context.Process(
+                    target=run_worker, args=(path, share, messages, ready_queue, result_queue)
+                )
+                process.start()
+                processes.append(process)
+            for _ in processes:
+                ready_queue.get(timeout=30)
+
+            async def send_all():
+                layer = UnixSocketChannelLayer(path=path)
+                # Become a listener so the broker treats this like a real worker
+                await layer.new_channel()
+                started = time.time()
+                for i in range(messages):
+                    await layer.group_send(GROUP, {'type': 'benchmark.message', 'seq': i})
+                await layer.close()
+                return started
+
+            started = asyncio.run(send_all())
+            delivered, finished = 0, started
+            for _ in processes:
+                count, finished_at = result_queue.get(timeout=60)
+                delivered += count
+                finished = max(finished, finished_at)
+            return delivered, finished - started
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            broker.terminate()
+            broker.wait()
+            if tmpdir is not None:
+                tmpdir.cleanup()
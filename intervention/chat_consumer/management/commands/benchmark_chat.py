@@ -0,0 +1,451 @@
+import asyncio
+import datetime
+import json
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+import uuid
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from authentication.models import User
+from chat_consumer.middleware import TokenAuthMiddleware
+from chat_consumer.persistence import get_message_writer
+from chat_consumer.wire import FORMATS, JSON, decode, encode
+from intervention.routing import websocket_urlpatterns
+from intervention_app.models import Intervention
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    'messages_per_sec': True,
+    'deliveries_per_sec': True,
+    'latency_ms.p50': False,
+    'latency_ms.p95': False,
+    'latency_ms.p99': False,
+    'queries_per_message': False,
+    'memory_per_connection_kb': False,
+}
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def metric(results, name):
+    value = results
+    for part in name.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+class QueryCounter:
+    """Counts SQL queries on every database connection, in any thread"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def start(self):
+        connection_created.connect(self.install)
+        for conn in connections.all(initialized_only=True):
+            self.install(connection=conn)
+
+    def stop(self):
+        connection_created.disconnect(self.install)
+        for conn in connections.all(initialized_only=True):
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+
+class CommunicatorConnection:
+    """A consumer driven in-process through ``WebsocketCommunicator``"""
+
+    application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    def __init__(self, path, token, subprotocols):
+        self.communicator = WebsocketCommunicator(
+            self.application, f"{path}?token={token}", subprotocols=subprotocols
+        )
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise CommandError("Consumer refused the connection")
+
+    async def send(self, frame):
+        if isinstance(frame, bytes):
+            await self.communicator.send_to(bytes_data=frame)
+        else:
+            await self.communicator.send_to(text_data=frame)
+
+    async def receive(self, timeout):
+        # A receive timeout cancels the consumer, so only time out when done with it
+        try:
+            return await self.communicator.receive_from(timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def drain(self, timeout):
+        """Receive until nothing arrives for ``timeout`` seconds, keeping the consumer alive"""
+        received = []
+        while not await self.communicator.receive_nothing(timeout):
+            received.append(await self.communicator.receive_from())
+        return received
+
+    async def close(self):
+        if not self.communicator.future.done():
+            await self.communicator.disconnect()
+
+
+class SocketConnection:
+    """A WebSocket to a running server (daphne), using the ``websockets`` package"""
+
+    def __init__(self, url, path, token, subprotocols):
+        self.uri = f"{url.rstrip('/')}{path}?token={token}"
+        self.subprotocols = subprotocols
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+
+        self.socket = await websockets.connect(self.uri, max_queue=None, subprotocols=self.subprotocols or None)
+
+    async def send(self, frame):
+        await self.socket.send(frame)
+
+    async def receive(self, timeout):
+        try:
+            return await asyncio.wait_for(self.socket.recv(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def drain(self, timeout):
+        received = []
+        while True:
+            text = await self.receive(timeout)
+            if text is None:
+                return received
+            received.append(text)
+
+    async def close(self):
+        await self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test ChatConsumer and UserNotificationConsumer with rooms x participants, "
+        "in-process through WebsocketCommunicator or against a running server with --url"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10, help="Interventions (chat rooms)")
+        parser.add_argument('--participants', type=int, default=4,
+                            help="Connections per room: the client plus employees")
+        parser.add_argument('--messages', type=int, default=20, help="Messages sent by each participant")
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Milliseconds between a participant's messages")
+        parser.add_argument('--timeout', type=float, default=10, help="Seconds to wait for a delivery")
+        parser.add_argument('--wire-format', choices=FORMATS, default=JSON,
+                            help="Negotiate this WebSocket subprotocol (JSON is also the default without one)")
+        parser.add_argument('--url', default=None,
+                            help="Standalone mode: base URL of a running server, e.g. ws://localhost:8000 "
+                                 "(needs the websockets package and the server's database settings)")
+        parser.add_argument('--server-pid', type=int, default=None,
+                            help="Standalone mode: server process whose RSS is sampled for memory per connection")
+        parser.add_argument('--rate-limited', action='store_true',
+                            help="Keep CHAT_RATE_LIMITS in in-process runs (lifted by default)")
+        parser.add_argument('--keep-data', action='store_true',
+                            help="Standalone mode: keep the generated users and interventions")
+        parser.add_argument('--output', default=None, help="Write the results as JSON to this file")
+        parser.add_argument('--compare', default=None, help="Compare with the JSON results of an earlier run")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        if options['participants'] < 1 or options['rooms'] < 1:
+            raise CommandError("--rooms and --participants must be at least 1")
+        if options['url']:
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError("Standalone mode needs the websockets package (pip install websockets)")
+            results = self.run_standalone(options)
+        else:
+            results = self.run_in_process(options)
+
+        results.update({
+            'commit': self.current_commit(),
+            'recorded_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+            'write_behind': getattr(settings, 'CHAT_WRITE_BEHIND', False),
+            'wire_format': options['wire_format'],
+        })
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_results(results)
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                self.print_comparison(json.load(baseline), results)
+
+    def run_in_process(self, options):
+        # Synthetic users and rooms go into a throwaway test database
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            rooms = self.create_rooms(options['rooms'], options['participants'])
+
+            def open_connection(path, token):
+                return CommunicatorConnection(path, token, [options['wire_format']])
+
+            if options['rate_limited']:
+                return asyncio.run(self.run(rooms, open_connection, options, mode='in-process'))
+            # Participants send as fast as they can; measure delivery, not the limiter
+            with override_settings(CHAT_RATE_LIMITS={'default': {'connection': None, 'user': None}}):
+                return asyncio.run(self.run(rooms, open_connection, options, mode='in-process'))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_standalone(self, options):
+        rooms = self.create_rooms(options['rooms'], options['participants'])
+        try:
+            def open_connection(path, token):
+                return SocketConnection(options['url'], path, token, [options['wire_format']])
+
+            return asyncio.run(self.run(rooms, open_connection, options, mode='standalone'))
+        finally:
+            if not options['keep_data']:
+                User.objects.filter(id__in={user.id for room in rooms for user in room['users']}).delete()
+
+    def create_rooms(self, room_count, participants):
+        """Create a client per room, shared employees and one assigned intervention per room"""
+        prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        employees = User.objects.bulk_create([
+            User(username=f"{prefix}-employee-{i}", email=f"{prefix}-employee-{i}@example.com",
+                 user_type='employee', password='!')
+            for i in range(participants - 1)
+        ])
+        clients = User.objects.bulk_create([
+            User(username=f"{prefix}-client-{i}", email=f"{prefix}-client-{i}@example.com",
+                 user_type='client', password='!')
+            for i in range(room_count)
+        ])
+        tokens = Token.objects.bulk_create([
+            Token(key=Token.generate_key(), user=user) for user in employees + clients
+        ])
+        keys = {token.user_id: token.key for token in tokens}
+
+        rooms = []
+        for client in clients:
+            intervention = Intervention.objects.create(
+                title=f"Benchmark room for {client.username}",
+                description="Synthetic load-test intervention",
+                created_by=client,
+                assigned_to=employees[0] if employees else None,
+                status='in_progress',
+            )
+            users = [client] + employees
+            rooms.append({
+                'intervention_id': intervention.id,
+                'users': users,
+                'tokens': [keys[user.id] for user in users],
+            })
+        return rooms
+
+    async def run(self, rooms, open_connection, options, mode):
+        messages, timeout = options['messages'], options['timeout']
+        participants = options['participants']
+
+        # Database threads connect lazily, so count from before the first connection
+        counter = QueryCounter() if mode == 'in-process' else None
+        if counter is not None:
+            counter.start()
+
+        # Connect chat sockets plus one notification socket per distinct user
+        tracemalloc_started = mode == 'in-process' and not tracemalloc.is_tracing()
+        if tracemalloc_started:
+            tracemalloc.start()
+        memory_before = self.memory_sample(mode, options['server_pid'])
+
+        chats = []
+        for room in rooms:
+            for user, token in zip(room['users'], room['tokens']):
+                chat = open_connection(f"/ws/chat/{room['intervention_id']}/", token)
+                await chat.connect()
+                await chat.receive(timeout)  # welcome message
+                chats.append((room, user, chat))
+        notification_tokens = {user.id: token for room in rooms for user, token in zip(room['users'], room['tokens'])}
+        notifications = []
+        for token in notification_tokens.values():
+            notification = open_connection('/ws/notifications/', token)
+            await notification.connect()
+            notifications.append(notification)
+
+        connection_count = len(chats) + len(notifications)
+        memory_after = self.memory_sample(mode, options['server_pid'])
+        if tracemalloc_started:
+            tracemalloc.stop()
+        memory_per_connection = None
+        if memory_before is not None and memory_after is not None:
+            memory_per_connection = (memory_after - memory_before) / connection_count / 1024
+
+        sent_at = {}
+        latencies = []
+        expected = participants * messages
+
+        async def receive_room(chat):
+            received = 0
+            while received < expected:
+                text = await chat.receive(timeout)
+                if text is None:
+                    break
+                now = time.perf_counter()
+                event = decode(bytes_data=text) if isinstance(text, bytes) else decode(text_data=text)
+                if event.get('type') != 'chat':
+                    continue
+                received += 1
+                started = sent_at.get(event['message'])
+                if started is not None:
+                    latencies.append((now - started) * 1000)
+            return received, time.perf_counter()
+
+        async def send_messages(room, user, chat):
+            for n in range(messages):
+                text = f"bench {room['intervention_id']}:{user.id}:{n}"
+                sent_at[text] = time.perf_counter()
+                await chat.send(encode({'message': text}, options['wire_format']))
+                if options['interval']:
+                    await asyncio.sleep(options['interval'] / 1000)
+
+        queries_before = counter.count if counter is not None else 0
+        receivers = [asyncio.create_task(receive_room(chat)) for _, _, chat in chats]
+        started = time.perf_counter()
+        await asyncio.gather(*(send_messages(room, user, chat) for room, user, chat in chats))
+        received = await asyncio.gather(*receivers)
+        writer = get_message_writer() if mode == 'in-process' else None
+        if writer is not None:
+            await writer.flush()
+        if counter is not None:
+            counter.stop()
+            queries = counter.count - queries_before
+
+        delivered = sum(count for count, _ in received)
+        finished = max(finished_at for _, finished_at in received)
+        elapsed = finished - started
+
+        coalesce = getattr(settings, 'NOTIFICATION_COALESCE_MS', 500) / 1000
+        notification_counts = await asyncio.gather(
+            *(notification.drain(coalesce + 0.25) for notification in notifications)
+        )
+        for _, _, chat in chats:
+            await chat.close()
+        for notification in notifications:
+            await notification.close()
+
+        sent = len(chats) * messages
+        ordered = sorted(latencies)
+        return {
+            'mode': mode,
+            'rooms': len(rooms),
+            'participants': participants,
+            'messages_per_participant': messages,
+            'connections': connection_count,
+            'messages_sent': sent,
+            'deliveries_expected': sent * participants,
+            'deliveries': delivered,
+            'notifications_received': sum(len(events) for events in notification_counts),
+            'elapsed': elapsed,
+            'messages_per_sec': sent / elapsed if elapsed else 0,
+            'deliveries_per_sec': delivered / elapsed if elapsed else 0,
+            'latency_ms': {
+                'p50': percentile(ordered, 50),
+                'p95': percentile(ordered, 95),
+                'p99': percentile(ordered, 99),
+                'max': ordered[-1] if ordered else None,
+            },
+            'queries_per_message': queries / sent if counter is not None and sent else None,
+            'memory_per_connection_kb': memory_per_connection,
+        }
+
+    def memory_sample(self, mode, server_pid):
+        """Traced bytes in-process, or the server's RSS in bytes in standalone mode"""
+        if mode == 'in-process':
+            return tracemalloc.get_traced_memory()[0]
+        if server_pid is None:
+            return None
+        try:
+            with open(f"/proc/{server_pid}/status") as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            raise CommandError(f"Cannot read the memory of process {server_pid}")
+        return None
+
+    def current_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_results(self, results):
+        latency = results['latency_ms']
+
+        def number(value, digits=1):
+            return 'n/a' if value is None else f"{value:.{digits}f}"
+
+        self.stdout.write(
+            f"{results['mode']}: {results['rooms']} rooms x {results['participants']} participants, "
+            f"{results['connections']} connections"
+        )
+        self.stdout.write(
+            f"  {results['messages_per_sec']:.0f} messages/s, {results['deliveries_per_sec']:.0f} deliveries/s "
+            f"({results['deliveries']}/{results['deliveries_expected']} delivered, "
+            f"{results['notifications_received']} notifications)"
+        )
+        self.stdout.write(
+            f"  latency p50 {number(latency['p50'])} ms, p95 {number(latency['p95'])} ms, "
+            f"p99 {number(latency['p99'])} ms"
+        )
+        self.stdout.write(
+            f"  {number(results['queries_per_message'], 2)} queries/message, "
+            f"{number(results['memory_per_connection_kb'])} KiB/connection"
+        )
+
+    def print_comparison(self, baseline, results):
+        self.stdout.write(f"Compared with {baseline.get('commit') or 'baseline'}:")
+        for name, higher_is_better in COMPARED_METRICS.items():
+            before, after = metric(baseline, name), metric(results, name)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            better = change > 0 if higher_is_better else change < 0
+            self.stdout.write(
+                f"  {name:<26} {before:>12.2f} -> {after:>12.2f} "
+                f"({change:+.1f}%{', better' if better else ''})"
+            )
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from intervention.log import JSONFormatter, QueueListenerHandler
+
+MODES = ('print', 'sync-logging', 'queue-logging')
+
+
+class SlowReader:
+    """Drains a pipe in 4 KiB reads with a pause between them, like a slow terminal or log shipper"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        read_fd, write_fd = os.pipe()
+        self.read_fd = read_fd
+        self.stream = os.fdopen(write_fd, 'w', buffering=1)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while os.read(self.read_fd, 4096):
+            if self.delay:
+                time.sleep(self.delay)
+        os.close(self.read_fd)
+
+    def close(self):
+        self.delay = 0
+        self.stream.close()
+        self.thread.join()
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure event-loop stalls while logging to a slow stream with print(), "
+        "a plain StreamHandler and the queued JSON pipeline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=2.0, help="Seconds per mode")
+        parser.add_argument('--rate', type=int, default=20000, help="Log records per second")
+        parser.add_argument('--reader-delay', type=float, default=10.0,
+                            help="Milliseconds the reader pauses after each 4 KiB read")
+        parser.add_argument('--mode', choices=MODES, action='append', help="Run only these modes")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        results = [self.run_mode(mode, options) for mode in options['mode'] or MODES]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<14} stall p50 {result['lag_ms']['p50']:>7.2f} ms  "
+                f"p99 {result['lag_ms']['p99']:>7.2f} ms  max {result['lag_ms']['max']:>8.2f} ms  "
+                f"total {result['stalled_ms']:>8.1f} ms  {result['records']} records"
+                + (f" ({result['dropped']} dropped)" if result['dropped'] else '')
+            )
+
+    def run_mode(self, mode, options):
+        reader = SlowReader(options['reader_delay'] / 1000)
+        logger = logging.getLogger(f'benchmark_logging.{mode}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = None
+        if mode == 'sync-logging':
+            handler = logging.StreamHandler(reader.stream)
+        elif mode == 'queue-logging':
+            handler = QueueListenerHandler(reader.stream)
+        if handler is not None:
+            handler.setFormatter(JSONFormatter())
+            logger.addHandler(handler)
+
+        def emit(n):
+            if mode == 'print':
+                print(f"WebSocket connect - User: benchmark-user-{n} (Client), Room: {n % 100}", file=reader.stream)
+            else:
+                logger.info("WebSocket connect", extra={'user_id': n, 'room': n % 100})
+
+        try:
+            lags, records = asyncio.run(self.measure(emit, options['duration'], options['rate']))
+        finally:
+            if handler is not None:
+                logger.removeHandler(handler)
+                reader.delay = 0
+                handler.close()
+            reader.close()
+
+        ordered = sorted(lags)
+        return {
+            'mode': mode,
+            'records': records,
+            'dropped': getattr(handler, 'dropped', 0),
+            'lag_ms': {
+                'p50': percentile(ordered, 50),
+                'p99': percentile(ordered, 99),
+                'max': ordered[-1] if ordered else 0.0,
+            },
+            'stalled_ms': sum(lag for lag in ordered if lag > 1.0),
+        }
+
+    async def measure(self, emit, duration, rate, tick=0.001):
+        """Log ``rate`` records/s for ``duration`` seconds while timing 1 ms heartbeats"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        lags = []
+        records = 0
+
+        async def heartbeat():
+            while loop.time() < deadline:
+                scheduled = loop.time() + tick
+                await asyncio.sleep(tick)
+                lags.append(max(0.0, loop.time() - scheduled) * 1000)
+
+        async def producer():
+            nonlocal records
+            per_tick = max(1, round(rate * tick))
+            while loop.time() < deadline:
+                for _ in range(per_tick):
+                    emit(records)
+                    records += 1
+                await asyncio.sleep(tick)
+
+        await asyncio.gather(heartbeat(), producer())
+        return lags, records
@@ -0,0 +1,32 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat_consumer.broker import ChannelBroker
+from chat_consumer.layers import DEFAULT_BROKER_PATH
+
+
+class Command(BaseCommand):
+    help = "Run the local channel broker used by UnixSocketChannelLayer"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=getattr(settings, 'CHANNEL_BROKER_SOCKET', None) or DEFAULT_BROKER_PATH,
+            help="Unix domain socket to listen on",
+        )
+        parser.add_argument(
+            '--max-buffer',
+            type=int,
+            default=8 * 1024 * 1024,
+            help="Bytes buffered per worker before frames to it are dropped",
+        )
+
+    def handle(self, *args, **options):
+        broker = ChannelBroker(options['path'], max_buffer=options['max_buffer'])
+        self.stdout.write(f"Channel broker listening on {options['path']}")
+        try:
+            asyncio.run(broker.serve_forever())
+        except KeyboardInterrupt:
+            pass
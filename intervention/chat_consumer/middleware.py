@@ -1,8 +1,12 @@
 from channels.middleware import BaseMiddleware
-from channels.db import database_sync_to_async
+from metrics.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.authtoken.models import Token
+from authentication.token_cache import token_cache
 from urllib.parse import parse_qs
+import logging
+
+logger = logging.getLogger(__name__)
 
 class TokenAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
@@ -11,12 +15,12 @@ class TokenAuthMiddleware(BaseMiddleware):
         query_params = parse_qs(query_string)
         token_key = query_params.get('token', [None])[0]
         
-        print(f"WebSocket auth - Token: {token_key}")
-        
         if token_key:
-            # Get user from token
-            user = await self.get_user_from_token(token_key)
-            print(f"WebSocket auth - User: {user}")
+            # Get user from token, skipping the thread hop when it's already cached
+            user = token_cache.get(token_key)
+            if user is None:
+                user = await self.get_user_from_token(token_key)
+            logger.debug("WebSocket auth", extra={'user_id': user.id})
             scope['user'] = user
         else:
             scope['user'] = AnonymousUser()
@@ -26,7 +30,6 @@ class TokenAuthMiddleware(BaseMiddleware):
     @database_sync_to_async
     def get_user_from_token(self, token_key):
         try:
-            token = Token.objects.get(key=token_key)
-            return token.user
+            return token_cache.load(token_key)
         except Token.DoesNotExist:
             return AnonymousUser() 
\ No newline at end of file
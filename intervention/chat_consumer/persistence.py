@@ -0,0 +1,187 @@
+"""Chat message persistence: sequence ids and the optional write-behind pipeline.
+
+Every chat message gets a sequence id equal to its timestamp in microseconds
+since the epoch, made strictly increasing within the process. Because the
+sequence and the stored timestamp are the same value, a sequence id can always
+be mapped back to a position in the ``Message`` table. Two workers can hand
+out the same sequence id, so live events also carry the clock's ``worker``
+token and (sequence, worker) is what identifies a message across processes.
+
+By default each message is saved (with its unread counter and search index
+writes) before it is broadcast. With ``CHAT_WRITE_BEHIND`` enabled,
+``ChatConsumer`` broadcasts a message as soon as it has a sequence id and hands
+it to a ``MessageWriter``, which ``bulk_create``s queued messages every
+``CHAT_WRITE_BEHIND_BATCH_SIZE`` messages or ``CHAT_WRITE_BEHIND_FLUSH_MS``
+milliseconds. A batch that still fails after its retries is only reported to
+the failure hooks, so messages clients already saw can be lost: write-behind
+trades durability for throughput and is opt-in.
+"""
+import asyncio
+import atexit
+import datetime
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from intervention_app.models import Message
+from intervention_app.unread import record_new_messages
+from metrics.db import database_sync_to_async
+from search.index import index_objects
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def sequence_for(timestamp):
+    """Return the sequence id of a message stored with ``timestamp``"""
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def timestamp_for(sequence):
+    return EPOCH + sequence * MICROSECOND
+
+
+class SequenceClock:
+    """Hands out strictly increasing (sequence, timestamp) pairs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = 0
+        # Tells this process's sequence ids apart from another worker's
+        self.worker = uuid.uuid4().hex
+
+    def next(self):
+        with self._lock:
+            sequence = max(sequence_for(timezone.now()), self._last + 1)
+            self._last = sequence
+        return sequence, timestamp_for(sequence)
+
+
+sequence_clock = SequenceClock()
+
+
+class MessageWriter:
+    """Queues unsaved ``Message`` instances and writes them in batches.
+
+    ``flush_hooks`` are called with each batch, in the transaction that inserts
+    it, so a batch commits together with what the hooks derive from it (unread
+    counters, search entries). ``failure_hooks`` are called with ``(batch,
+    exception)`` once a batch has failed ``max_retries`` times. Both run in the
+    database thread.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.05, max_pending=10000, max_retries=3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.flush_hooks = []
+        self.failure_hooks = [self.log_failure]
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def enqueue(self, message):
+        """Queue ``message`` for writing; waits only when ``max_pending`` is reached"""
+        self.start()
+        await self.queue.put(message)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await database_sync_to_async(self.write)(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, batch):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create(batch)
+                    for hook in self.flush_hooks:
+                        hook(batch)
+            except Exception as exc:
+                for message in batch:
+                    message.pk = None  # rolled back
+                if attempt == self.max_retries:
+                    for hook in self.failure_hooks:
+                        hook(batch, exc)
+                    return
+            else:
+                return
+
+    async def flush(self):
+        """Wait until everything queued so far has been written"""
+        if self._task is not None and not self._task.done():
+            await self.queue.join()
+
+    async def close(self):
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def flush_sync(self):
+        """Write whatever is still queued; used at interpreter exit, when no loop is running"""
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            self.write(batch)
+
+    @staticmethod
+    def log_failure(batch, exc):
+        logger.error("Dropped %d chat messages after write failures: %s", len(batch), exc)
+
+
+_writers = {}  # event loop -> MessageWriter
+_writers_lock = threading.Lock()
+
+
+def _flush_all_at_exit():
+    for writer in list(_writers.values()):
+        writer.flush_sync()
+
+
+atexit.register(_flush_all_at_exit)
+
+
+def get_message_writer():
+    """Return the running loop's MessageWriter, or ``None`` when write-behind is off"""
+    if not getattr(settings, 'CHAT_WRITE_BEHIND', False):
+        return None
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(loop)
+            if writer is None:
+                writer = MessageWriter(
+                    batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100),
+                    flush_interval=getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_MS', 50) / 1000,
+                )
+                # bulk_create skips post_save, so keep unread counters and search current here
+                writer.flush_hooks.append(record_new_messages)
+                writer.flush_hooks.append(index_objects)
+                _writers[loop] = writer
+    return writer
@@ -0,0 +1,168 @@
+"""Ephemeral presence and typing state of chat rooms, kept in memory only.
+
+Nothing here touches the database. Each process tracks who is connected to a
+room through it and who is typing there (``RoomPresence``). Changes only mark
+the room dirty; at most once per ``CHAT_PRESENCE_WINDOW_MS`` the room's state
+is sent to the room group as a single ``presence_update`` event, however many
+members joined, left or typed in the meantime.
+
+Every process announces its own members, tagged with the ``origin`` of its
+``RoomPresence``. The processes merge the latest announcement of each origin
+into the room state they deliver, and re-announce themselves when they hear
+from a new origin so late joiners learn about everybody.
+"""
+import asyncio
+import uuid
+
+from .wire import frames_for
+
+
+class RoomPresence:
+    """Presence of one room: local connections and typing users, plus what other processes announced"""
+
+    def __init__(self, group, channel_layer, window, typing_timeout):
+        self.group = group
+        self.channel_layer = channel_layer
+        self.window = window
+        self.typing_timeout = typing_timeout
+        # Identifies this process's announcements for the room
+        self.origin = uuid.uuid4().hex
+        # user id -> {'user_id', 'user', 'user_type', 'connections'}
+        self.members = {}
+        # user id -> event loop time the typing indicator expires
+        self.typing = {}
+        # origin -> (version, online, typing) of the latest announcement heard
+        self.snapshots = {}
+        self.version = 0
+        self.frames = None
+        self.last_flush = None
+        self.flush_task = None
+        self.expiry_handle = None
+
+    def join(self, user):
+        member = self.members.get(user.id)
+        if member is None:
+            member = self.members[user.id] = {
+                'user_id': user.id, 'user': user.username, 'user_type': user.user_type, 'connections': 0,
+            }
+            self.touch()
+        member['connections'] += 1
+
+    def leave(self, user):
+        member = self.members.get(user.id)
+        if member is None:
+            return
+        member['connections'] -= 1
+        if member['connections'] <= 0:
+            del self.members[user.id]
+            self.typing.pop(user.id, None)
+            self.touch()
+
+    def set_typing(self, user, typing):
+        if user.id not in self.members:
+            return
+        loop = asyncio.get_running_loop()
+        if typing:
+            started = user.id not in self.typing
+            self.typing[user.id] = loop.time() + self.typing_timeout
+            if started:
+                self.touch()
+            if self.expiry_handle is None:
+                self.expiry_handle = loop.call_later(self.typing_timeout, self.expire_typing)
+        elif self.typing.pop(user.id, None) is not None:
+            self.touch()
+
+    def expire_typing(self):
+        """Drop typing indicators nobody refreshed, then wait for the next one to lapse"""
+        self.expiry_handle = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        expired = [user_id for user_id, deadline in self.typing.items() if deadline <= now]
+        for user_id in expired:
+            del self.typing[user_id]
+        if expired:
+            self.touch()
+        if self.typing:
+            self.expiry_handle = loop.call_at(min(self.typing.values()), self.expire_typing)
+
+    def touch(self):
+        """Note a change; it is announced when the current window closes"""
+        if self.flush_task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = 0 if self.last_flush is None else max(0.0, self.last_flush + self.window - loop.time())
+        self.flush_task = loop.create_task(self.flush(delay))
+
+    async def flush(self, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        self.flush_task = None
+        self.last_flush = asyncio.get_running_loop().time()
+        self.version += 1
+        await self.channel_layer.group_send(self.group, {
+            'type': 'presence_update',
+            'origin': self.origin,
+            'version': self.version,
+            'online': [
+                {key: member[key] for key in ('user_id', 'user', 'user_type')} for member in self.members.values()
+            ],
+            'typing': list(self.typing),
+        })
+
+    def receive(self, event):
+        """Merge an announcement into the room state and return the frames to deliver"""
+        origin = event['origin']
+        known = self.snapshots.get(origin)
+        if known is None or known[0] < event['version']:
+            self.snapshots[origin] = (event['version'], event['online'], event['typing'])
+            self.frames = None
+            if known is None and origin != self.origin:
+                # A process we hadn't heard from: tell it who is here
+                self.touch()
+        if self.frames is None:
+            self.frames = frames_for(self.state())
+        return self.frames
+
+    def state(self):
+        online, typing = {}, set()
+        for _, members, typing_ids in self.snapshots.values():
+            for member in members:
+                online[member['user_id']] = member
+            typing.update(typing_ids)
+        return {
+            'type': 'presence',
+            'online': sorted(online.values(), key=lambda member: member['user_id']),
+            'typing': [online[user_id] for user_id in sorted(typing) if user_id in online],
+        }
+
+    def close(self):
+        if self.expiry_handle is not None:
+            self.expiry_handle.cancel()
+            self.expiry_handle = None
+
+
+class PresenceRegistry:
+    """The presence state of the rooms with members connected to this process"""
+
+    def __init__(self):
+        self.rooms = {}
+
+    def join(self, group, user, channel_layer, window, typing_timeout):
+        room = self.rooms.get(group)
+        if room is None:
+            room = self.rooms[group] = RoomPresence(group, channel_layer, window, typing_timeout)
+        room.join(user)
+        return room
+
+    def leave(self, group, user):
+        room = self.rooms.get(group)
+        if room is None:
+            return
+        room.leave(user)
+        if not room.members:
+            # The pending flush still announces that nobody is left here
+            room.close()
+            del self.rooms[group]
+
+
+room_presence = PresenceRegistry()
@@ -1,3 +1,652 @@
-from django.test import TestCase
+import asyncio
+import copy
+import io
+import json
+import os
+import tempfile
 
-# Create your tests here.
+from unittest import mock
+
+import msgpack
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from authentication.roster import roster_cache
+from authentication.token_cache import token_cache
+from intervention.routing import websocket_urlpatterns
+from intervention_app import archive
+from intervention_app.models import Intervention, Message
+
+from .broker import ChannelBroker, pack as broker_pack, unpack as broker_unpack
+from .history import RoomHistory
+from .management.commands.benchmark_chat import Command as BenchmarkChat, CommunicatorConnection, percentile
+from .layers import UnixSocketChannelLayer
+from .middleware import TokenAuthMiddleware
+from .persistence import MessageWriter, sequence_clock, sequence_for, timestamp_for
+from metrics.instruments import WEBSOCKET_DROPPED_FRAMES, WEBSOCKET_EVICTIONS
+
+from . import events
+from .flow import CLOSE_SLOW_CONSUMER
+from .wire import JSON, MSGPACK, WireFormatMixin, decode, encode, frames_for, history_frame
+
+application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+
+class ChatTestCase(TransactionTestCase):
+    """A client, an employee and an intervention between them, with WebSocket helpers"""
+
+    def setUp(self):
+        token_cache.clear()
+        roster_cache.invalidate()
+        self.client_user = User.objects.create_user('client', 'client@example.com', 'pw', user_type='client')
+        self.employee = User.objects.create_user('employee', 'employee@example.com', 'pw', user_type='employee')
+        self.intervention = Intervention.objects.create(
+            title='Printer', description='Jammed', created_by=self.client_user, assigned_to=self.employee
+        )
+
+    def token(self, user):
+        return Token.objects.get_or_create(user=user)[0].key
+
+    async def connect(self, user, path=None, **kwargs):
+        path = path or f'/ws/chat/{self.intervention.id}/'
+        token = await sync_to_async(self.token)(user)
+        communicator = WebsocketCommunicator(
+            application, f"{path}{'&' if '?' in path else '?'}token={token}", **kwargs
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        if path.startswith('/ws/chat/'):
+            self.assertEqual((await self.receive(communicator))['type'], 'system')
+        return communicator
+
+    def record_queries(self):
+        """Collect the SQL run from now on; consumers run their queries in the test's thread"""
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        connection.execute_wrappers.append(record)
+        self.addCleanup(connection.execute_wrappers.remove, record)
+        return statements
+
+    async def receive(self, communicator, timeout=2):
+        """The next frame that isn't a presence update"""
+        while True:
+            payload = await communicator.receive_json_from(timeout)
+            if payload.get('type') != 'presence':
+                return payload
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'broker.sock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def wait_for(self, condition, timeout=5):
+        async with asyncio.timeout(timeout):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+    async def test_broker_outage_drops_messages_without_failing(self):
+        layer = UnixSocketChannelLayer(path=self.path, reconnect_delay=0.05, max_reconnect_delay=0.1)
+        channel = await layer.new_channel()
+        await layer.group_add('room', channel)
+
+        # Local members are still served; what had to go through the broker is counted
+        await layer.group_send('room', {'type': 'chat.message', 'text': 'local'})
+        self.assertEqual((await layer.receive(channel))['text'], 'local')
+        await layer.send('specific.elsewhere!abc', {'type': 'chat.message'})
+        self.assertEqual(layer.dropped, 2)
+        await layer.close()
+
+    async def test_reconnects_and_reannounces_groups(self):
+        layer = UnixSocketChannelLayer(path=self.path, reconnect_delay=0.05, max_reconnect_delay=0.1)
+        channel = await layer.new_channel()
+        await layer.group_add('room', channel)
+
+        broker = ChannelBroker(self.path)
+        await broker.start()
+        try:
+            client = layer._clients[asyncio.get_running_loop()]
+            await self.wait_for(lambda: client.connected)
+            await self.wait_for(lambda: 'room' in broker.groups)
+
+            other = UnixSocketChannelLayer(path=self.path)
+            await other.group_send('room', {'type': 'chat.message', 'text': 'remote'})
+            async with asyncio.timeout(5):
+                self.assertEqual((await layer.receive(channel))['text'], 'remote')
+            await other.close()
+        finally:
+            await layer.close()
+            # Let the broker see the connections close before the loop goes away
+            await self.wait_for(lambda: not broker.listeners)
+            await broker.close()
+
+    async def burst_reaches_listener(self, send_burst):
+        broker = ChannelBroker(self.path)
+        await broker.start()
+        layer = UnixSocketChannelLayer(path=self.path, capacity=1000)
+        channel = await layer.new_channel()
+        try:
+            await layer.group_add('room', channel)
+            await self.wait_for(lambda: 'room' in broker.groups)
+            await send_burst()
+            async with asyncio.timeout(5):
+                texts = [(await layer.receive(channel))['text'] for _ in range(500)]
+            self.assertEqual(texts, [str(number) for number in range(500)])
+        finally:
+            await layer.close()
+            await self.wait_for(lambda: not broker.listeners)
+            await broker.close()
+
+    async def test_close_sends_everything_written_first(self):
+        body = 'x' * 4000
+
+        async def send_burst():
+            other = UnixSocketChannelLayer(path=self.path)
+            for number in range(500):
+                await other.group_send('room', {'type': 'chat.message', 'text': str(number), 'body': body})
+            await other.close()
+
+        await self.burst_reaches_listener(send_burst)
+
+    async def test_publishing_from_a_short_lived_loop_sends_everything(self):
+        other = UnixSocketChannelLayer(path=self.path)
+        body = 'x' * 4000
+
+        async def publish():
+            for number in range(500):
+                await other.group_send('room', {'type': 'chat.message', 'text': str(number), 'body': body})
+
+        async def send_burst():
+            # Like async_to_sync: the loop ends without closing the publish-only client
+            await asyncio.to_thread(asyncio.run, publish())
+
+        await self.burst_reaches_listener(send_burst)
+
+
+class InterventionCacheTests(ChatTestCase):
+    async def test_chat_message_runs_no_intervention_query(self):
+        client = await self.connect(self.client_user)
+        employee = await self.connect(self.employee)
+
+        statements = await sync_to_async(self.record_queries)()
+        await client.send_json_to({'message': 'Hello'})
+        self.assertEqual((await self.receive(employee))['message'], 'Hello')
+        await self.receive(client)
+        self.assertFalse([sql for sql in statements if 'FROM "intervention_app_intervention"' in sql])
+
+        await client.disconnect()
+        await employee.disconnect()
+        self.assertEqual(await Message.objects.filter(intervention=self.intervention).acount(), 1)
+
+    async def test_messages_are_stored_before_they_are_broadcast(self):
+        client = await self.connect(self.client_user)
+        employee = await self.connect(self.employee)
+        await client.send_json_to({'message': 'Hello'})
+        await self.receive(employee)
+        # Neither connection has closed, so no write-behind flush has run
+        self.assertTrue(await Message.objects.filter(intervention=self.intervention, content='Hello').aexists())
+        await client.disconnect()
+        await employee.disconnect()
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    async def test_write_behind_stores_messages_after_broadcasting(self):
+        client = await self.connect(self.client_user)
+        await client.send_json_to({'message': 'Hello'})
+        await self.receive(client)
+        await client.disconnect()
+        self.assertTrue(await Message.objects.filter(intervention=self.intervention, content='Hello').aexists())
+
+    async def test_chat_frames_carry_the_message_id(self):
+        client = await self.connect(self.client_user)
+        employee = await self.connect(self.employee)
+        await client.send_json_to({'message': 'Hello'})
+        frame = await self.receive(employee)
+        message = await Message.objects.aget(intervention=self.intervention, content='Hello')
+        self.assertEqual(frame['id'], message.id)
+
+        await employee.send_json_to({'action': 'mark_read', 'up_to': frame['id']})
+        self.assertEqual(await self.receive(employee), {'type': 'marked_read', 'up_to': message.id, 'marked': 1})
+        await client.disconnect()
+        await employee.disconnect()
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    async def test_write_behind_messages_are_marked_read_by_seq(self):
+        client = await self.connect(self.client_user)
+        employee = await self.connect(self.employee)
+        for content in ('First', 'Second'):
+            await client.send_json_to({'message': content})
+        first = await self.receive(employee)
+        await self.receive(employee)
+        self.assertIsNone(first['id'])
+
+        await employee.send_json_to({'action': 'mark_read', 'up_to_seq': first['seq']})
+        marked = await self.receive(employee)
+        message = await Message.objects.aget(intervention=self.intervention, content='First')
+        self.assertEqual(marked, {'type': 'marked_read', 'up_to': message.id, 'marked': 1})
+        await client.disconnect()
+        await employee.disconnect()
+
+    async def test_rest_status_change_reaches_the_cached_intervention(self):
+        client = await self.connect(self.client_user)
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Token {await sync_to_async(self.token)(self.employee)}')
+        response = await sync_to_async(api.post)(
+            f'/api/interventions/{self.intervention.id}/update_status/', {'status': 'closed'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # The room's intervention_update event refreshes the consumer's copy
+        await asyncio.sleep(0.2)
+        await client.send_json_to({'message': 'Still there?'})
+        self.assertEqual((await self.receive(client))['type'], 'error')
+        await client.disconnect()
+
+
+class MessageWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client', 'client@example.com', 'pw', user_type='client')
+        self.intervention = Intervention.objects.create(title='Printer', description='Jammed', created_by=self.user)
+
+    def message(self, content):
+        _, timestamp = sequence_clock.next()
+        return Message(intervention=self.intervention, user=self.user, content=content, timestamp=timestamp)
+
+    async def test_messages_are_written_in_batches(self):
+        writer = MessageWriter(batch_size=3, flush_interval=0.05)
+        batches = []
+        writer.flush_hooks.append(lambda batch: batches.append(len(batch)))
+        for i in range(5):
+            await writer.enqueue(self.message(f'Message {i}'))
+        await writer.close()
+
+        self.assertEqual(batches, [3, 2])
+        contents = [message.content async for message in Message.objects.order_by('timestamp')]
+        self.assertEqual(contents, [f'Message {i}' for i in range(5)])
+
+    async def test_failed_batches_reach_the_failure_hooks(self):
+        writer = MessageWriter(batch_size=10, flush_interval=0.01, max_retries=2)
+        failures = []
+        writer.failure_hooks = [lambda batch, exc: failures.append(len(batch))]
+        broken = self.message('Broken')
+        broken.user_id = 0  # no such user
+        await writer.enqueue(broken)
+        await writer.close()
+        self.assertEqual(failures, [1])
+
+    def test_sequence_ids_map_back_to_timestamps(self):
+        first, timestamp = sequence_clock.next()
+        second, _ = sequence_clock.next()
+        self.assertLess(first, second)
+        self.assertEqual(sequence_for(timestamp), first)
+        self.assertEqual(timestamp_for(first), timestamp)
+
+
+@override_settings(NOTIFICATION_COALESCE_MS=200)
+class NotificationTests(ChatTestCase):
+    async def test_message_bursts_are_coalesced(self):
+        notifications = await self.connect(self.employee, '/ws/notifications/')
+        client = await self.connect(self.client_user)
+        for i in range(3):
+            await client.send_json_to({'message': f'Message {i}'})
+            await self.receive(client)
+
+        first = await notifications.receive_json_from(2)
+        self.assertEqual((first['event'], str(first['intervention_id']), first['count']),
+                         ('new_message', str(self.intervention.id), 1))
+        self.assertIn('Message 0', first['message'])
+        summary = await notifications.receive_json_from(2)
+        self.assertEqual(summary['count'], 2)
+        self.assertIn('Message 2', summary['message'])
+        self.assertTrue(await notifications.receive_nothing(0.3))
+
+        await client.disconnect()
+        await notifications.disconnect()
+
+    async def test_the_sender_is_not_notified(self):
+        notifications = await self.connect(self.client_user, '/ws/notifications/')
+        client = await self.connect(self.client_user)
+        await client.send_json_to({'message': 'Hello'})
+        await self.receive(client)
+        self.assertTrue(await notifications.receive_nothing(0.3))
+        await client.disconnect()
+        await notifications.disconnect()
+
+
+@override_settings(CHAT_RATE_LIMITS={'default': {'connection': None, 'user': None}}, NOTIFICATION_COALESCE_MS=50)
+class BenchmarkChatTests(TransactionTestCase):
+    def setUp(self):
+        token_cache.clear()
+
+    async def test_small_run_delivers_every_message(self):
+        command = BenchmarkChat(stdout=io.StringIO())
+        rooms = await sync_to_async(command.create_rooms)(2, 2)
+        options = {'messages': 3, 'timeout': 2, 'participants': 2, 'interval': 0,
+                   'wire_format': 'json', 'server_pid': None}
+        results = await command.run(rooms, lambda path, token: CommunicatorConnection(path, token, ['json']),
+                                    options, mode='in-process')
+
+        # Four chat sockets, and a notification socket each for two clients and the shared employee
+        self.assertEqual((results['connections'], results['messages_sent']), (7, 12))
+        self.assertEqual(results['deliveries'], results['deliveries_expected'])
+        self.assertEqual(results['deliveries'], 24)
+        self.assertIsNotNone(results['latency_ms']['p99'])
+        self.assertIsNotNone(results['queries_per_message'])
+        command.print_results(results)
+        self.assertIn('24/24 delivered', command.stdout.getvalue())
+
+    def test_percentiles_and_comparison(self):
+        ordered = list(range(1, 101))
+        self.assertEqual((percentile(ordered, 50), percentile(ordered, 99)), (51, 99))
+        self.assertIsNone(percentile([], 50))
+
+        stdout = io.StringIO()
+        BenchmarkChat(stdout=stdout).print_comparison(
+            {'commit': 'abc1234', 'messages_per_sec': 100, 'latency_ms': {'p50': 2.0}},
+            {'messages_per_sec': 150, 'latency_ms': {'p50': 4.0}},
+        )
+        output = stdout.getvalue()
+        self.assertIn('abc1234', output)
+        self.assertIn('+50.0%, better', output)
+        self.assertIn('latency_ms.p50', output)
+        self.assertNotIn('+100.0%, better', output)
+
+
+class WireFormatTests(SimpleTestCase):
+    payload = {'type': 'chat', 'message': 'Héllo', 'seq': 12}
+
+    def test_payloads_round_trip_in_both_formats(self):
+        text, binary = encode(self.payload, JSON), encode(self.payload, MSGPACK)
+        self.assertIsInstance(text, str)
+        self.assertIsInstance(binary, bytes)
+        self.assertEqual(decode(text_data=text), self.payload)
+        self.assertEqual(decode(bytes_data=binary), self.payload)
+        frames = frames_for(self.payload)
+        self.assertEqual((frames[JSON], frames[MSGPACK]), (text, binary))
+
+    def test_frames_are_encoded_on_first_use_once_per_process(self):
+        frames, text = frames_for(self.payload), encode(self.payload, JSON)
+        with mock.patch('chat_consumer.wire.encode', wraps=encode) as encoder:
+            # What the in-memory layer hands each member is a deep copy of the event
+            copies = [copy.deepcopy({'frames': frames})['frames'] for _ in range(3)]
+            self.assertEqual({member[JSON] for member in copies}, {text})
+        self.assertEqual([call.args[1] for call in encoder.call_args_list], [JSON])
+
+        # Another worker gets the payload and encodes what its own members need
+        remote = broker_unpack(broker_pack({'frames': frames}))['frames']
+        self.assertEqual(remote.encoded, {})
+        self.assertEqual(remote[MSGPACK], encode(self.payload, MSGPACK))
+
+    def test_history_frames_splice_encoded_messages(self):
+        second = {**self.payload, 'seq': 13}
+        expected = {'type': 'history', 'messages': [self.payload, second], 'truncated': True}
+        frames = [frames_for(self.payload), frames_for(second)]
+        self.assertEqual(json.loads(history_frame([f[JSON] for f in frames], JSON, truncated=True)), expected)
+        self.assertEqual(msgpack.unpackb(history_frame([f[MSGPACK] for f in frames], MSGPACK, truncated=True)),
+                         expected)
+        self.assertEqual(json.loads(history_frame([], JSON))['messages'], [])
+
+
+class WireFormatNegotiationTests(ChatTestCase):
+    async def receive_msgpack(self, communicator):
+        while True:
+            payload = msgpack.unpackb(await communicator.receive_from(2))
+            if payload.get('type') != 'presence':
+                return payload
+
+    async def test_msgpack_and_json_clients_share_a_room(self):
+        token = await sync_to_async(self.token)(self.employee)
+        binary = WebsocketCommunicator(application, f'/ws/chat/{self.intervention.id}/?token={token}',
+                                       subprotocols=[MSGPACK, JSON])
+        connected, subprotocol = await binary.connect()
+        self.assertEqual((connected, subprotocol), (True, MSGPACK))
+        self.assertEqual((await self.receive_msgpack(binary))['type'], 'system')
+        text = await self.connect(self.client_user)
+
+        await binary.send_to(bytes_data=encode({'message': 'From msgpack'}, MSGPACK))
+        received = await self.receive(text)
+        self.assertEqual((received['type'], received['message']), ('chat', 'From msgpack'))
+        self.assertEqual(await self.receive_msgpack(binary), received)
+
+        await text.send_json_to({'message': 'From JSON'})
+        self.assertEqual((await self.receive_msgpack(binary))['message'], 'From JSON')
+        await self.receive(text)
+
+        await binary.disconnect()
+        await text.disconnect()
+
+    async def test_a_broadcast_is_encoded_once_for_the_whole_room(self):
+        members = [await self.connect(user) for user in (self.client_user, self.employee, self.employee)]
+        with mock.patch.object(events, 'frames_for', wraps=frames_for) as encoder:
+            await members[0].send_json_to({'message': 'Hello'})
+            for member in members:
+                self.assertEqual((await self.receive(member))['message'], 'Hello')
+        chat_frames = [call for call in encoder.call_args_list if call.args[0].get('type') == 'chat']
+        self.assertEqual(len(chat_frames), 1)
+        for member in members:
+            await member.disconnect()
+
+
+class RoomHistoryTests(SimpleTestCase):
+    def test_buffer_keeps_the_latest_messages_once(self):
+        history = RoomHistory(size=2, watermark=10)
+        for sequence in (11, 12, 12, 13):
+            history.add(sequence, 'a', {JSON: str(sequence)})
+        self.assertEqual([sequence for sequence, _, _ in history.entries], [12, 13])
+        self.assertEqual(history.watermark, 11)
+        self.assertEqual(history.since(11), [{JSON: '12'}, {JSON: '13'}])
+        self.assertEqual(history.since(13), [])
+        # 11 was evicted: only the database knows what came after 10
+        self.assertIsNone(history.since(10))
+
+    def test_workers_may_hand_out_the_same_sequence(self):
+        history = RoomHistory(size=10, watermark=10)
+        history.add(11, 'b', {JSON: 'from b'})
+        history.add(11, 'a', {JSON: 'from a'})
+        history.add(11, 'b', {JSON: 'from b'})
+        self.assertEqual(history.since(10), [{JSON: 'from a'}, {JSON: 'from b'}])
+
+
+class ReplayTests(ChatTestCase):
+    async def send(self, communicator, count):
+        sequences = []
+        for i in range(count):
+            await communicator.send_json_to({'message': f'Message {i}'})
+            sequences.append((await self.receive(communicator))['seq'])
+        return sequences
+
+    async def reconnect(self, last_seq):
+        client = await self.connect(self.client_user, f'/ws/chat/{self.intervention.id}/?last_seq={last_seq}')
+        history = await self.receive(client)
+        await client.disconnect()
+        self.assertEqual(history['type'], 'history')
+        return history
+
+    async def test_missed_messages_are_replayed_from_memory(self):
+        # The employee stays connected, keeping the room's buffer alive
+        employee = await self.connect(self.employee)
+        client = await self.connect(self.client_user)
+        sequences = await self.send(client, 3)
+        await client.disconnect()
+
+        statements = await sync_to_async(self.record_queries)()
+        history = await self.reconnect(sequences[0])
+        self.assertEqual([message['message'] for message in history['messages']], ['Message 1', 'Message 2'])
+        self.assertFalse(history['truncated'])
+        self.assertFalse([sql for sql in statements if 'intervention_app_message' in sql])
+        await employee.disconnect()
+
+    @override_settings(CHAT_HISTORY_SIZE=1)
+    async def test_older_gaps_fall_back_to_the_database(self):
+        employee = await self.connect(self.employee)
+        client = await self.connect(self.client_user)
+        sequences = await self.send(client, 3)
+        await client.disconnect()
+
+        history = await self.reconnect(sequences[0])
+        self.assertEqual([message['message'] for message in history['messages']], ['Message 1', 'Message 2'])
+        self.assertFalse(history['truncated'])
+        # Past the replay limit the newest messages win; the client pages back through REST
+        with override_settings(CHAT_HISTORY_REPLAY_LIMIT=1):
+            history = await self.reconnect(sequences[0])
+        self.assertEqual([message['message'] for message in history['messages']], ['Message 2'])
+        self.assertTrue(history['truncated'])
+        await employee.disconnect()
+
+    @override_settings(CHAT_HISTORY_SIZE=1)
+    async def test_archived_messages_are_replayed(self):
+        employee = await self.connect(self.employee)
+        client = await self.connect(self.client_user)
+        sequences = await self.send(client, 3)
+        await client.disconnect()
+        archived, _ = await sync_to_async(archive.archive_intervention)(self.intervention.id)
+        self.assertEqual(archived, 3)
+
+        history = await self.reconnect(sequences[0])
+        self.assertEqual([message['message'] for message in history['messages']], ['Message 1', 'Message 2'])
+        self.assertFalse(history['truncated'])
+        with override_settings(CHAT_HISTORY_REPLAY_LIMIT=1):
+            history = await self.reconnect(sequences[0])
+        self.assertEqual([message['message'] for message in history['messages']], ['Message 2'])
+        self.assertTrue(history['truncated'])
+        await employee.disconnect()
+
+
+@override_settings(CHAT_PRESENCE_WINDOW_MS=100, CHAT_TYPING_TIMEOUT_MS=600,
+                   CHAT_RATE_LIMITS={'default': {'connection': None, 'user': None}})
+class PresenceTests(ChatTestCase):
+    async def presence_frames(self, communicator, quiet=0.25):
+        """Presence frames received until nothing arrives for ``quiet`` seconds"""
+        frames = []
+        while not await communicator.receive_nothing(quiet):
+            payload = await communicator.receive_json_from()
+            if payload.get('type') == 'presence':
+                frames.append(payload)
+        return frames
+
+    def names(self, members):
+        return [member['user'] for member in members]
+
+    async def test_members_see_who_is_online(self):
+        employee = await self.connect(self.employee)
+        client = await self.connect(self.client_user)
+        self.assertEqual(self.names((await self.presence_frames(employee))[-1]['online']), ['client', 'employee'])
+
+        await client.disconnect()
+        self.assertEqual(self.names((await self.presence_frames(employee))[-1]['online']), ['employee'])
+        await employee.disconnect()
+
+    async def test_typing_bursts_are_coalesced_without_queries(self):
+        employee = await self.connect(self.employee)
+        client = await self.connect(self.client_user)
+        await self.presence_frames(employee)
+        await self.presence_frames(client)
+
+        statements = await sync_to_async(self.record_queries)()
+        for i in range(20):
+            await client.send_json_to({'action': 'typing', 'typing': i % 2 == 0})
+        await client.send_json_to({'action': 'typing'})
+        frames = await self.presence_frames(employee, quiet=0.15)
+        self.assertLessEqual(len(frames), 2)
+        self.assertEqual(self.names(frames[-1]['typing']), ['client'])
+        self.assertEqual(statements, [])
+
+        # Nobody refreshed the indicator: it lapses
+        frames = await self.presence_frames(employee, quiet=0.8)
+        self.assertEqual(frames[-1]['typing'], [])
+        self.assertEqual(statements, [])
+        await client.disconnect()
+        await employee.disconnect()
+
+
+@override_settings(CHAT_SEND_QUEUE_SIZE=4, CHAT_PRESENCE_WINDOW_MS=50)
+class SlowConsumerTests(ChatTestCase):
+    async def stall_client(self):
+        """Block the client's writer task as a server whose send waits for the socket would"""
+        release = asyncio.Event()
+        send_frame = WireFormatMixin.send_frame
+
+        async def stalled(consumer, frame):
+            if consumer.scope['user'].id == self.client_user.id:
+                await release.wait()
+            await send_frame(consumer, frame)
+
+        patcher = mock.patch.object(WireFormatMixin, 'send_frame', stalled)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(release.set)
+
+    async def broadcast(self, count):
+        for i in range(count):
+            await get_channel_layer().group_send(
+                f'chat_{self.intervention.id}',
+                events.chat_message_event({'type': 'chat', 'message': f'Message {i}', 'seq': i + 1}),
+            )
+
+    async def test_a_full_send_queue_evicts_the_connection(self):
+        client = await self.connect(self.client_user)
+        evictions = WEBSOCKET_EVICTIONS.labels('ChatConsumer', 'slow_consumer')
+        before = evictions.value
+        await self.stall_client()
+
+        # One frame held by the stalled writer, four queued, the sixth doesn't fit
+        await self.broadcast(6)
+        self.assertEqual(await client.receive_output(2), {'type': 'websocket.close', 'code': CLOSE_SLOW_CONSUMER})
+        self.assertEqual(evictions.value, before + 1)
+
+    async def test_lagging_connections_skip_presence_frames(self):
+        employee = await self.connect(self.employee)
+        client = await self.connect(self.client_user)
+        await asyncio.sleep(0.1)
+        dropped = WEBSOCKET_DROPPED_FRAMES.labels('ChatConsumer')
+        before = dropped.value
+        await self.stall_client()
+
+        # Half full: the presence update announcing the employee left is skipped
+        await self.broadcast(3)
+        await employee.disconnect()
+        await asyncio.sleep(0.2)
+        self.assertGreater(dropped.value, before)
+        await client.disconnect()
+
+    @override_settings(CHAT_PING_INTERVAL_MS=50, CHAT_MAX_ACK_LAG_MS=300)
+    async def test_unanswered_pings_evict_a_client_that_answers_them(self):
+        client = await self.connect(self.client_user)
+        evictions = WEBSOCKET_EVICTIONS.labels('ChatConsumer', 'ack_lag')
+        before = evictions.value
+        ping = await self.receive(client)
+        self.assertEqual(ping['type'], 'ping')
+        await client.send_json_to({'action': 'pong', 'id': ping['id']})
+
+        # The client stops reading: whatever buffers its frames, its pings go unanswered
+        while True:
+            output = await client.receive_output(2)
+            if output['type'] == 'websocket.close':
+                break
+        self.assertEqual(output['code'], CLOSE_SLOW_CONSUMER)
+        self.assertEqual(evictions.value, before + 1)
+
+    @override_settings(CHAT_PING_INTERVAL_MS=50, CHAT_MAX_ACK_LAG_MS=300)
+    async def test_clients_that_never_answer_pings_are_not_evicted(self):
+        client = await self.connect(self.client_user)
+        await asyncio.sleep(0.6)
+        await client.send_json_to({'message': 'Still here'})
+        frames = []
+        while not frames or frames[-1]['type'] == 'ping':
+            frames.append(await self.receive(client))
+        self.assertEqual(frames[-1]['message'], 'Still here')
+        await client.disconnect()
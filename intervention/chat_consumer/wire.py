@@ -0,0 +1,113 @@
+"""WebSocket wire formats and the encode-once broadcast helpers.
+
+Clients get JSON text frames by default. A client that offers the ``msgpack``
+subprotocol gets MessagePack binary frames instead, and may send them too.
+
+Group events that are the same for every recipient carry their payload as
+``Frames`` (``frames_for``): it is encoded the first time a member asks for
+a format, and only for the formats members use. Channel layers copy a
+message for every recipient; copies of ``Frames`` are the same object, so
+the members of a group in one process share each encoding instead of
+serializing per recipient.
+"""
+import json
+
+import msgpack
+
+try:
+    import orjson
+except ImportError:  # optional: a faster JSON encoder
+    orjson = None
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+FORMATS = (JSON, MSGPACK)
+
+# One shared encoder: json.dumps with non-default options builds a new one per call
+_json_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def dumps_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload).decode()
+    return _json_encoder.encode(payload)
+
+
+def encode(payload, wire_format):
+    """Return a text (JSON) or bytes (MessagePack) frame for ``payload``"""
+    if wire_format == MSGPACK:
+        return msgpack.packb(payload, use_bin_type=True)
+    return dumps_json(payload)
+
+
+def history_frame(frames, wire_format, truncated=False):
+    """Batch already encoded chat frames into one ``{'type': 'history', 'messages': [...],
+    'truncated': ...}`` frame without decoding and re-encoding them"""
+    if wire_format == MSGPACK:
+        packer = msgpack.Packer(use_bin_type=True)
+        return b''.join([
+            packer.pack_map_header(3),
+            packer.pack('type'), packer.pack('history'),
+            packer.pack('messages'), packer.pack_array_header(len(frames)), *frames,
+            packer.pack('truncated'), packer.pack(truncated),
+        ])
+    return f'{{"type":"history","messages":[{",".join(frames)}],"truncated":{"true" if truncated else "false"}}}'
+
+
+def decode(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        return msgpack.unpackb(bytes_data, raw=False)
+    return json.loads(text_data)
+
+
+class Frames:
+    """``payload`` encoded in each wire format on first use"""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.encoded = {}
+
+    def __getitem__(self, wire_format):
+        frame = self.encoded.get(wire_format)
+        if frame is None:
+            frame = self.encoded[wire_format] = encode(self.payload, wire_format)
+        return frame
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def frames_for(payload):
+    """Frames for group events: ``payload`` encoded at most once per wire format"""
+    return Frames(payload)
+
+
+class WireFormatMixin:
+    """Negotiates a consumer's wire format and sends payloads or pre-encoded frames in it"""
+
+    wire_format = JSON
+
+    async def accept_with_wire_format(self):
+        subprotocols = self.scope.get('subprotocols') or []
+        if MSGPACK in subprotocols:
+            self.wire_format = MSGPACK
+            await self.accept(subprotocol=MSGPACK)
+        elif JSON in subprotocols:
+            await self.accept(subprotocol=JSON)
+        else:
+            await self.accept()
+
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def send_payload(self, payload):
+        await self.send_frame(encode(payload, self.wire_format))
+
+    async def send_frames(self, frames):
+        await self.send_frame(frames[self.wire_format])
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
     'qa',
     'chat_consumer',
     'intervention_app',
+    'search',
+    'metrics',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -53,18 +55,142 @@ ASGI_APPLICATION = 'intervention.asgi.application'
 
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "metrics.layers.InMemoryChannelLayer"
+    },
+}
+
+# Run several ASGI workers on one host by pointing them at a shared broker
+# (`python manage.py runchannelbroker`) through CHANNEL_BROKER_SOCKET.
+CHANNEL_BROKER_SOCKET = os.environ.get('CHANNEL_BROKER_SOCKET')
+if CHANNEL_BROKER_SOCKET:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "metrics.layers.UnixSocketChannelLayer",
+            "CONFIG": {
+                "path": CHANNEL_BROKER_SOCKET,
+            },
+        },
+    }
+
+# Write-behind chat persistence: broadcast immediately, bulk_create every
+# CHAT_WRITE_BEHIND_BATCH_SIZE messages or CHAT_WRITE_BEHIND_FLUSH_MS milliseconds.
+# Off by default: messages are stored before they are broadcast. With it on
+# (CHAT_WRITE_BEHIND=1), messages clients already saw are lost if their batch
+# keeps failing to write
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', '0') == '1'
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100
+CHAT_WRITE_BEHIND_FLUSH_MS = 50
+
+# Reconnecting chat clients pass ?last_seq= and get what they missed in one frame:
+# from the last CHAT_HISTORY_SIZE messages kept per room in memory, or else from
+# the database, at most CHAT_HISTORY_REPLAY_LIMIT messages
+CHAT_HISTORY_SIZE = 200
+CHAT_HISTORY_REPLAY_LIMIT = 500
+
+# Presence and typing indicators are announced to a room at most once per
+# CHAT_PRESENCE_WINDOW_MS; a typing indicator lapses after CHAT_TYPING_TIMEOUT_MS
+# unless the client sends it again
+CHAT_PRESENCE_WINDOW_MS = 500
+CHAT_TYPING_TIMEOUT_MS = 6000
+
+# Incoming chat frames per second and burst, per connection and per user (across
+# the user's connections in a process), by user_type; None lifts a limit. A
+# connection still flooding after CHAT_THROTTLE_CLOSE_AFTER dropped frames is closed.
+CHAT_RATE_LIMITS = {
+    'default': {'connection': (5, 10), 'user': (10, 20)},
+    'employee': {'connection': (10, 20), 'user': (20, 40)},
+    'admin': {'connection': (10, 20), 'user': (20, 40)},
+}
+CHAT_THROTTLE_CLOSE_AFTER = 200
+# Frames queued per connection; a connection with a full queue is closed. Under
+# daphne, whose send doesn't wait for the client, this bounds in-process bursts
+# rather than detecting slow readers (see chat_consumer.flow)
+CHAT_SEND_QUEUE_SIZE = 256
+# Connections get a ping frame this often; a client answering pings that leaves
+# one unanswered for CHAT_MAX_ACK_LAG_MS is closed, whatever the server buffers
+CHAT_PING_INTERVAL_MS = 5000
+CHAT_MAX_ACK_LAG_MS = 30000
+
+# Bursts of new_message notifications for one intervention are summarized per window
+NOTIFICATION_COALESCE_MS = 500
+
+# Seconds a rendered QA list page stays cached (QA changes invalidate it immediately)
+QA_LIST_CACHE_TTL = 300
+
+# JSON logs, written to stderr by a background thread (see intervention.log).
+# LOG_SAMPLING keeps only a fraction of a logger's records below WARNING,
+# e.g. {'chat_consumer': 0.1}.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_SAMPLING = {}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'intervention.log.SamplingFilter',
+            'rates': LOG_SAMPLING,
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'intervention.log.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'intervention.log.QueueListenerHandler',
+            'formatter': 'json',
+            'filters': ['sampling'],
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': LOG_LEVEL,
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
     },
 }
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.authentication.CachedTokenAuthentication',
     ],
 }
 INSTALLED_APPS += ['rest_framework.authtoken']
 
+# Seconds the in-process employee roster stays cached (also invalidated on User save/delete)
+EMPLOYEE_ROSTER_CACHE_TTL = 300
+
+# Auto-assignment (intervention_app.assignment): assign new interventions on
+# creation, and re-read employee workloads from the database this often (seconds)
+INTERVENTION_AUTO_ASSIGN = False
+AUTO_ASSIGN_RECONCILE_INTERVAL = 60
+
+# Most intervention ids accepted by one bulk_update_status / bulk_assign request
+INTERVENTION_BULK_MAX = 5000
+
+# Messages of interventions closed for longer than this many days move to
+# compressed archive chunks (manage.py archive_messages)
+MESSAGE_ARCHIVE_AFTER_DAYS = 30
+
+# In-process token -> user cache shared by REST and WebSocket authentication.
+# Invalidation only reaches the process that deleted the token or changed the
+# user: other workers keep accepting a revoked token for up to TOKEN_CACHE_TTL seconds
+TOKEN_CACHE_MAX_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+
+# /metrics is served to staff users and to scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 MIDDLEWARE = [
+    'metrics.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+import time
+
+from django.test import SimpleTestCase
+
+from .log import JSONFormatter, QueueListenerHandler, SamplingFilter
+
+
+def record(name='app', level=logging.INFO, msg='Hello %s', args=('world',), **extra):
+    result = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    result.__dict__.update(extra)
+    return result
+
+
+class JSONFormatterTests(SimpleTestCase):
+    def test_records_become_one_json_object_with_their_extra_fields(self):
+        entry = json.loads(JSONFormatter().format(record(user_id=7)))
+        self.assertEqual((entry['level'], entry['logger'], entry['message'], entry['user_id']),
+                         ('INFO', 'app', 'Hello world', 7))
+        self.assertNotIn('args', entry)
+
+
+class SamplingFilterTests(SimpleTestCase):
+    def test_rates_follow_the_closest_configured_ancestor(self):
+        sampling = SamplingFilter({'chat': 0.0, 'chat.consumers': 1.0})
+        self.assertEqual(sampling.rate_for('chat.middleware'), 0.0)
+        self.assertEqual(sampling.rate_for('chat.consumers.presence'), 1.0)
+        self.assertEqual(sampling.rate_for('other'), 1.0)
+
+    def test_warnings_are_never_sampled_out(self):
+        sampling = SamplingFilter({'chat': 0.0})
+        self.assertFalse(sampling.filter(record('chat', logging.INFO)))
+        self.assertTrue(sampling.filter(record('chat', logging.WARNING)))
+
+
+class QueueListenerHandlerTests(SimpleTestCase):
+    def test_records_are_written_by_the_listener_thread(self):
+        stream = io.StringIO()
+        handler = QueueListenerHandler(stream)
+        handler.setFormatter(JSONFormatter())
+        args = ['world']
+        entry = record(args=(args,))
+        handler.handle(entry)
+        # The message was frozen when queued
+        args.append('again')
+        handler.close()
+        self.assertEqual(json.loads(stream.getvalue())['message'], "Hello ['world']")
+
+    def test_a_full_queue_drops_records_instead_of_blocking(self):
+        handler = QueueListenerHandler(io.StringIO(), max_queue=1)
+        handler.listener.stop()
+        started = time.perf_counter()
+        for _ in range(3):
+            handler.handle(record())
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(handler.dropped, 2)
+        handler.close()
@@ -17,12 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from authentication.views import employees
+from metrics.views import metrics
 
 
 urlpatterns = [
     path('api/auth/', include('authentication.urls')),
     path('api/qa/', include('qa.urls')),
+    path('api/search/', include('search.urls')),
     path('api/', include('intervention_app.urls')),
     path('api/employees/', employees, name='employees'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -0,0 +1,185 @@
+"""Cold storage for the message history of long-closed interventions.
+
+Messages of interventions closed for more than ``MESSAGE_ARCHIVE_AFTER_DAYS``
+days move out of the hot ``Message`` table into ``MessageArchive`` rows of up
+to ``CHUNK_SIZE`` messages each: a zlib-compressed JSON document of the
+messages' rows, along with their timestamp and id ranges. The
+``archive_messages`` management command does this a few interventions at a
+time, each in its own short transaction, so live writes are never blocked for
+long.
+
+Archived messages keep their ids and timestamps and are served read-only by
+``MessageViewSet`` (and the chat history replay) next to any hot messages the
+intervention still has. Readers ask for a page of history beyond a
+``(timestamp, id)`` key and only decompress the chunks that page can come
+from. Chunks written by later runs may overlap earlier ones in time.
+Archived messages leave the search index, and the intervention's unread
+counters are dropped along with them.
+"""
+import datetime
+import json
+import zlib
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from authentication.models import User
+
+from .models import Intervention, Message, MessageArchive, UnreadCounter
+
+FIELDS = ('id', 'user_id', 'content', 'message_type', 'timestamp', 'is_read')
+
+COMPRESSION_LEVEL = 6
+
+# Messages per archive chunk
+CHUNK_SIZE = 200
+
+DELETE_BATCH_SIZE = 500
+
+
+def pack(rows):
+    """Compress message rows (dicts with ``FIELDS``) into an archive blob"""
+    document = {
+        'fields': FIELDS,
+        'rows': [
+            [row['timestamp'].isoformat() if field == 'timestamp' else row[field] for field in FIELDS]
+            for row in rows
+        ],
+    }
+    return zlib.compress(json.dumps(document, separators=(',', ':')).encode(), COMPRESSION_LEVEL)
+
+
+def unpack(data):
+    """Return the message rows of an archive blob, oldest first"""
+    document = json.loads(zlib.decompress(bytes(data)))
+    rows = [dict(zip(document['fields'], values)) for values in document['rows']]
+    for row in rows:
+        row['timestamp'] = datetime.datetime.fromisoformat(row['timestamp'])
+    rows.sort(key=lambda row: (row['timestamp'], row['id']))
+    return rows
+
+
+def message_key(message):
+    return message.timestamp, message.id
+
+
+def in_bounds(key, bounds):
+    """Whether a ``(timestamp, id)`` key is beyond every ``(lookup, key)`` bound, lookup being gt or lt"""
+    return all(key > bound if lookup == 'gt' else key < bound for lookup, bound in bounds)
+
+
+def to_messages(intervention_id, rows):
+    """Unsaved ``Message`` instances (with their users) of archived rows"""
+    users = User.objects.in_bulk({row['user_id'] for row in rows})
+    messages = []
+    for row in rows:
+        message = Message(intervention_id=intervention_id, **row)
+        message.user = users.get(row['user_id'])
+        messages.append(message)
+    return [message for message in messages if message.user is not None]
+
+
+def archived_messages(intervention_id, bounds=(), descending=False, limit=None):
+    """Archived messages of an intervention beyond the keyset ``bounds``, at most ``limit`` of them.
+
+    ``bounds`` are ``(lookup, (timestamp, id))`` pairs, lookup being gt or lt.
+    Messages come in ``(timestamp, id)`` order, newest first when ``descending``.
+    Chunks are read one at a time, in the order their first (or last) messages
+    would come, and reading stops once no further chunk can hold a message
+    ahead of the ``limit``-th one found.
+    """
+    chunks = MessageArchive.objects.filter(intervention_id=intervention_id)
+    for lookup, (timestamp, message_id) in bounds:
+        if lookup == 'gt':
+            chunks = chunks.filter(Q(last_timestamp__gt=timestamp)
+                                   | Q(last_timestamp=timestamp, max_message_id__gt=message_id))
+        else:
+            chunks = chunks.filter(Q(first_timestamp__lt=timestamp)
+                                   | Q(first_timestamp=timestamp, min_message_id__lt=message_id))
+    if descending:
+        chunks = chunks.order_by('-last_timestamp', '-pk')
+    else:
+        chunks = chunks.order_by('first_timestamp', 'pk')
+
+    key = itemgetter('timestamp', 'id')
+    if limit is None:
+        rows = [row for data in chunks.values_list('data', flat=True) for row in unpack(data)
+                if in_bounds(key(row), bounds)]
+        rows.sort(key=key, reverse=descending)
+        return to_messages(intervention_id, rows)
+
+    rows = []
+    for chunk_id, first_timestamp, last_timestamp in list(chunks.values_list('pk', 'first_timestamp', 'last_timestamp')):
+        if len(rows) >= limit:
+            boundary = rows[limit - 1]['timestamp']
+            if (last_timestamp < boundary) if descending else (first_timestamp > boundary):
+                break
+        data = MessageArchive.objects.filter(pk=chunk_id).values_list('data', flat=True).first()
+        if data is None:
+            continue
+        rows.extend(row for row in unpack(data) if in_bounds(key(row), bounds))
+        rows.sort(key=key, reverse=descending)
+        del rows[limit:]
+    return to_messages(intervention_id, rows)
+
+
+def find_message(intervention_id, message_id):
+    """An archived message of the intervention by id, or None"""
+    chunks = MessageArchive.objects.filter(
+        intervention_id=intervention_id, min_message_id__lte=message_id, max_message_id__gte=message_id
+    ).values_list('data', flat=True)
+    for data in chunks:
+        rows = [row for row in unpack(data) if row['id'] == message_id]
+        if rows:
+            return next(iter(to_messages(intervention_id, rows)), None)
+    return None
+
+
+def candidates(days, after_id=0, limit=100):
+    """Ids of interventions closed for more than ``days`` days that still have hot messages"""
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    return list(
+        Intervention.objects
+        .filter(Q(resolved_at__lte=cutoff) | Q(resolved_at__isnull=True, updated_at__lte=cutoff),
+                status='closed', pk__gt=after_id, messages__isnull=False)
+        .distinct().order_by('pk').values_list('pk', flat=True)[:limit]
+    )
+
+
+def chunk(intervention_id, rows):
+    """An unsaved archive chunk of message rows, oldest first"""
+    ids = [row['id'] for row in rows]
+    return MessageArchive(
+        intervention_id=intervention_id,
+        data=pack(rows),
+        message_count=len(rows),
+        first_timestamp=rows[0]['timestamp'],
+        last_timestamp=rows[-1]['timestamp'],
+        min_message_id=min(ids),
+        max_message_id=max(ids),
+    )
+
+
+def archive_intervention(intervention_id):
+    """Move an intervention's hot messages into archive chunks; returns ``(messages, archive bytes)``"""
+    with transaction.atomic():
+        # Locked, so a concurrent run doesn't archive the same messages again
+        rows = list(
+            Message.objects.filter(intervention_id=intervention_id).select_for_update()
+            .order_by('timestamp', 'id').values(*FIELDS)
+        )
+        if not rows:
+            return 0, 0
+        # Messages written after an earlier run go into new chunks of their own
+        chunks = MessageArchive.objects.bulk_create([
+            chunk(intervention_id, rows[start:start + CHUNK_SIZE]) for start in range(0, len(rows), CHUNK_SIZE)
+        ])
+
+        ids = [row['id'] for row in rows]
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            # Only what was archived: messages written meanwhile stay hot until the next run
+            Message.objects.filter(id__in=ids[start:start + DELETE_BATCH_SIZE]).delete()
+        UnreadCounter.objects.filter(intervention_id=intervention_id).delete()
+    return len(rows), sum(len(archive.data) for archive in chunks)
@@ -0,0 +1,213 @@
+"""Load-aware auto-assignment of interventions to employees.
+
+An employee's workload is the sum of ``PRIORITY_WEIGHTS`` over the
+interventions assigned to them that are not resolved or closed. ``workloads``
+keeps one min-heap of employees per skill (their department and each entry of
+their comma-separated specialization) plus one of everybody, so picking the
+least loaded employee whose skills match an intervention's ``problem_type`` is
+a heap peek rather than a scan.
+
+Heaps are updated incrementally: every workload change pushes a fresh entry
+and older entries of that employee go stale, to be discarded when they reach
+the top. Intervention save/delete signals feed the changes in (see
+``intervention_app.signals``). Writes that skip signals (queryset updates,
+bulk operations) are caught by a reconciliation with the database every
+``AUTO_ASSIGN_RECONCILE_INTERVAL`` seconds, or whenever the employee roster
+changes.
+"""
+import heapq
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count
+
+from authentication.roster import roster_cache
+
+from .models import Intervention
+
+PRIORITY_WEIGHTS = {'low': 1, 'medium': 2, 'high': 3, 'urgent': 5}
+
+TRACKED_FIELDS = ('assigned_to_id', 'status', 'priority')
+
+# Heap of every assignable employee, used when no skill matches
+ANY = None
+
+
+def normalize(text):
+    return (text or '').strip().lower()
+
+
+def skills_of(employee):
+    """Skill keys an employee is indexed under: department and specializations"""
+    skills = {normalize(employee.department)}
+    skills.update(normalize(part) for part in re.split(r'[,;]', employee.specialization or ''))
+    skills.discard('')
+    return skills
+
+
+def tracked_values(intervention):
+    return {field: getattr(intervention, field) for field in TRACKED_FIELDS}
+
+
+def workload_of(values):
+    """``(employee id, weight)`` an intervention adds to a workload, or None"""
+    if values is None or values['assigned_to_id'] is None or values['status'] in Intervention.RESOLVED_STATUSES:
+        return None
+    return values['assigned_to_id'], PRIORITY_WEIGHTS.get(values['priority'], 1)
+
+
+class WorkloadBalancer:
+    """Process-wide employee workloads, indexed by skill in lazy-deletion min-heaps"""
+
+    def __init__(self, reconcile_interval):
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._roster = None
+        self._reconciled_at = 0
+        self._changes = 0
+        # employee id -> employee
+        self.employees = {}
+        # employee id -> current workload / heap entry version / skill keys (ANY included)
+        self.loads = {}
+        self._versions = {}
+        self._skills = {}
+        # skill key -> [(workload, employee id, version)]
+        self._heaps = {}
+        self._members = {}
+
+    def touches_workload(self, update_fields):
+        # Nothing to keep current before the first assignment loads the workloads
+        return self.loaded and (update_fields is None or bool({'assigned_to', *TRACKED_FIELDS} & set(update_fields)))
+
+    def ensure_fresh(self):
+        roster = roster_cache.get()
+        if (not self.loaded or roster is not self._roster
+                or time.monotonic() - self._reconciled_at >= self.reconcile_interval):
+            self.reconcile(roster)
+
+    def reconcile(self, roster=None, attempts=3):
+        """Rebuild every workload and heap from the database"""
+        roster = roster if roster is not None else roster_cache.get()
+        employees = [user for user in roster if user.user_type == 'employee']
+        for attempt in range(attempts):
+            with self._lock:
+                changes = self._changes
+            loads = dict.fromkeys((employee.id for employee in employees), 0)
+            rows = (
+                Intervention.objects.filter(assigned_to_id__in=loads)
+                .exclude(status__in=Intervention.RESOLVED_STATUSES)
+                .values('assigned_to_id', 'priority').annotate(count=Count('id'))
+            )
+            for row in rows:
+                loads[row['assigned_to_id']] += PRIORITY_WEIGHTS.get(row['priority'], 1) * row['count']
+            with self._lock:
+                # Changes recorded while loading may or may not be in the rows: load again
+                if changes != self._changes and attempt < attempts - 1:
+                    continue
+                self.employees = {employee.id: employee for employee in employees}
+                self.loads = loads
+                self._versions = dict.fromkeys(loads, 0)
+                self._skills = {employee.id: {ANY, *skills_of(employee)} for employee in employees}
+                self._members = {}
+                for employee_id, skills in self._skills.items():
+                    for skill in skills:
+                        self._members.setdefault(skill, set()).add(employee_id)
+                self._heaps = {skill: self._heap_of(members) for skill, members in self._members.items()}
+                self._roster = roster
+                self._reconciled_at = time.monotonic()
+                self.loaded = True
+                return
+
+    def _heap_of(self, members):
+        heap = [(self.loads[employee_id], employee_id, self._versions[employee_id]) for employee_id in members]
+        heapq.heapify(heap)
+        return heap
+
+    def _adjust(self, employee_id, amount):
+        # Caller holds the lock
+        if employee_id not in self.loads or not amount:
+            return
+        self.loads[employee_id] += amount
+        version = self._versions[employee_id] = self._versions[employee_id] + 1
+        entry = (self.loads[employee_id], employee_id, version)
+        for skill in self._skills[employee_id]:
+            heap = self._heaps[skill]
+            heapq.heappush(heap, entry)
+            if len(heap) > 2 * len(self._members[skill]) + 16:
+                # Mostly stale entries: rebuild from the live workloads
+                self._heaps[skill] = self._heap_of(self._members[skill])
+
+    def _least_loaded(self, skill):
+        heap = self._heaps.get(skill)
+        while heap:
+            _, employee_id, version = heap[0]
+            if self._versions[employee_id] == version:
+                return employee_id
+            heapq.heappop(heap)
+        return None
+
+    def record_change(self, old_values, new_values, reserved=None):
+        """Apply an intervention's change; ``reserved`` is a ``reserve()`` result already counted"""
+        if not self.loaded:
+            return
+        old, new = workload_of(old_values), workload_of(new_values)
+        with self._lock:
+            self._changes += 1
+            if old is not None:
+                self._adjust(old[0], -old[1])
+            if new is not None and new != reserved:
+                self._adjust(new[0], new[1])
+            if reserved is not None and new != reserved:
+                self._adjust(reserved[0], -reserved[1])
+
+    def reserve(self, intervention):
+        """Pick the least loaded employee matching the intervention and count its weight for them.
+
+        Returns ``(employee id, weight)``, or None when there is no employee.
+        """
+        self.ensure_fresh()
+        weight = PRIORITY_WEIGHTS.get(intervention.priority, 1)
+        with self._lock:
+            employee_id = self._least_loaded(normalize(intervention.problem_type) or ANY)
+            if employee_id is None:
+                employee_id = self._least_loaded(ANY)
+            if employee_id is None:
+                return None
+            self._changes += 1
+            self._adjust(employee_id, weight)
+        return employee_id, weight
+
+    def release(self, reservation):
+        """Undo a ``reserve()`` whose assignment wasn't saved"""
+        with self._lock:
+            self._changes += 1
+            self._adjust(reservation[0], -reservation[1])
+
+
+workloads = WorkloadBalancer(reconcile_interval=getattr(settings, 'AUTO_ASSIGN_RECONCILE_INTERVAL', 60))
+
+
+def auto_assign(intervention):
+    """Assign ``intervention`` to the least loaded matching employee and save it.
+
+    Returns the employee, or None when nobody can take it.
+    """
+    reservation = workloads.reserve(intervention)
+    if reservation is None:
+        return None
+    employee = workloads.employees[reservation[0]]
+    intervention.assigned_to = employee
+    intervention.status = 'in_progress'
+    # The signal handler sees the reservation and doesn't count the weight twice
+    intervention._workload_reservation = reservation
+    try:
+        intervention.save()
+    except Exception:
+        workloads.release(reservation)
+        raise
+    finally:
+        intervention._workload_reservation = None
+    return employee
@@ -0,0 +1,68 @@
+"""Status changes and assignments applied to many interventions at once.
+
+The interventions are written with one ``bulk_update`` and their system
+messages with one ``bulk_create``, in a single transaction. Bulk operations
+skip the save signals, so the dashboard stats, employee workloads, unread
+counters and search index are updated here instead.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from search.index import index_objects
+
+from . import assignment, stats
+from .models import Intervention, Message
+from .unread import record_new_messages
+
+BATCH_SIZE = 500
+
+
+def update_status(interventions, new_status, user):
+    """Set ``new_status`` on every intervention, each with a system message by ``user``"""
+    def change(intervention):
+        intervention.status = new_status
+        return f"Status updated to: {intervention.get_status_display()}"
+
+    return _apply(interventions, ['status'], change, user)
+
+
+def assign(interventions, employee, user):
+    """Assign every intervention to ``employee`` and mark it in progress, like ``assign_employee``"""
+    name = employee.get_full_name() or employee.username
+
+    def change(intervention):
+        intervention.assigned_to = employee
+        intervention.status = 'in_progress'
+        return f"Intervention assigned to {name}"
+
+    return _apply(interventions, ['assigned_to', 'status'], change, user)
+
+
+def _apply(interventions, fields, change, user):
+    """Run ``change`` on every intervention (it returns the system message text) and store
+    the interventions and their messages; returns the messages"""
+    if not interventions:
+        return []
+    now = timezone.now()
+    stat_changes, workload_changes, messages = [], [], []
+    for intervention in interventions:
+        old_stats, old_workload = stats.tracked_values(intervention), assignment.tracked_values(intervention)
+        content = change(intervention)
+        intervention.updated_at = now
+        intervention.stamp_resolved_at(now)
+        stat_changes.append((old_stats, stats.tracked_values(intervention)))
+        workload_changes.append((old_workload, assignment.tracked_values(intervention)))
+        messages.append(Message(
+            intervention=intervention, user=user, content=content,
+            message_type='system_message', timestamp=now,
+        ))
+
+    with transaction.atomic():
+        Intervention.objects.bulk_update(interventions, [*fields, 'updated_at', 'resolved_at'], batch_size=BATCH_SIZE)
+        Message.objects.bulk_create(messages, batch_size=BATCH_SIZE)
+        stats.record_changes(stat_changes)
+        record_new_messages(messages)
+        index_objects(messages)
+    for old_values, new_values in workload_changes:
+        assignment.workloads.record_change(old_values, new_values)
+    return messages
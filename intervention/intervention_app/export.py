@@ -0,0 +1,207 @@
+"""Streaming exports of interventions, optionally with their messages, as NDJSON or CSV.
+
+Rows are read with ``.values_list(...).iterator()`` and written out as they
+come, so memory stays flat however large the export is. Messages are read in
+one more query ordered by intervention and merged with the interventions as
+both streams advance; archived messages (see ``intervention_app.archive``)
+come from a third stream of archive chunks, unpacked one intervention at a time.
+
+NDJSON has one line per intervention, with its ``messages`` nested. CSV has
+one row per intervention, or per message when messages are included, the
+intervention's columns repeated on each of its messages' rows.
+"""
+import csv
+import datetime
+import heapq
+import itertools
+from operator import itemgetter
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from authentication.models import User
+from chat_consumer.wire import dumps_json
+
+from .archive import unpack
+from .models import Message, MessageArchive
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# Export column -> lookup
+INTERVENTION_COLUMNS = {
+    'id': 'id',
+    'title': 'title',
+    'description': 'description',
+    'problem_type': 'problem_type',
+    'priority': 'priority',
+    'status': 'status',
+    'created_by_id': 'created_by_id',
+    'created_by': 'created_by__username',
+    'assigned_to_id': 'assigned_to_id',
+    'assigned_to': 'assigned_to__username',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'resolved_at': 'resolved_at',
+    'chat_ended_by_employee': 'chat_ended_by_employee',
+    'chat_ended_at': 'chat_ended_at',
+    'chat_rating': 'chat_rating',
+}
+
+MESSAGE_COLUMNS = {
+    'id': 'id',
+    'user_id': 'user_id',
+    'user': 'user__username',
+    'message_type': 'message_type',
+    'content': 'content',
+    'timestamp': 'timestamp',
+    'is_read': 'is_read',
+}
+
+# Rows fetched from the database at a time
+CHUNK_SIZE = 2000
+ARCHIVE_CHUNK_SIZE = 20
+
+# Rows per chunk of the response
+ROWS_PER_CHUNK = 500
+
+
+def plain(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def intervention_rows(queryset):
+    rows = queryset.order_by('pk').values_list(*INTERVENTION_COLUMNS.values()).iterator(chunk_size=CHUNK_SIZE)
+    for values in rows:
+        yield dict(zip(INTERVENTION_COLUMNS, map(plain, values)))
+
+
+def hot_messages(queryset):
+    """``(intervention id, messages)`` from the Message table, by intervention id"""
+    rows = (
+        Message.objects.filter(intervention_id__in=queryset.values('pk'))
+        .order_by('intervention_id', 'timestamp', 'id')
+        .values_list('intervention_id', *MESSAGE_COLUMNS.values())
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for intervention_id, group in itertools.groupby(rows, key=itemgetter(0)):
+        yield intervention_id, [dict(zip(MESSAGE_COLUMNS, map(plain, values[1:]))) for values in group]
+
+
+def archived_messages(queryset):
+    """``(intervention id, messages)`` from the archives, by intervention id"""
+    chunks = (
+        MessageArchive.objects.filter(intervention_id__in=queryset.values('pk'))
+        .order_by('intervention_id', 'first_timestamp', 'pk')
+        .values_list('intervention_id', 'data')
+        .iterator(chunk_size=ARCHIVE_CHUNK_SIZE)
+    )
+    usernames = {}
+    for intervention_id, group in itertools.groupby(chunks, key=itemgetter(0)):
+        # Chunks of later archive runs may overlap earlier ones
+        rows = sorted(itertools.chain.from_iterable(unpack(data) for _, data in group),
+                      key=itemgetter('timestamp', 'id'))
+        missing = {row['user_id'] for row in rows} - usernames.keys()
+        if missing:
+            usernames.update(User.objects.filter(id__in=missing).values_list('id', 'username'))
+        yield intervention_id, [
+            {column: plain(usernames.get(row['user_id']) if column == 'user' else row[column])
+             for column in MESSAGE_COLUMNS}
+            for row in rows
+        ]
+
+
+def messages_by_intervention(queryset):
+    """``(intervention id, messages)`` of the interventions in ``queryset`` that have any"""
+    groups = heapq.merge(hot_messages(queryset), archived_messages(queryset), key=itemgetter(0))
+    for intervention_id, parts in itertools.groupby(groups, key=itemgetter(0)):
+        parts = [messages for _, messages in parts]
+        if len(parts) == 1:
+            yield intervention_id, parts[0]
+        else:
+            yield intervention_id, sorted(itertools.chain(*parts), key=itemgetter('timestamp', 'id'))
+
+
+def with_messages(interventions, groups):
+    """Pair every intervention row with its messages, both streams being ordered by intervention id"""
+    pending = next(groups, None)
+    for row in interventions:
+        while pending is not None and pending[0] < row['id']:
+            pending = next(groups, None)
+        if pending is not None and pending[0] == row['id']:
+            yield row, pending[1]
+            pending = next(groups, None)
+        else:
+            yield row, []
+
+
+def ndjson_lines(records, include_messages):
+    for row, messages in records:
+        if include_messages:
+            row['messages'] = messages
+        yield dumps_json(row) + '\n'
+
+
+class Echo:
+    """File-like object for ``csv.writer`` that hands back what is written"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records, include_messages):
+    writer = csv.writer(Echo())
+    header = list(INTERVENTION_COLUMNS)
+    if include_messages:
+        header += [f'message_{column}' for column in MESSAGE_COLUMNS]
+    yield writer.writerow(header)
+    for row, messages in records:
+        values = list(row.values())
+        if not include_messages:
+            yield writer.writerow(values)
+        elif not messages:
+            yield writer.writerow(values + [None] * len(MESSAGE_COLUMNS))
+        for message in messages:
+            yield writer.writerow(values + list(message.values()))
+
+
+def export_lines(queryset, export_format, include_messages=False):
+    """Lines of an export of the interventions in ``queryset``"""
+    records = intervention_rows(queryset)
+    if include_messages:
+        records = with_messages(records, messages_by_intervention(queryset))
+    else:
+        records = ((row, []) for row in records)
+    if export_format == 'csv':
+        return csv_lines(records, include_messages)
+    return ndjson_lines(records, include_messages)
+
+
+def chunks(lines):
+    while chunk := ''.join(itertools.islice(lines, ROWS_PER_CHUNK)):
+        yield chunk
+
+
+async def async_chunks(lines):
+    # Every step runs in the one thread that serves sync code, so the
+    # database cursors stay on the connection that opened them
+    next_chunk = sync_to_async(lambda: ''.join(itertools.islice(lines, ROWS_PER_CHUNK)), thread_sensitive=True)
+    try:
+        while chunk := await next_chunk():
+            yield chunk
+    finally:
+        await sync_to_async(lines.close, thread_sensitive=True)()
+
+
+def streaming_response(request, lines, export_format, filename):
+    """Stream ``lines``; under ASGI through an async iterator, which Django doesn't buffer"""
+    if isinstance(request, ASGIRequest):
+        content = async_chunks(lines)
+    else:
+        content = chunks(lines)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
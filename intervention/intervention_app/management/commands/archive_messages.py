@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from intervention_app import archive
+from intervention_app.models import Message
+
+
+class Command(BaseCommand):
+    help = "Move the messages of long-closed interventions into compressed archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'MESSAGE_ARCHIVE_AFTER_DAYS', 30),
+                            help="Archive interventions closed for more than this many days")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Interventions looked up per batch")
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help="Seconds to sleep between batches, to leave room for live traffic")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Stop after archiving this many interventions")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be archived")
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError("--days must be >= 0 and --batch-size >= 1")
+        limit = options['limit']
+        interventions = messages = size = 0
+        last_id = 0
+        while limit is None or interventions < limit:
+            batch = archive.candidates(options['days'], after_id=last_id, limit=options['batch_size'])
+            if not batch:
+                break
+            if limit is not None:
+                batch = batch[:limit - interventions]
+            for intervention_id in batch:
+                if options['dry_run']:
+                    count = Message.objects.filter(intervention_id=intervention_id).count()
+                else:
+                    # One short transaction per intervention
+                    count, archive_size = archive.archive_intervention(intervention_id)
+                    size += archive_size
+                interventions += 1
+                messages += count
+            last_id = batch[-1]
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        if options['dry_run']:
+            self.stdout.write(f"Would archive {messages} messages of {interventions} interventions")
+            return
+        self.stdout.write(f"Archived {messages} messages of {interventions} interventions")
+        if interventions:
+            self.stdout.write(f"Wrote {size} bytes of archives")
@@ -0,0 +1,368 @@
+import json
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import get_resolver, resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from authentication.roster import roster_cache
+from authentication.token_cache import token_cache
+from intervention_app import stats
+from intervention_app.models import Intervention, Message
+from qa.models import QA
+
+# URL configurations whose routes must all be exercised
+COVERED_URLCONFS = ('intervention_app.urls', 'authentication.urls', 'qa.urls')
+
+# Collection endpoints are also measured on a dataset this many times smaller
+SMALL_DATASET_DIVISOR = 20
+
+
+# What a request should cost, in queries, with nothing cached. Budgets are built
+# from these targets, so a budget says what an endpoint needs rather than what it
+# happened to run when the budget was written.
+AUTH = 1            # token -> user
+ROSTER = 1          # the employee roster of an intervention response
+PAGE = 2            # COUNT and the page's rows
+TRANSACTION = 2     # BEGIN and COMMIT, which SQLite runs as statements
+SEARCH = 1          # upserting one row into the search index
+STATS = 1           # the dashboard statistics UPDATE
+SAVE = TRANSACTION + 2   # an intervention update: locked read of the stored values, UPDATE
+UNREAD = 1          # bumping the recipients' unread counters
+NEW_UNREAD = 2      # first message to a recipient: find and create its counter
+MESSAGE = 1 + SEARCH  # INSERT of a message and its search entry
+INTERVENTION_BODY = 1 + 1 + ROSTER  # the intervention, its messages and the roster
+
+
+class Endpoint:
+    """One benchmarked request and the most SQL queries it may run.
+
+    ``path`` and ``data`` may be callables taking the dataset, so each repeat
+    can target fresh rows (e.g. for DELETE). Budgets do not depend on the
+    dataset size: an endpoint whose query count grows with the data is an N+1.
+    ``collection`` endpoints return rows in proportion to the dataset; they are
+    also run against a smaller dataset and must run as many queries there.
+    """
+
+    def __init__(self, name, method, path, user, budget, data=None, status=200, collection=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.budget = budget
+        self.data = data
+        self.status = status
+        self.collection = collection
+
+    def resolve(self, value, dataset):
+        return value(dataset) if callable(value) else value
+
+
+def intervention_path(suffix=''):
+    return lambda dataset: f"/api/interventions/{dataset.intervention.id}/{suffix}"
+
+
+def messages_path(suffix=''):
+    return lambda dataset: f"/api/interventions/{dataset.intervention.id}/messages/{suffix}"
+
+
+ENDPOINTS = [
+    # authentication.urls
+    Endpoint('login', 'post', '/api/auth/login', None, 2,  # the user, its token
+             data=lambda dataset: {'username': dataset.client.username, 'password': Dataset.PASSWORD}),
+    Endpoint('register', 'post', '/api/auth/register', None, 4, status=201,  # two uniqueness checks, two INSERTs
+             data=lambda dataset: {'username': dataset.unique('new-user'), 'email': f"{dataset.unique('new')}@example.com",
+                                   'password': 'benchmark-password'}),
+    Endpoint('employees', 'get', '/api/auth/employees/', 'client', AUTH + ROSTER, collection=True),
+    # qa.urls: the list's state (count and latest save) for the ETag, then the rows
+    Endpoint('qa list', 'get', '/api/qa/qa-list/', 'client', AUTH + 1 + 1, collection=True),
+    Endpoint('qa list page', 'get', '/api/qa/qa-list/?limit=20', 'client', AUTH + 1 + PAGE, collection=True),
+    # intervention_app.urls
+    Endpoint('api root', 'get', '/api/', 'client', AUTH),
+    Endpoint('interventions (employee)', 'get', '/api/interventions/', 'employee', AUTH + INTERVENTION_BODY,
+             collection=True),
+    Endpoint('interventions (client)', 'get', '/api/interventions/', 'client', AUTH + INTERVENTION_BODY,
+             collection=True),
+    Endpoint('interventions page', 'get', '/api/interventions/?limit=20', 'employee', AUTH + PAGE, collection=True),
+    # INSERT, then the (empty) messages and the roster for the response
+    Endpoint('intervention create', 'post', '/api/interventions/', 'client',
+             AUTH + 1 + STATS + SEARCH + 1 + ROSTER, status=201,
+             data={'title': 'Benchmark intervention', 'description': 'Created by benchmark_api', 'priority': 'high'}),
+    Endpoint('intervention detail', 'get', intervention_path(), 'employee', AUTH + INTERVENTION_BODY),
+    # The response is read back with its messages after the save
+    Endpoint('intervention update', 'patch', intervention_path(), 'employee',
+             AUTH + 1 + SAVE + SEARCH + STATS + INTERVENTION_BODY, data={'priority': 'urgent'}),
+    # Cascades: unread counters, archives, the intervention's search entry
+    Endpoint('intervention delete', 'delete', lambda dataset: f"/api/interventions/{dataset.spare_intervention().id}/",
+             'employee', AUTH + 2 + TRANSACTION + 3 + SEARCH + STATS, status=204),
+    Endpoint('assign employee', 'post', intervention_path('assign_employee/'), 'employee',
+             AUTH + 2 + SAVE + SEARCH + STATS + MESSAGE + UNREAD + NEW_UNREAD + TRANSACTION,
+             data=lambda dataset: {'employee_id': dataset.employee.id}),
+    # Candidate workloads instead of the employee lookup
+    Endpoint('auto assign', 'post', intervention_path('auto_assign/'), 'employee',
+             AUTH + 2 + SAVE + SEARCH + STATS + MESSAGE + UNREAD + NEW_UNREAD + TRANSACTION),
+    # Two queue levels, the conditional claim, then the claimed row
+    Endpoint('claim next', 'post', '/api/interventions/claim_next/', 'employee',
+             AUTH + 3 + STATS + 1 + MESSAGE + UNREAD + NEW_UNREAD + TRANSACTION),
+    Endpoint('update status', 'post', intervention_path('update_status/'), 'employee',
+             AUTH + 1 + SAVE + SEARCH + STATS + MESSAGE + UNREAD,
+             data={'status': 'waiting_for_client'}),
+    # One statement per table for the whole batch
+    Endpoint('bulk update status', 'post', '/api/interventions/bulk_update_status/', 'employee',
+             AUTH + 1 + TRANSACTION + 1 + MESSAGE + UNREAD + NEW_UNREAD + STATS,
+             data=lambda dataset: {'ids': dataset.bulk_ids, 'status': 'waiting_for_client'}),
+    Endpoint('bulk assign', 'post', '/api/interventions/bulk_assign/', 'employee',
+             AUTH + 2 + TRANSACTION + 1 + MESSAGE + UNREAD + STATS,
+             data=lambda dataset: {'ids': dataset.bulk_ids, 'employee_id': dataset.employee.id}),
+    Endpoint('unread counts', 'get', '/api/interventions/unread_counts/', 'client', AUTH + 1, collection=True),
+    Endpoint('stats', 'get', '/api/interventions/stats/', 'employee', AUTH + 1),
+    # Interventions, messages and archives, each streamed in one query
+    Endpoint('export', 'get', '/api/interventions/export/?export_format=csv&include_messages=1', 'employee',
+             AUTH + 3, collection=True),
+    # Archives, then the hot messages
+    Endpoint('messages', 'get', messages_path(), 'client', AUTH + 2, collection=True),
+    Endpoint('messages page', 'get', messages_path('?page_size=50'), 'client', AUTH + 2, collection=True),
+    Endpoint('message create', 'post', messages_path(), 'client',
+             AUTH + 1 + MESSAGE + UNREAD + NEW_UNREAD + TRANSACTION, status=201, data={'content': 'Benchmark message'}),
+    Endpoint('message detail', 'get', lambda dataset: f"{messages_path()(dataset)}{dataset.message.id}/", 'client',
+             AUTH + 1),
+    # The message, its UPDATE, and its intervention for the search entry
+    Endpoint('message update', 'patch', lambda dataset: f"{messages_path()(dataset)}{dataset.message.id}/",
+             'client', AUTH + 1 + 1 + 1 + SEARCH, data={'content': 'Edited benchmark message'}),
+    Endpoint('message delete', 'delete', lambda dataset: f"{messages_path()(dataset)}{dataset.spare_message().id}/",
+             'client', AUTH + 1 + TRANSACTION + 1 + SEARCH, status=204),
+    # Watermark, newly read messages, conditional watermark update, is_read
+    Endpoint('mark read', 'post', messages_path('mark_read/'), 'employee', AUTH + 4,
+             data=lambda dataset: {'up_to': dataset.message.id}),
+]
+
+
+class Dataset:
+    """Synthetic users, interventions, messages and QA entries"""
+
+    PASSWORD = 'benchmark-password'
+    # Unassigned open interventions, enough for every claim_next repeat
+    QUEUED = 100
+    # Interventions changed by each bulk request
+    BULK = 20
+
+    def __init__(self, interventions, messages, qa, employees):
+        self.counter = 0
+        hashed = User(password='')
+        hashed.set_password(self.PASSWORD)
+        users = User.objects.bulk_create(
+            [User(username=f'bench-employee-{i}', email=f'bench-employee-{i}@example.com',
+                  user_type='employee', password=hashed.password) for i in range(employees)]
+            + [User(username='bench-client', email='bench-client@example.com',
+                    user_type='client', password=hashed.password)]
+        )
+        self.employee, self.client = users[0], users[-1]
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+
+        created = Intervention.objects.bulk_create([
+            Intervention(title=f'Benchmark intervention {i}', description='Synthetic benchmark data',
+                         created_by=self.client, assigned_to=users[i % employees],
+                         priority=[choice for choice, _ in Intervention.PRIORITY_CHOICES][i % 4])
+            for i in range(interventions)
+        ])
+        self.intervention = created[0]
+        self.bulk_ids = [intervention.id for intervention in created[:self.BULK]]
+        # The triage queue, for claim_next
+        Intervention.objects.bulk_create([
+            Intervention(title=f'Unassigned intervention {i}', description='Synthetic benchmark data',
+                         created_by=self.client, priority='high')
+            for i in range(self.QUEUED)
+        ])
+        batch = []
+        for intervention in created:
+            for i in range(messages):
+                sender = self.client if i % 2 == 0 else intervention.assigned_to
+                batch.append(Message(
+                    intervention=intervention, user=sender, content=f'Benchmark message {i}',
+                    message_type='client_message' if sender is self.client else 'employee_message',
+                ))
+            if len(batch) >= 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+        self.message = Message.objects.filter(intervention=self.intervention).first()
+        QA.objects.bulk_create([
+            QA(question=f'Benchmark question {i}?', answer='Benchmark answer', author=self.employee)
+            for i in range(qa)
+        ])
+        stats.rebuild()
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f'{prefix}-{self.counter}'
+
+    def spare_intervention(self):
+        return Intervention.objects.create(title='Spare', description='To be deleted', created_by=self.client)
+
+    def spare_message(self):
+        return Message.objects.create(intervention=self.intervention, user=self.client, content='To be deleted')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every REST endpoint on a synthetic dataset and fail when one "
+        "runs more SQL queries than its budget, or when a collection endpoint "
+        "runs more queries than on a smaller dataset"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interventions', type=int, default=200, help="Interventions in the dataset")
+        parser.add_argument('--messages', type=int, default=20, help="Messages per intervention")
+        parser.add_argument('--qa', type=int, default=200, help="QA entries in the dataset")
+        parser.add_argument('--employees', type=int, default=10, help="Employees in the dataset")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed requests per endpoint")
+        parser.add_argument('--output', default=None, help="Write the results as JSON to this file")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        if options['interventions'] < 1 or options['employees'] < 1 or options['messages'] < 1:
+            raise CommandError("--interventions, --employees and --messages must be at least 1")
+        uncovered = self.uncovered_routes()
+        if uncovered:
+            raise CommandError(f"No benchmark for: {', '.join(sorted(uncovered))}")
+
+        sizes = {key: options[key] for key in ('interventions', 'messages', 'qa', 'employees')}
+        small_sizes = {key: max(2, size // SMALL_DATASET_DIVISOR) for key, size in sizes.items()}
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            small = self.run_dataset([endpoint for endpoint in ENDPOINTS if endpoint.collection], small_sizes, 1)
+            call_command('flush', interactive=False, verbosity=0)
+            results = self.run_dataset(ENDPOINTS, sizes, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        small_queries = {result['name']: result['queries'] for result in small}
+        for result in results:
+            result['small_dataset_queries'] = small_queries.get(result['name'])
+            result['grows_with_data'] = (
+                result['small_dataset_queries'] is not None and result['queries'] > result['small_dataset_queries']
+            )
+
+        report = {
+            'dataset': sizes,
+            'small_dataset': small_sizes,
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            for result in results:
+                flag = '' if result['within_budget'] else '  OVER BUDGET'
+                if result['grows_with_data']:
+                    flag += f"  GROWS WITH DATA (from {result['small_dataset_queries']})"
+                self.stdout.write(
+                    f"{result['name']:<26} {result['method'].upper():<6} {result['median_ms']:>8.1f} ms "
+                    f"{result['queries']:>4}/{result['budget']:<3} queries{flag}"
+                )
+
+        failures = self.failures(results)
+        if failures:
+            raise CommandError("; ".join(failures))
+
+    def run_dataset(self, endpoints, sizes, repeat):
+        """Measure ``endpoints`` against a dataset of ``sizes``"""
+        dataset = Dataset(sizes['interventions'], sizes['messages'], sizes['qa'], sizes['employees'])
+        return [self.measure(endpoint, dataset, repeat) for endpoint in endpoints]
+
+    def failures(self, results):
+        failures = []
+        for result in results:
+            if result['unexpected_status']:
+                failures.append(f"{result['name']}: {result['unexpected_status']}")
+            elif result['grows_with_data']:
+                failures.append(
+                    f"{result['name']}: {result['queries']} queries, {result['small_dataset_queries']} "
+                    f"on the small dataset"
+                )
+            elif not result['within_budget']:
+                failures.append(f"{result['name']}: {result['queries']} queries (budget {result['budget']})")
+        return failures
+
+    def uncovered_routes(self):
+        """Route names in COVERED_URLCONFS that no endpoint requests"""
+        def names(patterns):
+            for pattern in patterns:
+                if hasattr(pattern, 'url_patterns'):
+                    yield from names(pattern.url_patterns)
+                elif pattern.name:
+                    yield pattern.name
+
+        routes = {name for urlconf in COVERED_URLCONFS for name in names(get_resolver(urlconf).url_patterns)}
+        benchmarked = set()
+        for endpoint in ENDPOINTS:
+            path = endpoint.path if isinstance(endpoint.path, str) else endpoint.path(_PathProbe())
+            benchmarked.add(resolve(path.split('?')[0]).url_name)
+        return routes - benchmarked
+
+    def measure(self, endpoint, dataset, repeat):
+        timings, queries, unexpected = [], 0, None
+        for _ in range(repeat):
+            client = APIClient()
+            if endpoint.user is not None:
+                user = dataset.client if endpoint.user == 'client' else dataset.employee
+                client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=user).key}')
+            path = endpoint.resolve(endpoint.path, dataset)
+            data = endpoint.resolve(endpoint.data, dataset)
+
+            # Measure cold requests: budgets must hold when nothing is cached
+            token_cache.clear()
+            roster_cache.invalidate()
+            cache.clear()
+
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(client, endpoint.method)(path, data, format='json')
+                if response.streaming:
+                    # Streamed bodies are produced (and queried) as they are read
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(captured))
+            if response.status_code != endpoint.status and unexpected is None:
+                unexpected = f"status {response.status_code} (expected {endpoint.status})"
+
+        return {
+            'name': endpoint.name,
+            'method': endpoint.method,
+            'path': path,
+            'queries': queries,
+            'budget': endpoint.budget,
+            'within_budget': queries <= endpoint.budget,
+            'small_dataset_queries': None,
+            'grows_with_data': False,
+            'unexpected_status': unexpected,
+            'median_ms': statistics.median(timings),
+            'min_ms': min(timings),
+            'max_ms': max(timings),
+        }
+
+
+class _PathProbe:
+    """Stands in for a dataset when resolving endpoint paths to route names"""
+
+    class _Row:
+        id = 1
+
+    intervention = message = employee = client = _Row()
+
+    def spare_intervention(self):
+        return self._Row()
+
+    def spare_message(self):
+        return self._Row()
@@ -0,0 +1,34 @@
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+
+from intervention_app import stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the dashboard statistics from scratch and check them against live aggregates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check-only', action='store_true',
+                            help="Compare the stored statistics without rebuilding them")
+
+    def handle(self, *args, **options):
+        if options['check_only']:
+            stored = stats.snapshot()
+        else:
+            stored = stats.rebuild()
+            self.stdout.write(f"Rebuilt {len(stored)} statistics")
+
+        live = stats.live_aggregates()
+        mismatches = []
+        for key in sorted(set(stored) | set(live)):
+            stored_count, stored_total = stored.get(key, (0, 0.0))
+            live_count, live_total = live.get(key, (0, 0.0))
+            if stored_count != live_count or not math.isclose(stored_total, live_total, rel_tol=1e-9, abs_tol=1e-3):
+                mismatches.append(key)
+                self.stdout.write(
+                    f"{key}: stored {stored_count} / {stored_total} != live {live_count} / {live_total}"
+                )
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} statistics differ from the live aggregates")
+        self.stdout.write("Statistics match the live aggregates")
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intervention_app', '0004_intervention_chat_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['intervention', 'timestamp', 'id'], name='message_intervention_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intervention_app', '0006_message_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('intervention', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to='intervention_app.intervention')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'intervention'), name='unique_unread_counter')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:01
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+# Frozen copies of intervention_app.stats as of this migration
+TRACKED_FIELDS = ('status', 'priority', 'chat_rating', 'created_at', 'resolved_at')
+STAT_KEYS = [
+    'status:open', 'status:in_progress', 'status:waiting_for_client', 'status:waiting_for_employee',
+    'status:resolved', 'status:closed',
+    'priority:low', 'priority:medium', 'priority:high', 'priority:urgent',
+    'rating', 'resolution',
+]
+
+
+def compute(rows):
+    totals = defaultdict(lambda: [0, 0.0])
+    for values in rows:
+        contributions = {
+            f"status:{values['status']}": (1, 0.0),
+            f"priority:{values['priority']}": (1, 0.0),
+        }
+        if values['chat_rating'] is not None:
+            contributions['rating'] = (1, float(values['chat_rating']))
+        if values['resolved_at'] is not None and values['created_at'] is not None:
+            contributions['resolution'] = (1, (values['resolved_at'] - values['created_at']).total_seconds())
+        for key, (count, total) in contributions.items():
+            totals[key][0] += count
+            totals[key][1] += total
+    return totals
+
+
+def populate_stats(apps, schema_editor):
+    Intervention = apps.get_model('intervention_app', 'Intervention')
+    InterventionStat = apps.get_model('intervention_app', 'InterventionStat')
+    # Every key gets a row, zero or not, so stats updates never have to create one
+    totals = {key: (0, 0.0) for key in STAT_KEYS}
+    totals.update(compute(Intervention.objects.values(*TRACKED_FIELDS).iterator()))
+    InterventionStat.objects.bulk_create(
+        [InterventionStat(key=key, count=count, total=total) for key, (count, total) in totals.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intervention_app', '0007_unreadcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterventionStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('count', models.BigIntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
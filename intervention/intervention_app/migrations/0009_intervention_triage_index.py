@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intervention_app', '0008_interventionstat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='intervention',
+            index=models.Index(fields=['status', 'priority', 'created_at'], name='intervention_triage_idx'),
+        ),
+    ]
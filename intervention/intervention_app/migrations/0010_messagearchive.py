@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intervention_app', '0009_intervention_triage_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('min_message_id', models.BigIntegerField()),
+                ('max_message_id', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('intervention', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_archives', to='intervention_app.intervention')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['intervention', 'first_timestamp'], name='message_archive_range_idx')],
+            },
+        ),
+    ]
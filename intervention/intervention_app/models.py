@@ -1,5 +1,8 @@
-from django.db import models
+from contextlib import nullcontext
+
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
 
 class Intervention(models.Model):
     STATUS_CHOICES = [
@@ -42,19 +45,77 @@ class Intervention(models.Model):
     chat_ended_at = models.DateTimeField(null=True, blank=True)
     chat_rating = models.IntegerField(null=True, blank=True)
 
+    # Statuses that count as resolved for time-to-resolution
+    RESOLVED_STATUSES = ('resolved', 'closed')
+
+    class Meta:
+        indexes = [
+            # The triage queue (intervention_app.triage): open, by priority, oldest first
+            models.Index(fields=['status', 'priority', 'created_at'], name='intervention_triage_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} ({self.status})"
+
+    def stamp_resolved_at(self, now=None):
+        """Keep resolved_at in step with the status; returns whether it changed"""
+        if self.status in self.RESOLVED_STATUSES and self.resolved_at is None:
+            self.resolved_at = now or timezone.now()
+            return True
+        if self.status not in self.RESOLVED_STATUSES and self.resolved_at is not None:
+            self.resolved_at = None
+            return True
+        return False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the row held when loaded, so a save can tell whether it changes it
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def changes_tracked_fields(self, update_fields=None):
+        """Whether saving writes a statistics or workload field with a value other than
+        the loaded one (always, for an instance that wasn't loaded from the database)"""
+        from . import assignment, stats
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        fields = {*stats.TRACKED_FIELDS, *assignment.TRACKED_FIELDS}
+        if update_fields is not None:
+            fields &= {self._meta.get_field(name).attname for name in update_fields}
+        return any(field not in loaded or getattr(self, field) != loaded[field] for field in fields)
+
+    def save(self, *args, **kwargs):
+        stamp_changed = self.stamp_resolved_at()
+        if stamp_changed and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'resolved_at'}
+        # An update that changes a tracked field reads and locks the stored values in
+        # pre_save (see signals): keep that read, the write and the queued stats change
+        # in one transaction. Other updates leave the statistics and workloads alone
+        self._tracked_changes = self.pk is None or self.changes_tracked_fields(kwargs.get('update_fields'))
+        with transaction.atomic(savepoint=False) if self.pk is not None and self._tracked_changes else nullcontext():
+            super().save(*args, **kwargs)
+        if getattr(self, '_loaded_values', None) is not None:
+            # The row now holds what was written
+            written = kwargs.get('update_fields')
+            self._loaded_values.update(
+                (field.attname, getattr(self, field.attname)) for field in self._meta.concrete_fields
+                if written is None or field.name in written or field.attname in written
+            )
     
     def get_available_employees(self):
         """Get available employees who can handle this intervention"""
-        from authentication.models import User
-        return User.objects.filter(user_type__in=['employee', 'admin'])
+        from authentication.roster import roster_cache
+        return roster_cache.get()
 
     def end_chat_by_employee(self):
-        from django.utils import timezone
+        """Mark the chat as ended by the employee and close the intervention"""
         self.chat_ended_by_employee = True
         self.chat_ended_at = timezone.now()
-        self.save()
+        self.status = 'closed'
+        # Only write what changed: chat consumers call this on their long-lived cached copy
+        self.save(update_fields=['chat_ended_by_employee', 'chat_ended_at', 'status', 'updated_at'])
 
 class Message(models.Model):
     MESSAGE_TYPE_CHOICES = [
@@ -67,7 +128,8 @@ class Message(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPE_CHOICES, default='client_message')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: the chat write-behind path stamps messages when they are sent
+    timestamp = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
 
     def __str__(self):
@@ -75,3 +137,59 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['intervention', 'timestamp', 'id'], name='message_intervention_ts_idx'),
+        ]
+
+class UnreadCounter(models.Model):
+    """Denormalized number of unread messages per (user, intervention), and the id
+    of the last message the user marked read"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='unread_counters')
+    intervention = models.ForeignKey(Intervention, on_delete=models.CASCADE, related_name='unread_counters')
+    count = models.PositiveIntegerField(default=0)
+    last_read_message_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} / {self.intervention_id}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'intervention'], name='unique_unread_counter'),
+        ]
+
+class InterventionStat(models.Model):
+    """Incrementally maintained dashboard aggregate (see ``intervention_app.stats``).
+
+    ``key`` is ``status:<status>``, ``priority:<priority>``, ``rating`` or
+    ``resolution``; ``count`` is the number of interventions contributing and
+    ``total`` the sum of their ratings or resolution seconds.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    count = models.BigIntegerField(default=0)
+    total = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.key}: {self.count} / {self.total}"
+
+class MessageArchive(models.Model):
+    """A compressed chunk of a long-closed intervention's message history (see ``intervention_app.archive``).
+
+    The timestamp and id ranges of the chunk's messages let readers pick the
+    chunks a page of history needs without decompressing the others.
+    """
+    intervention = models.ForeignKey(Intervention, on_delete=models.CASCADE, related_name='message_archives')
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField(default=0)
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    min_message_id = models.BigIntegerField()
+    max_message_id = models.BigIntegerField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.intervention_id}: {self.message_count} messages"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['intervention', 'first_timestamp'], name='message_archive_range_idx'),
+        ]
@@ -0,0 +1,89 @@
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, LimitOffsetPagination
+
+
+class InterventionListPagination(LimitOffsetPagination):
+    """Limit/offset pagination for the intervention list.
+
+    No default limit: requests without ``?limit=`` keep the legacy unpaginated response.
+    """
+    default_limit = None
+    max_limit = 100
+
+
+class MessageCursorPagination(CursorPagination):
+    """Keyset pagination over an intervention's messages, keyed on (timestamp, id).
+
+    Opt-in: only requests carrying ``?cursor=`` or ``?page_size=`` are paginated.
+    Views may set ``message_ordering`` to walk the history newest-first.
+    History merged from the hot table and the archives goes through ``paginate_history``,
+    whose cursors hold a ``(timestamp, id)`` key.
+    """
+    ordering = ('timestamp', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    list_links = None
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_history(self, fetch, request, view=None):
+        """Paginate history read by ``fetch(after, reverse, limit)``: at most ``limit`` items beyond
+        the ``(timestamp, id)`` key ``after`` (None for the start), in the view's order or the
+        other way when ``reverse``. The cursors hold the key of a page's last or first item."""
+        if not self.is_requested(request):
+            return None
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        after = self.decode_key(cursor.position) if cursor is not None and cursor.position else None
+
+        items = fetch(after, reverse, self.page_size + 1)
+        has_more = len(items) > self.page_size
+        items = items[:self.page_size]
+        if reverse:
+            items.reverse()
+        # Coming back from a later page, there is one to go forward to
+        has_next, has_previous = (True, has_more) if reverse else (has_more, after is not None)
+        self.list_links = (
+            self.encode_key(items[-1], reverse=False) if has_next and items else None,
+            self.encode_key(items[0], reverse=True) if has_previous and items else None,
+        )
+        return items
+
+    def encode_key(self, item, reverse):
+        position = f'{item.timestamp.isoformat()}|{item.id}'
+        return self.encode_cursor(Cursor(offset=0, reverse=reverse, position=position))
+
+    def decode_key(self, position):
+        timestamp, _, message_id = position.rpartition('|')
+        try:
+            key = parse_datetime(timestamp), int(message_id)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if key[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return key
+
+    def get_next_link(self):
+        if self.list_links is not None:
+            return self.list_links[0]
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.list_links is not None:
+            return self.list_links[1]
+        return super().get_previous_link()
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'message_ordering', self.ordering)
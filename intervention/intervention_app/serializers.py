@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Intervention, Message
 from django.contrib.auth import get_user_model
+from authentication.roster import roster_cache
 
 User = get_user_model()
 
@@ -18,6 +19,8 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ['id', 'content', 'timestamp', 'user', 'message_type', 'message_type_display', 'is_read']
+        # Stamped by the server: history order, cursors and chat sequence ids depend on it
+        read_only_fields = ['timestamp']
 
 class InterventionSerializer(serializers.ModelSerializer):
     assigned_to = UserSerializer(read_only=True)
@@ -38,5 +41,22 @@ class InterventionSerializer(serializers.ModelSerializer):
     
     def get_available_employees(self, obj):
         """Return available employees for this intervention"""
-        employees = obj.get_available_employees()
-        return UserSerializer(employees, many=True).data
+        # Every intervention shares the same roster, so serialize it once per roster load
+        return roster_cache.serialized(UserSerializer)
+
+
+class InterventionListSerializer(serializers.ModelSerializer):
+    """Lightweight intervention representation for paginated list pages (no messages or roster)"""
+    assigned_to = UserSerializer(read_only=True)
+    created_by = UserSerializer(read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    priority_display = serializers.CharField(source='get_priority_display', read_only=True)
+
+    class Meta:
+        model = Intervention
+        fields = [
+            'id', 'title', 'description', 'problem_type', 'priority', 'priority_display',
+            'assigned_to', 'created_by', 'status', 'status_display',
+            'created_at', 'updated_at',
+            'chat_ended_by_employee', 'chat_ended_at', 'chat_rating'
+        ]
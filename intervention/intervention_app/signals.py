@@ -0,0 +1,67 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import assignment, stats
+from .assignment import workloads
+from .models import Intervention, Message
+from .unread import record_new_messages
+
+
+@receiver(post_save, sender=Message)
+def count_unread_message(sender, instance, created, raw=False, **kwargs):
+    # bulk_create skips signals; the chat write-behind path records its batches itself
+    if created and not raw:
+        record_new_messages([instance])
+
+
+@receiver(pre_save, sender=Intervention)
+def remember_stored_values(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The stored row, not the instance, holds what the stats and workloads currently count.
+    # Intervention.save() runs in a transaction, so the row stays locked until the save
+    # commits and two concurrent saves can't both count the same change
+    instance._stat_values = instance._workload_values = None
+    if instance.pk is None or raw or not getattr(instance, '_tracked_changes', True):
+        return
+    touches_stats, touches_workload = stats.touches_stats(update_fields), workloads.touches_workload(update_fields)
+    if not (touches_stats or touches_workload):
+        return
+    row = Intervention.objects.select_for_update().filter(pk=instance.pk).values(
+        *stats.TRACKED_FIELDS, *assignment.TRACKED_FIELDS
+    ).first()
+    if row is not None:
+        if touches_stats:
+            instance._stat_values = row
+        if touches_workload:
+            instance._workload_values = row
+
+
+@receiver(post_save, sender=Intervention)
+def update_stats_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or not stats.touches_stats(update_fields) or not getattr(instance, '_tracked_changes', True):
+        return
+    # No previous row (created, or saved with a new explicit pk) counts as an insert
+    previous = None if created else getattr(instance, '_stat_values', None)
+    stats.record_change(previous, stats.tracked_values(instance))
+
+
+@receiver(post_delete, sender=Intervention)
+def update_stats_on_delete(sender, instance, **kwargs):
+    stats.record_change(stats.tracked_values(instance), None)
+
+
+@receiver(post_save, sender=Intervention)
+def update_workload_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or not workloads.touches_workload(update_fields) or not getattr(instance, '_tracked_changes', True):
+        return
+    previous = None if created else getattr(instance, '_workload_values', None)
+    if previous is None and not created:
+        # The workloads were loaded during this save; the next reconciliation counts it
+        return
+    workloads.record_change(
+        previous, assignment.tracked_values(instance), getattr(instance, '_workload_reservation', None)
+    )
+
+
+@receiver(post_delete, sender=Intervention)
+def update_workload_on_delete(sender, instance, **kwargs):
+    workloads.record_change(assignment.tracked_values(instance), None)
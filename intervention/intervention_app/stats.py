@@ -0,0 +1,172 @@
+"""Incrementally maintained intervention statistics for the dashboard.
+
+Each intervention contributes ``(count, total)`` to a few ``InterventionStat``
+rows: its status, its priority, its rating (total = rating) and, once
+resolved, its resolution time (total = seconds from creation to resolution).
+Saves and deletes add the difference between the old and new contributions
+when their transaction commits, all of a transaction's changes in one
+conditional UPDATE, so reading the dashboard is a single small query. A row
+exists for every status, every priority, ``rating`` and ``resolution`` (the
+migrations and ``rebuild`` create them); a row that is missing anyway is
+created on the spot rather than losing the change.
+"""
+from collections import defaultdict
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models import (
+    Case, Count, DurationField, ExpressionWrapper, F, Func, IntegerField, Subquery, Sum, Value, When,
+)
+from django.db.models.lookups import Exact
+
+from .models import Intervention, InterventionStat
+
+TRACKED_FIELDS = ('status', 'priority', 'chat_rating', 'created_at', 'resolved_at')
+
+
+def stat_keys():
+    """Keys of the rows that are always kept, zero or not"""
+    return [
+        *(f'status:{value}' for value, _ in Intervention.STATUS_CHOICES),
+        *(f'priority:{value}' for value, _ in Intervention.PRIORITY_CHOICES),
+        'rating',
+        'resolution',
+    ]
+
+
+def tracked_values(intervention):
+    return {field: getattr(intervention, field) for field in TRACKED_FIELDS}
+
+
+def touches_stats(update_fields):
+    return update_fields is None or bool(set(TRACKED_FIELDS) & set(update_fields))
+
+
+def contributions(values):
+    """Return ``{key: (count, total)}`` for one intervention's tracked values"""
+    result = {
+        f"status:{values['status']}": (1, 0.0),
+        f"priority:{values['priority']}": (1, 0.0),
+    }
+    if values['chat_rating'] is not None:
+        result['rating'] = (1, float(values['chat_rating']))
+    if values['resolved_at'] is not None and values['created_at'] is not None:
+        result['resolution'] = (1, (values['resolved_at'] - values['created_at']).total_seconds())
+    return result
+
+
+def compute(rows):
+    """Aggregate an iterable of tracked-value dicts into ``{key: [count, total]}``"""
+    totals = defaultdict(lambda: [0, 0.0])
+    for values in rows:
+        for key, (count, total) in contributions(values).items():
+            totals[key][0] += count
+            totals[key][1] += total
+    return dict(totals)
+
+
+def record_changes(changes):
+    """Apply ``(old_values, new_values)`` pairs; ``None`` means created or deleted.
+
+    The deltas are written when the surrounding transaction commits (at once in
+    autocommit mode): the shared stat rows stay locked for a single statement
+    rather than the whole transaction, and a rolled back change never counts.
+    """
+    deltas = defaultdict(lambda: [0, 0.0])
+    for old_values, new_values in changes:
+        for values, sign in ((old_values, -1), (new_values, 1)):
+            if values is None:
+                continue
+            for key, (count, total) in contributions(values).items():
+                deltas[key][0] += sign * count
+                deltas[key][1] += sign * total
+
+    deltas = {key: (count, total) for key, (count, total) in deltas.items() if count or total}
+    if deltas:
+        transaction.on_commit(partial(apply_deltas, deltas))
+
+
+def apply_deltas(deltas):
+    """Add ``{key: (count, total)}`` to the stored rows in one conditional UPDATE.
+
+    The UPDATE only runs once every row exists; when some are missing (a status
+    outside the choices, or rows deleted by hand) they are created and it runs again.
+    """
+    def shift(field, index, output_field):
+        return F(field) + Case(
+            *[When(key=key, then=Value(delta[index])) for key, delta in deltas.items()],
+            default=Value(0), output_field=output_field,
+        )
+
+    rows = InterventionStat.objects.filter(key__in=deltas)
+    present = Subquery(rows.order_by().values(n=Func(F('pk'), function='COUNT', output_field=IntegerField())))
+
+    def update():
+        return rows.filter(Exact(present, len(deltas))).update(
+            count=shift('count', 0, models.BigIntegerField()),
+            total=shift('total', 1, models.FloatField()),
+        )
+
+    if not update():
+        InterventionStat.objects.bulk_create([InterventionStat(key=key) for key in deltas], ignore_conflicts=True)
+        update()
+
+
+def record_change(old_values, new_values):
+    record_changes([(old_values, new_values)])
+
+
+def snapshot():
+    """Return the stored statistics as ``{key: (count, total)}``"""
+    return {stat.key: (stat.count, stat.total) for stat in InterventionStat.objects.all()}
+
+
+def rebuild(batch_size=2000):
+    """Recompute every statistic from the intervention table"""
+    rows = Intervention.objects.values(*TRACKED_FIELDS).iterator(chunk_size=batch_size)
+    totals = {key: (0, 0.0) for key in stat_keys()}
+    totals.update(compute(rows))
+    with transaction.atomic():
+        InterventionStat.objects.all().delete()
+        InterventionStat.objects.bulk_create(
+            [InterventionStat(key=key, count=count, total=total) for key, (count, total) in totals.items()]
+        )
+    return totals
+
+
+def live_aggregates():
+    """Compute the same ``{key: (count, total)}`` directly with GROUP BY queries"""
+    result = {}
+    for field in ('status', 'priority'):
+        for row in Intervention.objects.values(field).annotate(n=Count('id')).order_by():
+            result[f"{field}:{row[field]}"] = (row['n'], 0.0)
+
+    rating = Intervention.objects.filter(chat_rating__isnull=False).aggregate(n=Count('id'), total=Sum('chat_rating'))
+    if rating['n']:
+        result['rating'] = (rating['n'], float(rating['total']))
+
+    resolution = Intervention.objects.filter(resolved_at__isnull=False).aggregate(
+        n=Count('id'),
+        total=Sum(ExpressionWrapper(F('resolved_at') - F('created_at'), output_field=DurationField())),
+    )
+    if resolution['n']:
+        result['resolution'] = (resolution['n'], resolution['total'].total_seconds())
+    return result
+
+
+def dashboard():
+    """Format the stored statistics for the stats endpoint"""
+    stats = snapshot()
+    by_status = {value: stats.get(f'status:{value}', (0, 0))[0] for value, _ in Intervention.STATUS_CHOICES}
+    by_priority = {value: stats.get(f'priority:{value}', (0, 0))[0] for value, _ in Intervention.PRIORITY_CHOICES}
+    rated, rating_total = stats.get('rating', (0, 0))
+    resolved, resolution_total = stats.get('resolution', (0, 0))
+    return {
+        'total': sum(by_status.values()),
+        'by_status': by_status,
+        'by_priority': by_priority,
+        'rated': rated,
+        'average_rating': rating_total / rated if rated else None,
+        'resolved': resolved,
+        'average_resolution_seconds': resolution_total / resolved if resolved else None,
+    }
@@ -1,3 +1,704 @@
+import csv
+import datetime
+import io
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from authentication.roster import roster_cache
+from authentication.token_cache import token_cache
+
+from . import archive, export, stats, triage
+from .assignment import workloads
+from .management.commands.benchmark_api import ENDPOINTS, Command as BenchmarkApi, Dataset
+from .models import Intervention, InterventionStat, Message, MessageArchive
+
+
+class APITestCase(TestCase):
+    """A client, an employee and API clients authenticated as each"""
+
+    def setUp(self):
+        token_cache.clear()
+        roster_cache.invalidate()
+        self.client_user = User.objects.create_user('client', 'client@example.com', 'pw', user_type='client')
+        self.employee = User.objects.create_user(
+            'employee', 'employee@example.com', 'pw', user_type='employee',
+            department='Tech', specialization='Software, Network',
+        )
+        self.api = self.api_for(self.client_user)
+        self.employee_api = self.api_for(self.employee)
+
+    def api_for(self, user):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+        return api
+
+    def create_intervention(self, **fields):
+        fields = {'title': 'Printer', 'description': 'Jammed', 'created_by': self.client_user, **fields}
+        return Intervention.objects.create(**fields)
+
+    def assertStatsMatchLive(self):
+        # Totals are float sums, added up in a different order than the live aggregates
+        stored = {key: value for key, value in stats.snapshot().items() if any(value)}
+        live = stats.live_aggregates()
+        self.assertEqual({key: count for key, (count, _) in stored.items()},
+                         {key: count for key, (count, _) in live.items()})
+        for key, (_, total) in live.items():
+            self.assertAlmostEqual(stored[key][1], total, places=6)
+        call_command('rebuild_intervention_stats', '--check-only', stdout=io.StringIO())
+
+
+class InterventionListTests(APITestCase):
+    def test_limit_returns_lightweight_pages_newest_first(self):
+        interventions = [self.create_intervention(title=f'Intervention {i}') for i in range(5)]
+        Message.objects.create(intervention=interventions[0], user=self.client_user, content='Hello')
+
+        response = self.employee_api.get('/api/interventions/?limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([row['id'] for row in response.data['results']], [interventions[4].id, interventions[3].id])
+        self.assertNotIn('messages', response.data['results'][0])
+        self.assertNotIn('available_employees', response.data['results'][0])
+
+        response = self.employee_api.get(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], [interventions[2].id, interventions[1].id])
+
+    def test_without_limit_keeps_the_full_response(self):
+        intervention = self.create_intervention()
+        Message.objects.create(intervention=intervention, user=self.client_user, content='Hello')
+
+        response = self.api.get('/api/interventions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual([message['content'] for message in response.data[0]['messages']], ['Hello'])
+        self.assertEqual([user['id'] for user in response.data[0]['available_employees']], [self.employee.id])
+
+    def test_clients_only_page_through_their_own_interventions(self):
+        other = User.objects.create_user('other', 'other@example.com', 'pw', user_type='client')
+        self.create_intervention(created_by=other)
+        own = self.create_intervention()
+
+        response = self.api.get('/api/interventions/?limit=10')
+        self.assertEqual([row['id'] for row in response.data['results']], [own.id])
+
+
+class MessagePaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.intervention = self.create_intervention()
+        moment = timezone.now()
+        # Equal timestamps: the id breaks the tie
+        self.messages = [
+            Message.objects.create(intervention=self.intervention, user=self.client_user, content=f'Message {i}',
+                                   timestamp=moment + datetime.timedelta(seconds=i // 2))
+            for i in range(7)
+        ]
+        self.url = f'/api/interventions/{self.intervention.id}/messages/'
+
+    def ids(self, messages):
+        return [message.id for message in messages]
+
+    def test_cursor_pages_walk_the_history_in_order(self):
+        seen = []
+        response = self.api.get(f'{self.url}?page_size=3')
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.api.get(response.data['next'])
+        self.assertEqual(seen, self.ids(self.messages))
+
+    def test_unpaginated_requests_get_the_full_list(self):
+        response = self.api.get(self.url)
+        self.assertEqual([row['id'] for row in response.data], self.ids(self.messages))
+
+    def test_after_returns_newer_messages(self):
+        response = self.api.get(f'{self.url}?after={self.messages[2].id}')
+        self.assertEqual([row['id'] for row in response.data], self.ids(self.messages[3:]))
+
+    def test_before_scrolls_back_newest_first(self):
+        response = self.api.get(f'{self.url}?before={self.messages[4].id}&page_size=2')
+        self.assertEqual([row['id'] for row in response.data['results']], self.ids(self.messages[3:1:-1]))
+
+    def test_unknown_anchor_is_rejected(self):
+        other = self.create_intervention()
+        foreign = Message.objects.create(intervention=other, user=self.client_user, content='Elsewhere')
+        self.assertEqual(self.api.get(f'{self.url}?after={foreign.id}').status_code, 400)
+        self.assertEqual(self.api.get(f'{self.url}?after=abc').status_code, 400)
+
+    def test_previous_links_walk_back(self):
+        response = self.api.get(f'{self.url}?page_size=3')
+        response = self.api.get(self.api.get(response.data['next']).data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], self.ids(self.messages[6:]))
+
+        pages = []
+        while response.data['previous'] is not None:
+            response = self.api.get(response.data['previous'])
+            pages.append([row['id'] for row in response.data['results']])
+        self.assertEqual(pages, [self.ids(self.messages[3:6]), self.ids(self.messages[:3])])
+
+
+class ArchivedMessagePaginationTests(MessagePaginationTests):
+    """The same history, its first five messages archived in chunks of two"""
+
+    def setUp(self):
+        super().setUp()
+        rows = list(
+            Message.objects.filter(id__in=self.ids(self.messages[:5])).order_by('timestamp', 'id').values(*archive.FIELDS)
+        )
+        MessageArchive.objects.bulk_create(
+            [archive.chunk(self.intervention.id, rows[start:start + 2]) for start in range(0, 5, 2)]
+        )
+        Message.objects.filter(id__in=self.ids(self.messages[:5])).delete()
+
+    def archive_reads(self, path):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.api.get(path)
+        self.assertEqual(response.status_code, 200)
+        return sum('"data"' in query['sql'] and 'messagearchive' in query['sql'] for query in captured)
+
+    def test_pages_only_decompress_the_chunks_they_need(self):
+        self.assertEqual(self.archive_reads(f'{self.url}?page_size=1'), 1)
+        # The archived anchor is looked up, then only hot messages follow it
+        self.assertEqual(self.archive_reads(f'{self.url}?after={self.messages[4].id}&page_size=2'), 1)
+        self.assertEqual(self.archive_reads(f'{self.url}?before={self.messages[5].id}&page_size=2'), 2)
+
+    def test_hot_reads_are_limited_to_the_page(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.api.get(f'{self.url}?page_size=2')
+        hot = [query['sql'] for query in captured if 'FROM "intervention_app_message"' in query['sql']]
+        self.assertTrue(hot)
+        self.assertTrue(all('LIMIT 3' in sql for sql in hot))
+
+    def test_archived_messages_are_read_only(self):
+        archived = self.messages[1]
+        response = self.api.get(f'{self.url}{archived.id}/')
+        self.assertEqual((response.status_code, response.data['content']), (200, archived.content))
+        self.assertEqual(self.api.patch(f'{self.url}{archived.id}/', {'content': 'x'}).status_code, 404)
+        self.assertEqual(self.api.get(f'{self.url}{self.messages[6].id + 100}/').status_code, 404)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.api.get(f'{self.url}?cursor=garbage').status_code, 404)
+
+
+class MessageArchiveTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.intervention = self.create_intervention()
+        self.moment = timezone.now() - datetime.timedelta(days=1)
+
+    def post(self, *minutes):
+        return [Message.objects.create(intervention=self.intervention, user=self.client_user, content=f'At {minute}',
+                                       timestamp=self.moment + datetime.timedelta(minutes=minute))
+                for minute in minutes]
+
+    def archive_messages(self):
+        self.intervention.status = 'closed'
+        self.intervention.save()
+        with mock.patch.object(archive, 'CHUNK_SIZE', 2):
+            call_command('archive_messages', '--days', '0', stdout=io.StringIO())
+
+    def history(self, path=''):
+        response = self.api.get(f'/api/interventions/{self.intervention.id}/messages/{path}')
+        return [row['content'] for row in response.data]
+
+    def test_archiving_moves_messages_into_chunks(self):
+        messages = self.post(0, 1, 2, 3, 4)
+        self.archive_messages()
+        self.assertFalse(Message.objects.exists())
+        chunks = list(MessageArchive.objects.order_by('first_timestamp'))
+        self.assertEqual([chunk.message_count for chunk in chunks], [2, 2, 1])
+        self.assertEqual((chunks[0].min_message_id, chunks[0].max_message_id), (messages[0].id, messages[1].id))
+        self.assertEqual((chunks[1].first_timestamp, chunks[1].last_timestamp),
+                         (messages[2].timestamp, messages[3].timestamp))
+        self.assertEqual(self.history(), [f'At {minute}' for minute in range(5)])
+
+    def test_later_runs_may_overlap_earlier_chunks(self):
+        self.post(0, 10, 20)
+        self.archive_messages()
+        # Written after the first run, partly older than what it archived
+        self.post(5, 15, 30)
+        self.archive_messages()
+        expected = [f'At {minute}' for minute in (0, 5, 10, 15, 20, 30)]
+        self.assertEqual(self.history(), expected)
+        response = self.api.get(f'/api/interventions/{self.intervention.id}/messages/?page_size=4')
+        self.assertEqual([row['content'] for row in response.data['results']], expected[:4])
+        response = self.api.get(response.data['next'])
+        self.assertEqual([row['content'] for row in response.data['results']], expected[4:])
+
+        found = archive.archived_messages(self.intervention.id, descending=True, limit=3)
+        self.assertEqual([message.content for message in found], ['At 30', 'At 20', 'At 15'])
+        bounds = [('gt', archive.message_key(found[-1]))]
+        found = archive.archived_messages(self.intervention.id, bounds, limit=2)
+        self.assertEqual([message.content for message in found], ['At 20', 'At 30'])
+
+
+class MessageTimestampTests(APITestCase):
+    def test_clients_cannot_set_message_timestamps(self):
+        intervention = self.create_intervention()
+        url = f'/api/interventions/{intervention.id}/messages/'
+        before = timezone.now()
+
+        response = self.api.post(url, {'content': 'Backdated', 'timestamp': '2001-01-01T00:00:00Z'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get(pk=response.data['id'])
+        self.assertGreaterEqual(message.timestamp, before)
+
+        response = self.api.patch(f'{url}{message.id}/', {'timestamp': '2001-01-01T00:00:00Z'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        message.refresh_from_db()
+        self.assertGreaterEqual(message.timestamp, before)
+
+
+class UnreadCounterTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.colleague = User.objects.create_user('colleague', 'colleague@example.com', 'pw', user_type='employee')
+        self.intervention = self.create_intervention(assigned_to=self.employee)
+        self.url = f'/api/interventions/{self.intervention.id}/messages/'
+
+    def post(self, user, content='Hello'):
+        return Message.objects.create(intervention=self.intervention, user=user, content=content)
+
+    def mark_read(self, api, up_to):
+        response = api.post(f'{self.url}mark_read/', {'up_to': up_to}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['marked']
+
+    def unread(self, api):
+        return api.get('/api/interventions/unread_counts/').data
+
+    def test_messages_count_as_unread_for_the_other_participants(self):
+        self.post(self.client_user)
+        self.assertEqual(self.unread(self.api), {})
+        self.assertEqual(self.unread(self.employee_api), {self.intervention.id: 1})
+
+    def test_each_recipient_marks_the_same_message_read(self):
+        # A third employee writes: the client and the assignee both get it
+        message = self.post(self.colleague)
+        self.assertEqual(self.unread(self.api), {self.intervention.id: 1})
+        self.assertEqual(self.unread(self.employee_api), {self.intervention.id: 1})
+
+        self.assertEqual(self.mark_read(self.api, message.id), 1)
+        self.assertEqual(self.unread(self.api), {})
+        self.assertEqual(self.unread(self.employee_api), {self.intervention.id: 1})
+
+        self.assertEqual(self.mark_read(self.employee_api, message.id), 1)
+        self.assertEqual(self.unread(self.employee_api), {})
+
+    def test_watermark_only_moves_forward(self):
+        first, second = self.post(self.employee), self.post(self.employee)
+        own = self.post(self.client_user)
+        third = self.post(self.employee)
+
+        self.assertEqual(self.mark_read(self.api, second.id), 2)
+        self.assertEqual(self.mark_read(self.api, first.id), 0)
+        self.assertEqual(self.mark_read(self.api, second.id), 0)
+        self.assertEqual(self.unread(self.api), {self.intervention.id: 1})
+        # Own messages never count
+        self.assertEqual(self.mark_read(self.api, own.id), 0)
+        self.assertEqual(self.mark_read(self.api, third.id), 1)
+        self.assertEqual(self.unread(self.api), {})
+        self.assertTrue(Message.objects.get(pk=first.pk).is_read)
+        self.assertFalse(Message.objects.get(pk=own.pk).is_read)
+
+    def test_marking_without_unread_messages(self):
+        message = self.post(self.client_user)
+        self.assertEqual(self.mark_read(self.api, message.id), 0)
+        self.assertEqual(self.api.post(f'{self.url}mark_read/', {'up_to': 'x'}, format='json').status_code, 400)
+
+
+class InterventionStatsTests(APITestCase):
+    def test_saves_and_deletes_keep_the_stats_current(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.create_intervention(priority='high')
+            second = self.create_intervention()
+        self.assertStatsMatchLive()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.employee_api.post(f'/api/interventions/{first.id}/update_status/', {'status': 'resolved'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats.snapshot()['resolution'][0], 1)
+        self.assertStatsMatchLive()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.chat_rating = 4
+            second.save(update_fields=['chat_rating'])
+            self.assertEqual(self.employee_api.delete(f'/api/interventions/{first.id}/').status_code, 204)
+        self.assertStatsMatchLive()
+        self.assertEqual(stats.dashboard()['average_rating'], 4)
+
+    def test_a_save_writes_the_stats_in_one_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_intervention(status='resolved')
+            intervention = self.create_intervention()
+        intervention.status = 'resolved'
+        with self.captureOnCommitCallbacks() as callbacks:
+            # Locked read of the stored values, the row itself and its search entry
+            with self.assertNumQueries(3):
+                intervention.save()
+        self.assertEqual(len(callbacks), 1)
+        with CaptureQueriesContext(connection) as captured:
+            callbacks[0]()
+        statements = [query['sql'].split()[0] for query in captured if 'interventionstat' in query['sql']]
+        self.assertEqual(statements, ['UPDATE'])
+        self.assertEqual(stats.snapshot()['status:resolved'], (2, 0.0))
+
+    def test_rolled_back_changes_are_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            intervention = self.create_intervention()
+        before = stats.snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                intervention.status = 'closed'
+                intervention.save()
+                transaction.set_rollback(True)
+        self.assertEqual(stats.snapshot(), before)
+
+    def test_every_key_has_a_row(self):
+        self.assertEqual(set(stats.snapshot()), set(stats.stat_keys()))
+        stats.rebuild()
+        self.assertEqual(set(stats.snapshot()), set(stats.stat_keys()))
+
+    def test_unknown_keys_get_a_row(self):
+        stats.apply_deltas({'status:open': (2, 0.0), 'status:escalated': (1, 0.0)})
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['status:open'], snapshot['status:escalated']), ((2, 0.0), (1, 0.0)))
+
+        # A missing row is created rather than the change lost, and no present row
+        # gets its delta twice
+        InterventionStat.objects.filter(key='rating').delete()
+        stats.apply_deltas({'rating': (1, 5.0), 'status:open': (1, 0.0)})
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['rating'], snapshot['status:open']), ((1, 5.0), (3, 0.0)))
+
+    def test_saves_that_leave_tracked_fields_alone_skip_the_locked_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.create_intervention()
+        # Loaded from the database, so the save can tell what it changes
+        intervention = Intervention.objects.get(pk=created.pk)
+        intervention.description = 'Still jammed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            # The row itself and its search entry: no transaction, no locked read
+            with self.assertNumQueries(2):
+                intervention.save()
+        self.assertEqual(callbacks, [])
+
+        intervention.status = 'resolved'
+        with self.captureOnCommitCallbacks(execute=True):
+            intervention.save()
+        self.assertStatsMatchLive()
+        intervention.description = 'Fixed'
+        with self.assertNumQueries(2):
+            intervention.save()
+
+
+class AutoAssignmentTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.billing = User.objects.create_user(
+            'billing', 'billing@example.com', 'pw', user_type='employee', department='Billing',
+        )
+        workloads.reconcile()
+
+    def auto_assign(self, intervention):
+        return self.employee_api.post(f'/api/interventions/{intervention.id}/auto_assign/')
+
+    def assertLoadsMatchDatabase(self):
+        loads = dict(workloads.loads)
+        workloads.reconcile()
+        self.assertEqual(loads, workloads.loads)
+
+    def test_picks_the_least_loaded_employee_with_a_matching_skill(self):
+        network = self.create_intervention(problem_type='Network')
+        invoice = self.create_intervention(problem_type='billing')
+        self.assertEqual(self.auto_assign(network).data['assigned_to'], self.employee.id)
+        self.assertEqual(self.auto_assign(invoice).data['assigned_to'], self.billing.id)
+
+        # No skill matches: whoever is least loaded
+        self.create_intervention(assigned_to=self.employee, status='in_progress', priority='urgent')
+        response = self.auto_assign(self.create_intervention(problem_type='Plumbing'))
+        self.assertEqual(response.data['assigned_to'], self.billing.id)
+
+        network.refresh_from_db()
+        self.assertEqual((network.assigned_to, network.status), (self.employee, 'in_progress'))
+        self.assertTrue(network.messages.filter(message_type='system_message').exists())
+
+    def test_workloads_follow_priorities_and_status_changes(self):
+        intervention = self.create_intervention(problem_type='Network', priority='urgent')
+        self.auto_assign(intervention)
+        self.assertEqual(workloads.loads[self.employee.id], 5)
+
+        intervention.refresh_from_db()
+        intervention.priority = 'low'
+        intervention.save()
+        self.assertEqual(workloads.loads[self.employee.id], 1)
+        self.assertLoadsMatchDatabase()
+
+        self.employee_api.post(f'/api/interventions/{intervention.id}/update_status/', {'status': 'resolved'})
+        self.assertEqual(workloads.loads[self.employee.id], 0)
+        self.assertLoadsMatchDatabase()
+
+        self.auto_assign(self.create_intervention(problem_type='Software'))
+        self.employee_api.delete(f'/api/interventions/{intervention.id}/')
+        self.assertLoadsMatchDatabase()
+
+    def test_equal_skills_share_the_load(self):
+        User.objects.create_user('second', 'second@example.com', 'pw', user_type='employee', department='Billing')
+        assigned = [self.auto_assign(self.create_intervention(problem_type='Billing')).data['assigned_to']
+                    for _ in range(4)]
+        self.assertEqual(sorted(assigned.count(employee_id) for employee_id in set(assigned)), [2, 2])
+
+    def test_reconciliation_catches_writes_that_skip_signals(self):
+        self.auto_assign(self.create_intervention(problem_type='Network'))
+        Intervention.objects.update(status='closed')
+        self.assertEqual(workloads.loads[self.employee.id], 2)
+        workloads.reconcile()
+        self.assertEqual(workloads.loads[self.employee.id], 0)
+
+    def test_only_employees_assign_open_interventions(self):
+        intervention = self.create_intervention()
+        response = self.api.post(f'/api/interventions/{intervention.id}/auto_assign/')
+        self.assertEqual(response.status_code, 403)
+
+        intervention.status = 'resolved'
+        intervention.save()
+        self.assertEqual(self.auto_assign(intervention).status_code, 400)
+
+        User.objects.filter(user_type='employee').update(user_type='admin')
+        roster_cache.invalidate()
+        self.assertEqual(self.auto_assign(self.create_intervention()).status_code, 409)
+
+
+class ClaimNextTests(APITestCase):
+    def create_open(self, age, **fields):
+        intervention = self.create_intervention(**fields)
+        Intervention.objects.filter(pk=intervention.pk).update(
+            created_at=timezone.now() - datetime.timedelta(minutes=age)
+        )
+        return intervention
+
+    def claim(self, api=None):
+        return (api or self.employee_api).post('/api/interventions/claim_next/')
+
+    def test_claims_by_priority_then_age(self):
+        newer_urgent = self.create_open(1, priority='urgent')
+        older_low = self.create_open(30, priority='low')
+        older_urgent = self.create_open(10, priority='urgent')
+        self.create_open(60, priority='urgent', status='waiting_for_client')
+        self.create_open(60, priority='urgent', assigned_to=self.employee)
+
+        claimed = [self.claim().data['id'] for _ in range(3)]
+        self.assertEqual(claimed, [older_urgent.id, newer_urgent.id, older_low.id])
+        self.assertEqual(self.claim().status_code, 404)
+
+        older_low.refresh_from_db()
+        self.assertEqual((older_low.assigned_to, older_low.status), (self.employee, 'in_progress'))
+        self.assertTrue(older_low.messages.filter(message_type='system_message').exists())
+
+    def test_a_lost_race_moves_on_to_the_next_candidate(self):
+        taken = self.create_open(20, priority='high')
+        available = self.create_open(10, priority='high')
+        other = User.objects.create_user('other', 'other@example.com', 'pw', user_type='employee')
+        taken.assigned_to, taken.status = other, 'in_progress'
+        taken.save()
+
+        # The candidates were read before the other employee's claim landed
+        stale_queue = lambda priority: Intervention.objects.filter(priority=priority).order_by('created_at', 'id')
+        with mock.patch.object(triage, 'queue', stale_queue):
+            self.assertEqual(triage.claim_next(self.employee).id, available.id)
+        taken.refresh_from_db()
+        self.assertEqual(taken.assigned_to, other)
+
+    def test_claims_keep_the_stats_current(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_open(5)
+            self.assertEqual(self.claim().status_code, 200)
+        self.assertStatsMatchLive()
+
+    def test_only_employees_claim(self):
+        self.create_open(5)
+        self.assertEqual(self.claim(self.api).status_code, 403)
+
+
+class BulkUpdateTests(APITestCase):
+    def bulk(self, action, api=None, **data):
+        return (api or self.employee_api).post(f'/api/interventions/{action}/', data, format='json')
+
+    def test_bulk_status_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = [self.create_intervention(priority='high').id for _ in range(3)]
+            response = self.bulk('bulk_update_status', ids=ids, status='resolved')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 3)
+
+        for intervention in Intervention.objects.filter(pk__in=ids):
+            self.assertEqual(intervention.status, 'resolved')
+            self.assertIsNotNone(intervention.resolved_at)
+            self.assertEqual(intervention.messages.get().content, 'Status updated to: Resolved')
+        self.assertStatsMatchLive()
+        self.assertEqual(self.api.get('/api/interventions/unread_counts/').data, dict.fromkeys(ids, 1))
+
+    def test_bulk_assign(self):
+        interventions = [self.create_intervention() for _ in range(2)]
+        response = self.bulk('bulk_assign', ids=[intervention.id for intervention in interventions],
+                             employee_id=self.employee.id)
+        self.assertEqual(response.status_code, 200)
+        for intervention in interventions:
+            intervention.refresh_from_db()
+            self.assertEqual((intervention.assigned_to, intervention.status), (self.employee, 'in_progress'))
+
+        response = self.bulk('bulk_assign', ids=[interventions[0].id], employee_id=self.client_user.id)
+        self.assertEqual(response.status_code, 404)
+        response = self.bulk('bulk_assign', ids=[interventions[0].id], employee_id='someone')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def queries(count):
+            ids = [self.create_intervention().id for _ in range(count)]
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.bulk('bulk_update_status', ids=ids, status='closed').status_code, 200)
+            return len(captured)
+
+        queries(1)  # Warm the token cache
+        self.assertEqual(queries(2), queries(20))
+
+    def test_inaccessible_ids_change_nothing(self):
+        own = self.create_intervention()
+        other = User.objects.create_user('other', 'other@example.com', 'pw', user_type='client')
+        foreign = self.create_intervention(created_by=other)
+
+        response = self.bulk('bulk_update_status', self.api, ids=[own.id, foreign.id], status='closed')
+        self.assertEqual((response.status_code, response.data['ids']), (404, [foreign.id]))
+        self.assertFalse(Intervention.objects.filter(status='closed').exists())
+        self.assertFalse(Message.objects.exists())
+
+    def test_invalid_requests_are_rejected(self):
+        intervention = self.create_intervention()
+        for data in ({'ids': [intervention.id], 'status': 'done'}, {'ids': [], 'status': 'closed'},
+                     {'ids': ['x'], 'status': 'closed'}, {'ids': intervention.id, 'status': 'closed'}):
+            self.assertEqual(self.bulk('bulk_update_status', **data).status_code, 400)
+        with self.settings(INTERVENTION_BULK_MAX=1):
+            response = self.bulk('bulk_update_status', ids=[intervention.id, intervention.id + 1], status='closed')
+            self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(APITestCase):
+    def export(self, api=None, **params):
+        response = (api or self.employee_api).get('/api/interventions/export/', params)
+        if response.status_code != 200:
+            return response, None
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def ndjson(self, **params):
+        response, content = self.export(export_format='ndjson', **params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_ndjson_export_with_filters(self):
+        old = self.create_intervention(title='Old', status='resolved')
+        Intervention.objects.filter(pk=old.pk).update(created_at=timezone.now() - datetime.timedelta(days=10))
+        recent = self.create_intervention(title='Recent', assigned_to=self.employee)
+        self.create_intervention(title='Closed', status='closed')
+
+        rows = self.ndjson()
+        self.assertEqual([row['title'] for row in rows], ['Old', 'Recent', 'Closed'])
+        self.assertEqual((rows[1]['created_by'], rows[1]['assigned_to']), ('client', 'employee'))
+        self.assertNotIn('messages', rows[0])
+
+        self.assertEqual([row['id'] for row in self.ndjson(status='open,resolved')], [old.id, recent.id])
+        since = (timezone.now() - datetime.timedelta(days=1)).date().isoformat()
+        self.assertEqual([row['title'] for row in self.ndjson(created_after=since)], ['Recent', 'Closed'])
+        self.assertEqual([row['title'] for row in self.ndjson(created_before=since)], ['Old'])
+
+    def test_messages_merge_hot_and_archived_history(self):
+        intervention = self.create_intervention()
+        moment = timezone.now() - datetime.timedelta(days=1)
+        for minute in (0, 20):
+            Message.objects.create(intervention=intervention, user=self.client_user, content=f'At {minute}',
+                                   timestamp=moment + datetime.timedelta(minutes=minute))
+        archive.archive_intervention(intervention.id)
+        Message.objects.create(intervention=intervention, user=self.employee, content='At 10',
+                               timestamp=moment + datetime.timedelta(minutes=10))
+        self.create_intervention(title='Quiet')
+
+        rows = self.ndjson(include_messages='true')
+        self.assertEqual([message['content'] for message in rows[0]['messages']], ['At 0', 'At 10', 'At 20'])
+        self.assertEqual([message['user'] for message in rows[0]['messages']], ['client', 'employee', 'client'])
+        self.assertEqual(rows[1]['messages'], [])
+
+        response, content = self.export(export_format='csv', include_messages='1')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="interventions.csv"', response['Content-Disposition'])
+        table = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([(row['title'], row['message_content']) for row in table],
+                         [('Printer', 'At 0'), ('Printer', 'At 10'), ('Printer', 'At 20'), ('Quiet', '')])
+
+    def test_query_count_does_not_grow_with_the_export(self):
+        def queries(count):
+            for _ in range(count):
+                intervention = self.create_intervention()
+                Message.objects.create(intervention=intervention, user=self.client_user, content='Hello')
+            with CaptureQueriesContext(connection) as captured:
+                self.export(export_format='csv', include_messages='1')
+            return len(captured)
+
+        queries(1)  # Warm the token cache
+        self.assertEqual(queries(2), queries(30))
+
+    def test_clients_export_their_own_interventions(self):
+        own = self.create_intervention()
+        other = User.objects.create_user('other', 'other@example.com', 'pw', user_type='client')
+        self.create_intervention(created_by=other)
+        response, content = self.export(self.api)
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [own.id])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'export_format': 'xml'}, {'status': 'done'}, {'created_after': 'yesterday'}):
+            self.assertEqual(self.export(**params)[0].status_code, 400)
+
+    def test_async_chunks_close_the_lines_when_abandoned(self):
+        lines = (f'{i}\n' for i in range(export.ROWS_PER_CHUNK * 3))
+
+        async def first_chunk():
+            chunks = export.async_chunks(lines)
+            chunk = await anext(chunks)
+            await chunks.aclose()
+            return chunk
+
+        self.assertEqual(len(async_to_sync(first_chunk)().splitlines()), export.ROWS_PER_CHUNK)
+        self.assertIsNone(lines.gi_frame)
+
+
+class BenchmarkApiTests(TestCase):
+    def measure(self, endpoints, *sizes):
+        dataset = Dataset(*sizes)
+        return {result['name']: result for result in
+                (BenchmarkApi().measure(endpoint, dataset, 1) for endpoint in endpoints)}
+
+    def test_every_endpoint_stays_within_its_budget(self):
+        results = self.measure(ENDPOINTS, 30, 3, 30, 3)
+        self.assertEqual(BenchmarkApi().failures(results.values()), [])
+
+    def test_collection_endpoints_run_as_many_queries_on_more_data(self):
+        collections = [endpoint for endpoint in ENDPOINTS if endpoint.collection]
+        small = self.measure(collections, 2, 2, 2, 2)
+        User.objects.all().delete()
+        large = self.measure(collections, 40, 8, 40, 4)
+        self.assertEqual({name: result['queries'] for name, result in large.items()},
+                         {name: result['queries'] for name, result in small.items()})
 
-# Create your tests here.
+    def test_growing_query_counts_fail(self):
+        result = {'name': 'interventions', 'queries': 9, 'budget': 10, 'within_budget': True,
+                  'unexpected_status': None, 'small_dataset_queries': 4, 'grows_with_data': True}
+        self.assertEqual(BenchmarkApi().failures([result]), ['interventions: 9 queries, 4 on the small dataset'])
@@ -0,0 +1,72 @@
+"""The triage queue: employees claim the next unassigned open intervention.
+
+The queue is ordered by priority (urgent first), then age. Each priority is
+probed separately with ``status='open', priority=<p>`` ordered by
+``created_at``, which is a seek on ``intervention_triage_idx``.
+
+Claims never hand the same intervention to two employees. On backends with
+``SELECT ... FOR UPDATE SKIP LOCKED`` the candidate row is locked and
+concurrent claimers skip to the next one. On the others (SQLite) the claim is
+a single conditional ``UPDATE`` that only succeeds while the row is still open
+and unassigned; a claimer that loses the race moves on to the next candidate.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import assignment, stats
+from .models import Intervention
+
+# Highest priority first
+PRIORITY_ORDER = [value for value, _ in reversed(Intervention.PRIORITY_CHOICES)]
+
+# Candidates fetched per priority on backends without SKIP LOCKED
+CANDIDATES = 10
+
+
+def queue(priority):
+    return (
+        Intervention.objects
+        .filter(status='open', priority=priority, assigned_to__isnull=True)
+        .order_by('created_at', 'id')
+    )
+
+
+def claim_next(employee):
+    """Assign the highest-priority, oldest unassigned open intervention to ``employee``.
+
+    Returns the claimed intervention, or None when the queue is empty.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        return _claim_skip_locked(employee)
+    return _claim_conditional_update(employee)
+
+
+def _claim_skip_locked(employee):
+    with transaction.atomic():
+        for priority in PRIORITY_ORDER:
+            intervention = queue(priority).select_for_update(skip_locked=True).first()
+            if intervention is not None:
+                intervention.assigned_to = employee
+                intervention.status = 'in_progress'
+                intervention.save(update_fields=['assigned_to', 'status', 'updated_at'])
+                return intervention
+    return None
+
+
+def _claim_conditional_update(employee):
+    fields = ['id', *stats.TRACKED_FIELDS, *assignment.TRACKED_FIELDS]
+    for priority in PRIORITY_ORDER:
+        for values in queue(priority).values(*dict.fromkeys(fields))[:CANDIDATES]:
+            now = timezone.now()
+            claimed = Intervention.objects.filter(
+                pk=values['id'], status='open', assigned_to__isnull=True
+            ).update(assigned_to=employee, status='in_progress', updated_at=now)
+            if not claimed:
+                continue  # Another employee got it first
+
+            # A queryset update skips the save signals: keep stats and workloads current here
+            new_values = {**values, 'status': 'in_progress', 'assigned_to_id': employee.id}
+            stats.record_change(values, new_values)
+            assignment.workloads.record_change(values, new_values)
+            return Intervention.objects.select_related('assigned_to', 'created_by').get(pk=values['id'])
+    return None
@@ -0,0 +1,95 @@
+from collections import Counter
+
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+
+from .models import Message, UnreadCounter
+
+# Interventions per UPDATE when recording a batch of messages
+CHUNK_SIZE = 200
+
+
+def message_recipient_ids(message):
+    """Participants of the message's intervention other than its author"""
+    intervention = message.intervention
+    recipient_ids = {intervention.created_by_id, intervention.assigned_to_id}
+    recipient_ids.discard(None)
+    recipient_ids.discard(message.user_id)
+    return recipient_ids
+
+
+def record_new_messages(messages):
+    """Bump the unread counters of every recipient of ``messages``"""
+    increments = Counter()
+    for message in messages:
+        for user_id in message_recipient_ids(message):
+            increments[(message.intervention_id, user_id)] += 1
+
+    # One UPDATE per increment (and chunk of interventions), which is a single query for a lone message
+    grouped = {}
+    for (intervention_id, user_id), amount in increments.items():
+        grouped.setdefault(amount, {}).setdefault(intervention_id, set()).add(user_id)
+    for amount, recipients in grouped.items():
+        items = list(recipients.items())
+        for start in range(0, len(items), CHUNK_SIZE):
+            chunk = items[start:start + CHUNK_SIZE]
+            condition = Q()
+            for intervention_id, user_ids in chunk:
+                condition |= Q(intervention_id=intervention_id, user_id__in=user_ids)
+            counters = UnreadCounter.objects.filter(condition)
+            if counters.update(count=F('count') + amount) == sum(len(user_ids) for _, user_ids in chunk):
+                continue
+            # First unread message for some of these users: create their counters
+            existing = set(counters.values_list('intervention_id', 'user_id'))
+            UnreadCounter.objects.bulk_create(
+                [
+                    UnreadCounter(intervention_id=intervention_id, user_id=user_id, count=amount)
+                    for intervention_id, user_ids in chunk
+                    for user_id in user_ids
+                    if (intervention_id, user_id) not in existing
+                ],
+                ignore_conflicts=True
+            )
+
+
+def mark_read(user, intervention_id, up_to):
+    """Move ``user``'s read watermark in the intervention up to message id ``up_to``.
+
+    Messages from others between the old and the new watermark stop counting as
+    unread for ``user`` alone. Returns how many messages that was.
+    """
+    counters = UnreadCounter.objects.filter(user=user, intervention_id=intervention_id)
+    while True:
+        watermark = counters.values_list('last_read_message_id', flat=True).first()
+        if watermark is not None and up_to <= watermark:
+            return 0
+        newly_read = (
+            Message.objects
+            .filter(intervention_id=intervention_id, id__gt=watermark or 0, id__lte=up_to)
+            .exclude(user=user)
+        )
+        marked = newly_read.count()
+        if watermark is None:
+            if not marked:
+                return 0
+            _, stored = UnreadCounter.objects.get_or_create(
+                user=user, intervention_id=intervention_id, defaults={'last_read_message_id': up_to}
+            )
+        else:
+            # Only if the watermark didn't move meanwhile, so no message is subtracted twice
+            stored = counters.filter(last_read_message_id=watermark).update(
+                last_read_message_id=up_to, count=Greatest(F('count') - marked, Value(0))
+            )
+        if stored:
+            break
+    if marked:
+        # The message's own flag means read by at least one recipient
+        newly_read.filter(is_read=False).update(is_read=True)
+    return marked
+
+
+def unread_counts(user):
+    """Return ``{intervention_id: unread count}`` for ``user`` in one query"""
+    return dict(
+        UnreadCounter.objects.filter(user=user, count__gt=0).values_list('intervention_id', 'count')
+    )
@@ -2,25 +2,78 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Q
-from .models import Intervention, Message
-from .serializers import InterventionSerializer, MessageSerializer
+from rest_framework.exceptions import ValidationError
+import datetime
+import heapq
+import itertools
+from functools import cached_property
+
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Intervention, Message, MessageArchive
+from .serializers import InterventionSerializer, InterventionListSerializer, MessageSerializer
+from .pagination import InterventionListPagination, MessageCursorPagination
+from . import archive, assignment, bulk, export, stats, triage, unread
+from chat_consumer.events import broadcast_intervention_state, broadcast_intervention_states
 
 class InterventionViewSet(viewsets.ModelViewSet):
     serializer_class = InterventionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = InterventionListPagination
+
+    def is_paginated_list(self):
+        """List requests that ask for a page (``?limit=``) get the lightweight list mode"""
+        return self.action == 'list' and self.paginator.limit_query_param in self.request.query_params
 
     def get_queryset(self):
         user = self.request.user
         if user.is_employee():
             # Employees can see all interventions
-            return Intervention.objects.all()
+            queryset = Intervention.objects.all()
         else:
             # Clients can only see their own interventions
-            return Intervention.objects.filter(created_by=user)
+            queryset = Intervention.objects.filter(created_by=user)
+        queryset = queryset.select_related('assigned_to', 'created_by')
+        if self.is_paginated_list():
+            # Stable ordering so pages don't overlap or skip rows
+            queryset = queryset.order_by('-created_at', '-id')
+        elif self.action in ('list', 'retrieve'):
+            queryset = self.with_messages(queryset)
+        return queryset
+
+    def with_messages(self, queryset):
+        # The full serializer nests every message and its author
+        return queryset.prefetch_related(Prefetch('messages', queryset=Message.objects.select_related('user')))
+
+    def get_serializer_class(self):
+        if self.is_paginated_list():
+            return InterventionListSerializer
+        return super().get_serializer_class()
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        intervention = serializer.save(created_by=self.request.user)
+        if getattr(settings, 'INTERVENTION_AUTO_ASSIGN', False):
+            employee = assignment.auto_assign(intervention)
+            if employee is not None:
+                self.announce_assignment(intervention, employee)
+
+    def announce_assignment(self, intervention, employee):
+        broadcast_intervention_state(intervention)
+        Message.objects.create(
+            intervention=intervention,
+            user=self.request.user,
+            content=f"Intervention assigned to {employee.get_full_name() or employee.username}",
+            message_type='system_message'
+        )
+
+    def perform_update(self, serializer):
+        intervention = serializer.save()
+        broadcast_intervention_state(intervention)
+        # Respond from a prefetched copy; DRF drops the saved instance's prefetch cache
+        serializer.instance = self.with_messages(self.get_queryset()).get(pk=intervention.pk)
     
     @action(detail=True, methods=['post'])
     def assign_employee(self, request, pk=None):
@@ -37,6 +90,7 @@ class InterventionViewSet(viewsets.ModelViewSet):
             intervention.assigned_to = employee
             intervention.status = 'in_progress'
             intervention.save()
+            broadcast_intervention_state(intervention)
             
             # Create a system message
             Message.objects.create(
@@ -50,6 +104,32 @@ class InterventionViewSet(viewsets.ModelViewSet):
         except User.DoesNotExist:
             return Response({'error': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    @action(detail=True, methods=['post'])
+    def auto_assign(self, request, pk=None):
+        """Assign the least loaded employee whose skills match the problem type (employees only)"""
+        if not request.user.is_employee():
+            return Response({'error': 'Only employees can assign interventions'}, status=status.HTTP_403_FORBIDDEN)
+        intervention = self.get_object()
+        if intervention.status in Intervention.RESOLVED_STATUSES:
+            return Response({'error': 'Intervention is already resolved'}, status=status.HTTP_400_BAD_REQUEST)
+
+        employee = assignment.auto_assign(intervention)
+        if employee is None:
+            return Response({'error': 'No employee available'}, status=status.HTTP_409_CONFLICT)
+        self.announce_assignment(intervention, employee)
+        return Response({'message': 'Employee assigned successfully', 'assigned_to': employee.id})
+
+    @action(detail=False, methods=['post'])
+    def claim_next(self, request):
+        """Assign the highest-priority, oldest unassigned open intervention to the caller (employees only)"""
+        if not request.user.is_employee():
+            return Response({'error': 'Only employees can claim interventions'}, status=status.HTTP_403_FORBIDDEN)
+        intervention = triage.claim_next(request.user)
+        if intervention is None:
+            return Response({'error': 'No open intervention to claim'}, status=status.HTTP_404_NOT_FOUND)
+        self.announce_assignment(intervention, request.user)
+        return Response(InterventionListSerializer(intervention).data)
+
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
         """Update intervention status"""
@@ -61,6 +141,7 @@ class InterventionViewSet(viewsets.ModelViewSet):
         
         intervention.status = new_status
         intervention.save()
+        broadcast_intervention_state(intervention)
         
         # Create a system message
         Message.objects.create(
@@ -72,13 +153,216 @@ class InterventionViewSet(viewsets.ModelViewSet):
         
         return Response({'message': 'Status updated successfully'})
 
+    def get_bulk_interventions(self, request):
+        """The interventions listed in ``ids``, all checked against the caller's queryset in one query.
+
+        Returns ``(interventions, error response)``; nothing is changed unless every id is accessible.
+        """
+        ids = request.data.get('ids')
+        limit = getattr(settings, 'INTERVENTION_BULK_MAX', 5000)
+        if not isinstance(ids, list) or not ids:
+            return None, Response({'error': 'ids must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > limit:
+            return None, Response({'error': f'At most {limit} ids per request'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = {int(pk) for pk in ids}
+        except (TypeError, ValueError):
+            return None, Response({'error': 'ids must be intervention ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        interventions = list(self.get_queryset().filter(pk__in=ids).order_by('pk'))
+        missing = ids - {intervention.pk for intervention in interventions}
+        if missing:
+            return None, Response(
+                {'error': 'Interventions not found', 'ids': sorted(missing)}, status=status.HTTP_404_NOT_FOUND
+            )
+        return interventions, None
+
+    @action(detail=False, methods=['post'])
+    def bulk_update_status(self, request):
+        """Update the status of every intervention in ``ids`` in one transaction"""
+        new_status = request.data.get('status')
+        if new_status not in dict(Intervention.STATUS_CHOICES):
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        interventions, error = self.get_bulk_interventions(request)
+        if error is not None:
+            return error
+
+        bulk.update_status(interventions, new_status, request.user)
+        broadcast_intervention_states(interventions)
+        return Response({'message': 'Status updated successfully', 'updated': len(interventions)})
+
+    @action(detail=False, methods=['post'])
+    def bulk_assign(self, request):
+        """Assign an employee to every intervention in ``ids`` in one transaction"""
+        employee_id = request.data.get('employee_id')
+        if not employee_id:
+            return Response({'error': 'employee_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            employee_id = int(employee_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'employee_id must be a user id'}, status=status.HTTP_400_BAD_REQUEST)
+        interventions, error = self.get_bulk_interventions(request)
+        if error is not None:
+            return error
+
+        from authentication.models import User
+        employee = User.objects.filter(id=employee_id, user_type__in=['employee', 'admin']).first()
+        if employee is None:
+            return Response({'error': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        bulk.assign(interventions, employee, request.user)
+        broadcast_intervention_states(interventions)
+        return Response({'message': 'Employee assigned successfully', 'updated': len(interventions)})
+
+    @action(detail=False, methods=['get'])
+    def unread_counts(self, request):
+        """Unread message counts of the current user, keyed by intervention id"""
+        return Response(unread.unread_counts(request.user))
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Dashboard statistics, maintained incrementally (employees only)"""
+        if not request.user.is_employee():
+            return Response({'error': 'Only employees can view statistics'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(stats.dashboard())
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the caller's interventions as NDJSON or CSV (``?export_format=``), optionally
+        filtered by ``status`` (comma-separated) and ``created_after`` / ``created_before``,
+        with their messages when ``include_messages`` is set"""
+        params = request.query_params
+        export_format = params.get('export_format', 'ndjson')
+        if export_format not in export.CONTENT_TYPES:
+            return Response({'error': 'export_format must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset()
+        if params.get('status'):
+            statuses = params['status'].split(',')
+            if not set(statuses) <= dict(Intervention.STATUS_CHOICES).keys():
+                return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(status__in=statuses)
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            if params.get(param):
+                moment = self.parse_moment(params[param])
+                if moment is None:
+                    return Response({'error': f'{param} must be an ISO date or datetime'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                queryset = queryset.filter(**{lookup: moment})
+
+        include_messages = params.get('include_messages', '').lower() in ('1', 'true', 'yes')
+        lines = export.export_lines(queryset, export_format, include_messages)
+        return export.streaming_response(request._request, lines, export_format, 'interventions')
+
+    @staticmethod
+    def parse_moment(value):
+        """An ISO datetime, or a date meaning its midnight, in the current time zone"""
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                if day is None:
+                    return None
+                moment = datetime.datetime.combine(day, datetime.time())
+        except ValueError:
+            return None
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = MessageCursorPagination
+
+    @property
+    def message_ordering(self):
+        # Scrolling back (?before=) walks the history newest-first
+        if self.action == 'list' and 'before' in self.request.query_params:
+            return ('-timestamp', '-id')
+        return ('timestamp', 'id')
 
     def get_queryset(self):
         intervention_id = self.kwargs['intervention_pk']
-        return Message.objects.filter(intervention_id=intervention_id).order_by('timestamp')
+        queryset = Message.objects.filter(intervention_id=intervention_id).select_related('user')
+        if self.action == 'list':
+            queryset = self.filter_by_bounds(queryset, self.anchor_bounds)
+        return queryset.order_by(*self.message_ordering)
+
+    @cached_property
+    def has_archive(self):
+        return MessageArchive.objects.filter(intervention_id=self.kwargs['intervention_pk']).exists()
+
+    @cached_property
+    def anchor_bounds(self):
+        """``?after=<id>`` / ``?before=<id>`` as ``(lookup, (timestamp, id))`` keyset bounds"""
+        bounds = []
+        for param, lookup in (('after', 'gt'), ('before', 'lt')):
+            value = self.request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                message_id = int(value)
+            except ValueError:
+                raise ValidationError({param: 'Unknown message id for this intervention'})
+            anchor = Message.objects.filter(
+                intervention_id=self.kwargs['intervention_pk'], id=message_id
+            ).values_list('timestamp', 'id').first()
+            if anchor is None and self.has_archive:
+                message = archive.find_message(self.kwargs['intervention_pk'], message_id)
+                anchor = archive.message_key(message) if message is not None else None
+            if anchor is None:
+                raise ValidationError({param: 'Unknown message id for this intervention'})
+            bounds.append((lookup, anchor))
+        return bounds
+
+    def filter_by_bounds(self, queryset, bounds):
+        for lookup, (timestamp, message_id) in bounds:
+            queryset = queryset.filter(
+                Q(**{f'timestamp__{lookup}': timestamp})
+                | Q(timestamp=timestamp, **{f'id__{lookup}': message_id})
+            )
+        return queryset
+
+    def history(self, after=None, reverse=False, limit=None):
+        """Hot and archived messages in the list's order (the other way when ``reverse``),
+        beyond the anchors and the ``(timestamp, id)`` key ``after``, at most ``limit``"""
+        descending = self.message_ordering[0].startswith('-') != reverse
+        bounds = list(self.anchor_bounds)
+        if after is not None:
+            bounds.append(('lt' if descending else 'gt', after))
+        hot = self.filter_by_bounds(
+            Message.objects.filter(intervention_id=self.kwargs['intervention_pk']).select_related('user'), bounds
+        ).order_by(*(('-timestamp', '-id') if descending else ('timestamp', 'id')))
+        if limit is not None:
+            hot = hot[:limit]
+        archived = archive.archived_messages(self.kwargs['intervention_pk'], bounds, descending, limit)
+        messages = heapq.merge(hot, archived, key=archive.message_key, reverse=descending)
+        return list(itertools.islice(messages, limit))
+
+    def list(self, request, *args, **kwargs):
+        if not self.has_archive:
+            return super().list(request, *args, **kwargs)
+
+        # Archived history is merged with what is still in the hot table, each read
+        # only as far as the page needs
+        page = self.paginator.paginate_history(self.history, request, self)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(self.history(), many=True).data)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Archived messages can be read but not changed
+            if self.action != 'retrieve':
+                raise
+            pk = self.kwargs['pk']
+            message = archive.find_message(self.kwargs['intervention_pk'], int(pk)) if pk.isdigit() else None
+            if message is None:
+                raise
+            return message
     
     def perform_create(self, serializer):
         intervention_id = self.kwargs['intervention_pk']
@@ -96,3 +380,14 @@ class MessageViewSet(viewsets.ModelViewSet):
             user=user,
             message_type=message_type
         )
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request, intervention_pk=None):
+        """Mark every message from others up to ``up_to`` (a message id) as read"""
+        try:
+            up_to = int(request.data.get('up_to'))
+        except (TypeError, ValueError):
+            return Response({'error': 'up_to must be a message id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        marked = unread.mark_read(request.user, intervention_pk, up_to)
+        return Response({'marked': marked})
@@ -0,0 +1,37 @@
+import time
+
+from channels.consumer import get_handler_name
+
+from .instruments import CONSUMER_HANDLER_SECONDS, WEBSOCKET_EVENTS
+
+
+class ConsumerMetricsMixin:
+    """Count WebSocket events and time every handler of a consumer.
+
+    List it before the consumer base class so it wraps ``dispatch`` and ``send``.
+    """
+
+    async def dispatch(self, message):
+        started = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            CONSUMER_HANDLER_SECONDS.labels(type(self).__name__, get_handler_name(message)).observe(
+                time.perf_counter() - started
+            )
+
+    async def websocket_connect(self, message):
+        WEBSOCKET_EVENTS.labels(type(self).__name__, 'connect').inc()
+        await super().websocket_connect(message)
+
+    async def websocket_receive(self, message):
+        WEBSOCKET_EVENTS.labels(type(self).__name__, 'receive').inc()
+        await super().websocket_receive(message)
+
+    async def websocket_disconnect(self, message):
+        WEBSOCKET_EVENTS.labels(type(self).__name__, 'disconnect').inc()
+        await super().websocket_disconnect(message)
+
+    async def send(self, *args, **kwargs):
+        WEBSOCKET_EVENTS.labels(type(self).__name__, 'send').inc()
+        await super().send(*args, **kwargs)
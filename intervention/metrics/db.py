@@ -0,0 +1,38 @@
+import contextvars
+import functools
+import time
+
+from channels import db
+
+from .instruments import DB_EXECUTION_SECONDS, DB_QUEUE_WAIT_SECONDS
+
+# Set by the caller just before the call is handed to the thread; the thread
+# runs in a copy of the caller's context, so it reads the same value
+_enqueued_at = contextvars.ContextVar('database_sync_to_async_enqueued_at')
+
+
+class DatabaseSyncToAsync(db.DatabaseSyncToAsync):
+    """``database_sync_to_async`` that records queue wait and execution time"""
+
+    def __init__(self, func, *args, **kwargs):
+        name = getattr(func, '__qualname__', repr(func))
+        wait = DB_QUEUE_WAIT_SECONDS.labels(name)
+        execution = DB_EXECUTION_SECONDS.labels(name)
+
+        @functools.wraps(func)
+        def timed(*func_args, **func_kwargs):
+            started = time.perf_counter()
+            wait.observe(started - _enqueued_at.get(started))
+            try:
+                return func(*func_args, **func_kwargs)
+            finally:
+                execution.observe(time.perf_counter() - started)
+
+        super().__init__(timed, *args, **kwargs)
+
+    async def __call__(self, *args, **kwargs):
+        _enqueued_at.set(time.perf_counter())
+        return await super().__call__(*args, **kwargs)
+
+
+database_sync_to_async = DatabaseSyncToAsync
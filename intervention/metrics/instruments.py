@@ -0,0 +1,74 @@
+"""The application's metrics; see ``metrics.registry`` for the primitives"""
+from channels.layers import channel_layers
+
+from .registry import Counter, Gauge, Histogram
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', "HTTP request latency by view",
+    ['view', 'method', 'status'],
+)
+
+WEBSOCKET_EVENTS = Counter(
+    'websocket_events_total', "WebSocket connects, receives, sends and disconnects by consumer",
+    ['consumer', 'event'],
+)
+
+CONSUMER_HANDLER_SECONDS = Histogram(
+    'consumer_handler_duration_seconds', "Time spent in each consumer handler method",
+    ['consumer', 'handler'],
+)
+
+DB_QUEUE_WAIT_SECONDS = Histogram(
+    'database_sync_to_async_wait_seconds', "Time a database_sync_to_async call waited for its thread",
+    ['function'],
+)
+
+DB_EXECUTION_SECONDS = Histogram(
+    'database_sync_to_async_execution_seconds', "Time a database_sync_to_async call ran in its thread",
+    ['function'],
+)
+
+GROUP_SEND_SECONDS = Histogram(
+    'channel_layer_group_send_duration_seconds', "Channel layer group_send latency by group kind",
+    ['group_kind'],
+)
+
+WEBSOCKET_THROTTLED = Counter(
+    'websocket_throttled_total', "Incoming WebSocket frames dropped by a rate limit",
+    ['consumer', 'limit'],
+)
+
+WEBSOCKET_DROPPED_FRAMES = Counter(
+    'websocket_dropped_frames_total', "Supersedable frames skipped for connections that lag behind",
+    ['consumer'],
+)
+
+WEBSOCKET_EVICTIONS = Counter(
+    'websocket_evictions_total', "Connections closed for flooding or for not reading fast enough",
+    ['consumer', 'reason'],
+)
+
+
+def group_kind(group):
+    # chat_<id> -> chat, user_<id> -> user: keeps the label set small
+    return group.split('_', 1)[0]
+
+
+def group_connections():
+    """Group members in this process's channel layers, summed by group kind.
+
+    Group names carry user and intervention ids, so they never become labels.
+    """
+    totals = {}
+    for layer in list(channel_layers.backends.values()):
+        for group, channels in list(getattr(layer, 'groups', {}).items()):
+            if channels:
+                kind = group_kind(group)
+                totals[kind] = totals.get(kind, 0) + len(channels)
+    return [((kind,), count) for kind, count in sorted(totals.items())]
+
+
+GROUP_CONNECTIONS = Gauge(
+    'channel_layer_group_connections', "Channels currently in groups, by group kind (this process)",
+    ['group_kind'], callback=group_connections,
+)
@@ -0,0 +1,26 @@
+import time
+
+from channels import layers
+
+from chat_consumer import layers as chat_layers
+
+from .instruments import GROUP_SEND_SECONDS, group_kind
+
+
+class ChannelLayerMetricsMixin:
+    """Time ``group_send``; group sizes are read from the layer at scrape time"""
+
+    async def group_send(self, group, message):
+        started = time.perf_counter()
+        try:
+            await super().group_send(group, message)
+        finally:
+            GROUP_SEND_SECONDS.labels(group_kind(group)).observe(time.perf_counter() - started)
+
+
+class InMemoryChannelLayer(ChannelLayerMetricsMixin, layers.InMemoryChannelLayer):
+    pass
+
+
+class UnixSocketChannelLayer(ChannelLayerMetricsMixin, chat_layers.UnixSocketChannelLayer):
+    pass
@@ -0,0 +1,20 @@
+import time
+
+from .instruments import HTTP_REQUEST_SECONDS
+
+
+class RequestMetricsMiddleware:
+    """Record each request's latency under its URL name (e.g. ``intervention-list``)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match else 'unresolved'
+        HTTP_REQUEST_SECONDS.labels(view, request.method, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+        return response
@@ -0,0 +1,43 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase, override_settings
+
+from authentication.models import User
+
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsEndpointTests(TestCase):
+    def test_anonymous_requests_are_refused(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    def test_scrapers_use_the_metrics_token(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', response.content.decode())
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_only_staff_users_without_a_token(self):
+        user = User.objects.create_user('client', 'client@example.com', 'pw', user_type='client')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_group_connections_are_counted_by_kind(self):
+        layer = get_channel_layer()
+        members = [('chat_41', 'one'), ('chat_42', 'two'), ('user_7', 'three')]
+        for group, channel in members:
+            async_to_sync(layer.group_add)(group, channel)
+        try:
+            body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret').content.decode()
+        finally:
+            for group, channel in members:
+                async_to_sync(layer.group_discard)(group, channel)
+
+        self.assertIn('channel_layer_group_connections{group_kind="chat"} 2', body)
+        self.assertIn('channel_layer_group_connections{group_kind="user"} 1', body)
+        self.assertNotIn('chat_41', body)
@@ -0,0 +1,22 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .registry import REGISTRY
+
+
+def authorized(request):
+    """Staff users, or a scraper presenting ``Authorization: Bearer <METRICS_TOKEN>``"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer '):
+        return hmac.compare_digest(header[len('Bearer '):].encode(), token.encode())
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics(request):
+    """This process's metrics in the Prometheus text exposition format"""
+    if not authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,48 @@
+"""Response caching and conditional GET support for the QA list.
+
+The list's state is read from the data itself: how many QA entries there are
+and when the latest of them was saved. Saves move the latter and deletes the
+former, so every worker derives the same state without sharing anything,
+whatever the cache backend. ETags, Last-Modified and the cached response
+bodies are all derived from it: after a change the old ones are never looked
+up again and expire with ``QA_LIST_CACHE_TTL``.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .models import QA
+
+
+def list_state(request):
+    """Return ``(version, last_modified)`` of the QA list, read once per request"""
+    # The conditional GET checks see the Django request, the view DRF's wrapper around it
+    request = getattr(request, '_request', request)
+    state = getattr(request, 'qa_list_state', None)
+    if state is None:
+        latest = QA.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+        last_modified = latest['updated_at']
+        version = f"{latest['count']}-{last_modified.timestamp() if last_modified else ''}"
+        state = request.qa_list_state = (version, last_modified)
+    return state
+
+
+def list_etag(request, *args, **kwargs):
+    version, _ = list_state(request)
+    # The full URI covers pagination parameters and the host used in next/previous links
+    uri = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'{version}-{uri}'
+
+
+def list_last_modified(request, *args, **kwargs):
+    return list_state(request)[1]
+
+
+def get_cached_response(request):
+    return cache.get(f'qa:list:{list_etag(request)}')
+
+
+def set_cached_response(request, data):
+    cache.set(f'qa:list:{list_etag(request)}', data, timeout=getattr(settings, 'QA_LIST_CACHE_TTL', 300))
@@ -1,3 +1,64 @@
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from authentication.models import User
+
+from .models import QA
+
+URL = '/api/qa/qa-list/'
+
+
+class QAListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('employee', 'employee@example.com', 'pw', user_type='employee')
+        self.entries = [QA.objects.create(question=f'Question {i}', answer='Answer', author=self.author) for i in range(3)]
+
+    def test_full_list_without_limit(self):
+        response = self.client.get(URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+
+    def test_limit_paginates(self):
+        data = self.client.get(URL, {'limit': 2}).json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(len(self.client.get(data['next']).json()['results']), 1)
+
+    def test_repeat_requests_are_served_from_the_cache(self):
+        self.client.get(URL)
+        # Only the list's state is read
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get(URL).json()), 3)
+
+    def test_conditional_get(self):
+        response = self.client.get(URL)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(URL, headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.client.get(URL, headers={'If-Modified-Since': last_modified}).status_code, 304)
+        # Another page has its own ETag
+        self.assertNotEqual(self.client.get(URL, {'limit': 1})['ETag'], etag)
+
+    def test_changes_invalidate_the_cache_and_etag(self):
+        etag = self.client.get(URL)['ETag']
+        QA.objects.create(question='New question', author=self.author)
+        response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+        self.entries[0].delete()
+        self.assertEqual(len(self.client.get(URL).json()), 3)
+
+        entry = self.entries[1]
+        etag = self.client.get(URL)['ETag']
+        entry.answer = 'Edited answer'
+        entry.save()
+        response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Edited answer', [item['answer'] for item in response.json()])
+
+    def test_workers_agree_on_the_etag(self):
+        etag = self.client.get(URL)['ETag']
+        # Another worker, with a cache of its own, derives the same state from the data
+        cache.clear()
+        self.assertEqual(self.client.get(URL, headers={'If-None-Match': etag}).status_code, 304)
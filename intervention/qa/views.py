@@ -1,10 +1,30 @@
+from django.views.decorators.http import condition
 from rest_framework.decorators import api_view
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from .caching import get_cached_response, list_etag, list_last_modified, set_cached_response
 from .models import QA
 from .serializers import QASerializer
 
+
+class QAPagination(LimitOffsetPagination):
+    # No default limit: requests without ?limit= keep the full, unpaginated list
+    default_limit = None
+    max_limit = 100
+
+
+# Repeat polls with If-None-Match / If-Modified-Since get a 304 before the view runs
+@condition(etag_func=list_etag, last_modified_func=list_last_modified)
 @api_view(['GET'])
 def QAListView(request):
-    qas = QA.objects.all().order_by('-created_at')
-    serializer = QASerializer(qas, many=True)
-    return Response(serializer.data)
\ No newline at end of file
+    data = get_cached_response(request)
+    if data is None:
+        qas = QA.objects.all().order_by('-created_at')
+        paginator = QAPagination()
+        page = paginator.paginate_queryset(qas, request)
+        if page is not None:
+            data = paginator.get_paginated_response(QASerializer(page, many=True).data).data
+        else:
+            data = QASerializer(qas, many=True).data
+        set_cached_response(request, data)
+    return Response(data)
@@ -0,0 +1,236 @@
+"""Full-text index over messages, interventions and QA entries.
+
+Documents live in a single raw ``search_index`` table: an FTS5 virtual table
+on SQLite, or a table with a generated, GIN-indexed ``tsvector`` on Postgres.
+Each document's id encodes its kind and primary key (``pk * 4 + kind code``)
+so updates and deletes go straight to the row. ``owner_id`` is the creator of
+the related intervention and is used to scope client searches; QA documents
+have no owner and are visible to everyone.
+"""
+import re
+
+from django.db import connection
+
+KIND_CODES = {'message': 0, 'intervention': 1, 'qa': 2}
+KINDS = {code: kind for kind, code in KIND_CODES.items()}
+KIND_SLOTS = 4
+
+TABLE = 'search_index'
+
+
+def document_id(kind, pk):
+    return pk * KIND_SLOTS + KIND_CODES[kind]
+
+
+def split_document_id(doc_id):
+    return KINDS[doc_id % KIND_SLOTS], doc_id // KIND_SLOTS
+
+
+def kind_of(obj):
+    from intervention_app.models import Intervention, Message
+    from qa.models import QA
+
+    for model, kind in ((Message, 'message'), (Intervention, 'intervention'), (QA, 'qa')):
+        if isinstance(obj, model):
+            return kind
+    raise TypeError(f"{type(obj).__name__} is not indexed")
+
+
+def document_for(obj):
+    """Return ``(id, intervention_id, owner_id, title, body)`` for an indexed model instance"""
+    kind = kind_of(obj)
+    if kind == 'message':
+        return (
+            document_id(kind, obj.pk), obj.intervention_id,
+            obj.intervention.created_by_id, '', obj.content,
+        )
+    if kind == 'intervention':
+        return (
+            document_id(kind, obj.pk), obj.pk,
+            obj.created_by_id, obj.title, obj.description or '',
+        )
+    return (document_id(kind, obj.pk), None, None, obj.question, obj.answer or '')
+
+
+class SQLiteBackend:
+    vendor = 'sqlite'
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "intervention_id UNINDEXED, owner_id UNINDEXED, title, body, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def upsert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {TABLE}(rowid, intervention_id, owner_id, title, body) VALUES (%s, %s, %s, %s, %s)",
+            documents,
+        )
+
+    def delete(self, cursor, doc_ids):
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(doc_id,) for doc_id in doc_ids])
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {TABLE}")
+
+    def match_expression(self, query):
+        # Quote every word so user input can't inject FTS5 syntax; last word matches as a prefix
+        words = re.findall(r'\w+', query)
+        if not words:
+            return None
+        terms = [f'"{word}"' for word in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def where(self, owner_id):
+        sql = f"{TABLE} MATCH %s"
+        if owner_id is not None:
+            sql += " AND (owner_id = %s OR owner_id IS NULL)"
+        return sql
+
+    def count(self, cursor, query, owner_id):
+        match = self.match_expression(query)
+        if match is None:
+            return 0
+        params = [match] + ([owner_id] if owner_id is not None else [])
+        cursor.execute(f"SELECT COUNT(*) FROM {TABLE} WHERE {self.where(owner_id)}", params)
+        return cursor.fetchone()[0]
+
+    def fetch(self, cursor, query, owner_id, offset, limit):
+        match = self.match_expression(query)
+        if match is None:
+            return []
+        params = [match] + ([owner_id] if owner_id is not None else []) + [limit, offset]
+        cursor.execute(
+            f"SELECT rowid, intervention_id, title, "
+            f"snippet({TABLE}, -1, '<mark>', '</mark>', '…', 12), "
+            f"-bm25({TABLE}, 0.0, 0.0, 4.0, 1.0) AS score "
+            f"FROM {TABLE} WHERE {self.where(owner_id)} "
+            f"ORDER BY score DESC LIMIT %s OFFSET %s",
+            params,
+        )
+        return cursor.fetchall()
+
+
+class PostgresBackend:
+    vendor = 'postgresql'
+    config = 'english'
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+            "id bigint PRIMARY KEY, intervention_id bigint NULL, owner_id bigint NULL, "
+            "title text NOT NULL DEFAULT '', body text NOT NULL DEFAULT '', "
+            f"document tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('{self.config}', title), 'A') || "
+            f"setweight(to_tsvector('{self.config}', body), 'B')) STORED)"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_document_idx ON {TABLE} USING GIN (document)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_owner_idx ON {TABLE} (owner_id)")
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def upsert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {TABLE}(id, intervention_id, owner_id, title, body) VALUES (%s, %s, %s, %s, %s) "
+            "ON CONFLICT (id) DO UPDATE SET intervention_id = EXCLUDED.intervention_id, "
+            "owner_id = EXCLUDED.owner_id, title = EXCLUDED.title, body = EXCLUDED.body",
+            documents,
+        )
+
+    def delete(self, cursor, doc_ids):
+        cursor.execute(f"DELETE FROM {TABLE} WHERE id = ANY(%s)", [list(doc_ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {TABLE}")
+
+    def where(self, owner_id):
+        sql = "document @@ q"
+        if owner_id is not None:
+            sql += " AND (owner_id = %s OR owner_id IS NULL)"
+        return sql
+
+    def count(self, cursor, query, owner_id):
+        params = [query] + ([owner_id] if owner_id is not None else [])
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {TABLE}, websearch_to_tsquery('{self.config}', %s) q "
+            f"WHERE {self.where(owner_id)}",
+            params,
+        )
+        return cursor.fetchone()[0]
+
+    def fetch(self, cursor, query, owner_id, offset, limit):
+        params = [query] + ([owner_id] if owner_id is not None else []) + [limit, offset]
+        cursor.execute(
+            f"SELECT id, intervention_id, title, "
+            f"ts_headline('{self.config}', CASE WHEN body = '' THEN title ELSE body END, q, "
+            f"'StartSel=<mark>, StopSel=</mark>, MaxWords=24, MinWords=8'), "
+            f"ts_rank_cd(document, q) AS score "
+            f"FROM {TABLE}, websearch_to_tsquery('{self.config}', %s) q "
+            f"WHERE {self.where(owner_id)} ORDER BY score DESC, id LIMIT %s OFFSET %s",
+            params,
+        )
+        return cursor.fetchall()
+
+
+BACKENDS = {backend.vendor: backend for backend in (SQLiteBackend(), PostgresBackend())}
+
+
+def get_backend(conn=None):
+    """Return the index backend for the database vendor, or ``None`` if unsupported"""
+    return BACKENDS.get((conn or connection).vendor)
+
+
+def index_objects(objs):
+    """Add or refresh the documents of ``objs``"""
+    backend = get_backend()
+    if backend is None or not objs:
+        return
+    with connection.cursor() as cursor:
+        backend.upsert(cursor, [document_for(obj) for obj in objs])
+
+
+def unindex_objects(objs):
+    backend = get_backend()
+    if backend is None or not objs:
+        return
+    with connection.cursor() as cursor:
+        backend.delete(cursor, [document_id(kind_of(obj), obj.pk) for obj in objs])
+
+
+class SearchResults:
+    """Lazy, sliceable search result set (works with DRF's LimitOffsetPagination)"""
+
+    def __init__(self, query, owner_id=None):
+        self.backend = get_backend()
+        self.query = query
+        self.owner_id = owner_id
+
+    def count(self):
+        with connection.cursor() as cursor:
+            return self.backend.count(cursor, self.query, self.owner_id)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, page):
+        offset = page.start or 0
+        with connection.cursor() as cursor:
+            rows = self.backend.fetch(cursor, self.query, self.owner_id, offset, page.stop - offset)
+        results = []
+        for doc_id, intervention_id, title, snippet, score in rows:
+            kind, pk = split_document_id(doc_id)
+            results.append({
+                'kind': kind,
+                'id': pk,
+                'intervention_id': intervention_id,
+                'title': title,
+                'snippet': snippet,
+                'score': score,
+            })
+        return results
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from intervention_app.models import Intervention, Message
+from qa.models import QA
+from search.index import document_for, get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from messages, interventions and QA entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows indexed per batch")
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if backend is None:
+            raise CommandError(f"Full-text search is not supported on {connection.vendor}")
+
+        batch_size = options['batch_size']
+        querysets = [
+            Intervention.objects.all(),
+            Message.objects.select_related('intervention'),
+            QA.objects.all(),
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            backend.clear(cursor)
+            for queryset in querysets:
+                indexed, batch = 0, []
+                for obj in queryset.iterator(chunk_size=batch_size):
+                    batch.append(document_for(obj))
+                    if len(batch) >= batch_size:
+                        backend.upsert(cursor, batch)
+                        indexed, batch = indexed + len(batch), []
+                if batch:
+                    backend.upsert(cursor, batch)
+                    indexed += len(batch)
+                self.stdout.write(f"Indexed {indexed} {queryset.model._meta.verbose_name_plural}")
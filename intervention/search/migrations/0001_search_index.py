@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# Frozen copy of the search_index DDL of search.index as of this migration, per
+# database vendor; other databases get no full-text index
+CREATE_INDEX = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "intervention_id UNINDEXED, owner_id UNINDEXED, title, body, "
+        "tokenize='unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS search_index ("
+        "id bigint PRIMARY KEY, intervention_id bigint NULL, owner_id bigint NULL, "
+        "title text NOT NULL DEFAULT '', body text NOT NULL DEFAULT '', "
+        "document tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', body), 'B')) STORED)",
+        "CREATE INDEX IF NOT EXISTS search_index_document_idx ON search_index USING GIN (document)",
+        "CREATE INDEX IF NOT EXISTS search_index_owner_idx ON search_index (owner_id)",
+    ],
+}
+DROP_INDEX = "DROP TABLE IF EXISTS search_index"
+
+
+def create_index(apps, schema_editor):
+    for statement in CREATE_INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_INDEX:
+        schema_editor.execute(DROP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intervention_app', '0007_unreadcounter'),
+        ('qa', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
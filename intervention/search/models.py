@@ -0,0 +1,2 @@
+# The search index is a backend-specific raw table (SQLite FTS5 or a Postgres
+# tsvector table), created by this app's migrations and managed by search.index.
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from intervention_app.models import Intervention, Message
+from qa.models import QA
+
+from .index import index_objects, unindex_objects
+
+
+# bulk_create skips these; the chat write-behind path indexes its batches itself
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Intervention)
+@receiver(post_save, sender=QA)
+def index_saved_object(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if sender is Intervention and update_fields and not {'title', 'description'} & set(update_fields):
+        return
+    index_objects([instance])
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=Intervention)
+@receiver(post_delete, sender=QA)
+def unindex_deleted_object(sender, instance, **kwargs):
+    unindex_objects([instance])
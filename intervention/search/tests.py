@@ -0,0 +1,67 @@
+import io
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from authentication.token_cache import token_cache
+from intervention_app.models import Intervention, Message
+from qa.models import QA
+
+from .index import document_id, split_document_id
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.client_user = User.objects.create_user('client', 'client@example.com', 'pw', user_type='client')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw', user_type='client')
+        self.employee = User.objects.create_user('employee', 'employee@example.com', 'pw', user_type='employee')
+        self.own = Intervention.objects.create(title='Printer jammed', description='Paper stuck', created_by=self.client_user)
+        self.foreign = Intervention.objects.create(title='Printer offline', description='No network', created_by=self.other)
+        self.message = Message.objects.create(intervention=self.own, user=self.client_user, content='The toner is empty')
+        self.qa = QA.objects.create(question='How do I replace the toner?', answer='Open the front cover', author=self.employee)
+
+    def search(self, user, query):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+        return api.get('/api/search/', {'q': query})
+
+    def found(self, response):
+        return {(result['kind'], result['id']) for result in response.data['results']}
+
+    def test_finds_messages_interventions_and_qa(self):
+        response = self.search(self.employee, 'toner')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.found(response), {('message', self.message.id), ('qa', self.qa.id)})
+        self.assertEqual(self.found(self.search(self.employee, 'print')),
+                         {('intervention', self.own.id), ('intervention', self.foreign.id)})
+
+    def test_clients_only_see_their_own_interventions(self):
+        self.assertEqual(self.found(self.search(self.client_user, 'printer')), {('intervention', self.own.id)})
+        self.assertEqual(self.found(self.search(self.other, 'toner')), {('qa', self.qa.id)})
+
+    def test_index_follows_updates_and_deletes(self):
+        self.message.content = 'Cartridge replaced'
+        self.message.save()
+        self.assertEqual(self.found(self.search(self.employee, 'cartridge')), {('message', self.message.id)})
+        self.assertEqual(self.found(self.search(self.employee, 'toner')), {('qa', self.qa.id)})
+
+        self.qa.delete()
+        self.assertEqual(self.found(self.search(self.employee, 'toner')), set())
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search(self.employee, 'toner" OR "x').status_code, 200)
+        self.assertEqual(self.search(self.employee, '').status_code, 400)
+
+    def test_rebuild_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM search_index')
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.found(self.search(self.employee, 'toner')), {('message', self.message.id), ('qa', self.qa.id)})
+
+    def test_document_ids_encode_kind_and_pk(self):
+        self.assertEqual(split_document_id(document_id('qa', 41)), ('qa', 41))
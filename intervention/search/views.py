@@ -0,0 +1,32 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework import status
+
+from .index import SearchResults, get_backend
+
+
+class SearchPagination(LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 100
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search(request):
+    """Ranked full-text search over messages, interventions and QA entries"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if get_backend() is None:
+        return Response(
+            {'error': 'Full-text search is not available on this database'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+
+    # Clients only see their own interventions (and the public QA entries)
+    owner_id = None if request.user.is_employee() else request.user.id
+    paginator = SearchPagination()
+    page = paginator.paginate_queryset(SearchResults(query, owner_id), request)
+    return paginator.get_paginated_response(page)